@@ -1,23 +1,15 @@
 import os
 import sys
-import threading
+import atexit
 import time
 import subprocess
 import logging
 import json
 import base64
-import qrcode
-from io import BytesIO
+import hashlib
 from datetime import datetime, timezone, timedelta
-from dateutil.relativedelta import relativedelta
 from urllib.parse import quote, unquote
-from flask import Flask, request, jsonify, render_template, send_file, url_for, Response
-import psutil
-import requests
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+from flask import Flask, request, jsonify, render_template, send_file, url_for, Response, stream_with_context, g
 # Postgres
 import psycopg2
 import psycopg2.pool
@@ -27,10 +19,28 @@ from yookassa import Configuration, Payment
 # User management
 from user_manager import UserManager
 from services.orders import OrderService, PLANS
+from services.expiry import ExpiryEngine
+from services.traffic import TrafficHistory, parse_range
+from services.admin_clients import client_row, list_clients
+from services.admin_events import AdminEventFeed, ORDERS_CHANNEL
+from services.outbox import OutboxDispatcher, OUTBOX_CHANNEL, enqueue
+from services.payments import PaymentEventProcessor, PAYMENT_EVENTS_CHANNEL, record_event
+from services.subscriptions import SubscriptionState
+from services.activity import ActivityLog
+from services.notifications import NotificationService
 from dotenv import load_dotenv
 
-from app.db import init_db_pool as _init_db_pool, get_conn as _get_conn
+from app import db as _db
+from app.db import init_db_pool as _init_db_pool, get_conn as _get_conn, get_read_conn, connect_dedicated, PoolTimeout
 from app import wg as wgmod
+from app import wgkeys
+from app.hostmetrics import HostMetricsSampler
+from app.pgnotify import get_listener
+from app.migrate import apply_migrations
+from app.metrics import METRICS
+from app.profiling import SlowRequestProfiler
+from app.qrcache import QRCache, default_cache_dir
+from app.delivery import SMTPSender, TelegramSender
 
 #
 
@@ -84,6 +94,30 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("true", "1", "yes")
+
+# -------------------
+# Outbox (очередь исходящих писем и сообщений Telegram)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+OUTBOX_BOT_TOKEN = os.getenv("BOT_TOKEN") or os.getenv("TELEGRAM_BOT_TOKEN")
+OUTBOX_EMAIL_WORKERS = int(os.getenv("OUTBOX_EMAIL_WORKERS", 2))
+OUTBOX_TELEGRAM_WORKERS = int(os.getenv("OUTBOX_TELEGRAM_WORKERS", 2))
+OUTBOX_EMAIL_RATE = float(os.getenv("OUTBOX_EMAIL_RATE", 5))
+OUTBOX_TELEGRAM_RATE = float(os.getenv("OUTBOX_TELEGRAM_RATE", 20))
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", 2))
+SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", 30))
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", 20000))
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", 2))
+ACTIVITY_LOG_RETENTION_MONTHS = int(os.getenv("ACTIVITY_LOG_RETENTION_MONTHS", 12))
+TELEGRAM_AUTH_RETENTION_MONTHS = int(os.getenv("TELEGRAM_AUTH_RETENTION_MONTHS", 1))
+NOTIFICATIONS_PAGE_SIZE = int(os.getenv("NOTIFICATIONS_PAGE_SIZE", 20))
+NOTIFICATIONS_MAX_PAGE = int(os.getenv("NOTIFICATIONS_MAX_PAGE", 100))
+NOTIFICATIONS_WAIT_TIMEOUT = float(os.getenv("NOTIFICATIONS_WAIT_TIMEOUT", 25))
+# long-poll держит поток gunicorn (--threads 8): остальным запросам должно хватать
+NOTIFICATIONS_MAX_WAITERS = int(os.getenv("NOTIFICATIONS_MAX_WAITERS", 4))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", 0))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
 
 # -------------------
 # JWT / Telegram
@@ -98,11 +132,15 @@ logger = logging.getLogger("securelink")
 
 # Ensure configs dir
 os.makedirs(CONF_DIR, exist_ok=True)
+qr_cache = QRCache(default_cache_dir(CONF_DIR))
 
 # ---------------------------
 # Postgres connection pool
 # ---------------------------
 user_manager = None
+subscriptions: SubscriptionState = None
+activity_log: ActivityLog = None
+notifications: NotificationService = None
 
 def init_db_pool():
     try:
@@ -139,11 +177,42 @@ def init_db():
         payment_method VARCHAR(50) DEFAULT 'yookassa',
         auto_renewal BOOLEAN DEFAULT FALSE
     );
+    CREATE TABLE IF NOT EXISTS ip_leases (
+        ip TEXT PRIMARY KEY,
+        leased_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    );
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        channel TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        last_error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+        sent_at TIMESTAMP WITH TIME ZONE
+    );
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(channel, next_attempt_at) WHERE status = 'pending';
+    CREATE TABLE IF NOT EXISTS payment_events (
+        payment_id TEXT PRIMARY KEY,
+        event_type TEXT,
+        payment_status TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        processed_at TIMESTAMP WITH TIME ZONE,
+        last_error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_payment_events_due ON payment_events(next_attempt_at) WHERE state = 'pending';
     """
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(create_sql)
-    logger.info("DB init (ensured orders table)")
+    logger.info("DB init (ensured orders, ip_leases, outbox and payment_events tables)")
+    # Индексы и прочие изменения схемы — версионные миграции из migrations/
+    apply_migrations(get_conn)
 
 # ---------------------------
 # WireGuard helpers
@@ -170,11 +239,26 @@ def append_peer_to_conf(public_key: str, client_ip: str):
     except Exception as e:
         logger.exception("Failed to append peer to conf: %s", e)
 
+def remove_peers_from_conf(public_keys):
+    try:
+        wgmod.remove_peers_from_conf(public_keys)
+    except Exception as e:
+        logger.exception("Failed to remove peers from conf: %s", e)
+
 def get_used_ips() -> set:
     return wgmod.get_used_ips()
 
-def get_next_free_ip() -> str:
-    return wgmod.get_next_free_ip()
+def get_next_free_ip(cur=None) -> str:
+    return wgmod.get_next_free_ip(cur)
+
+def release_ip(client_ip: str, cur=None):
+    if cur is not None:
+        # ошибка в транзакции вызывающего должна её откатить, а не потеряться
+        return wgmod.release_ip(client_ip, cur)
+    try:
+        wgmod.release_ip(client_ip)
+    except Exception as e:
+        logger.exception("Failed to release IP %s: %s", client_ip, e)
 
 def wg_gen_keypair():
     return wgmod.wg_gen_keypair()
@@ -191,171 +275,103 @@ def parse_conf(conf_path: str):
                 result["Address"] = line.split("=",1)[1].strip()
     return result
 
-# ---------------------------
-# Client config creation
-# ---------------------------
-def create_client_conf(order_id: int, email: str, plan_name: str):
-    private_key, public_key = wg_gen_keypair()
-    client_ip = get_next_free_ip()
-
-    if wg_set_peer(public_key, client_ip):
-        append_peer_to_conf(public_key, client_ip)
-        logger.info("Peer %s -> %s added for %s", public_key, client_ip, email)
-    else:
-        logger.warning("Failed to add peer for %s", email)
-
-    conf_text = (
-        f"[Interface]\nPrivateKey = {private_key}\nAddress = {client_ip}\nDNS = {DNS_ADDR}\n\n"
-        f"[Peer]\nPublicKey = {SERVER_PUBLIC_KEY}\nEndpoint = {SERVER_ENDPOINT}\nAllowedIPs = 0.0.0.0/0\n"
-        f"# Email: {email}\n# Plan: {plan_name}\n"
-    )
-
-    conf_path = os.path.join(CONF_DIR, f"wg_{order_id}.conf")
-    with open(conf_path, "w") as f:
-        f.write(conf_text)
-    os.chmod(conf_path, 0o600)
-    logger.info("Saved client config: %s", conf_path)
-    return conf_path, public_key, client_ip
-
 # ---------------------------
 # Subscriptions checker (background)
 # ---------------------------
+def remove_expired_peers(public_keys):
+    """Снимает пиров пачкой: один вызов wg и одна перезапись wg0.conf."""
+    batch = wgmod.wg_peer_batch()
+    for public_key in public_keys:
+        batch.remove_peer(public_key)
+    if not batch.apply():
+        logger.error("wg batch remove failed for %s peers", len(public_keys))
+    remove_peers_from_conf(public_keys)
+
+expiry_engine: ExpiryEngine = None
+traffic_history: TrafficHistory = None
+host_metrics = HostMetricsSampler()
+
 def check_subscriptions():
-    now = datetime.now(timezone.utc)
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, public_key, expires_at FROM orders WHERE status='paid';")
-            rows = cur.fetchall()
-            for row in rows:
-                order_id, public_key, expires_at = row
-                if not expires_at:
-                    continue
-                try:
-                    exp_dt = expires_at
-                    if isinstance(exp_dt, str):
-                        exp_dt = datetime.fromisoformat(exp_dt)
-                        if exp_dt.tzinfo is None:
-                            exp_dt = exp_dt.replace(tzinfo=timezone.utc)
-                except Exception:
-                    logger.warning("Invalid expires_at for order %s: %s", order_id, expires_at)
-                    continue
-                if now > exp_dt and public_key:
-                    if wg_remove_peer(public_key):
-                        logger.info("Peer %s removed for order %s", public_key, order_id)
-                    cur.execute("UPDATE orders SET status='expired' WHERE id=%s;", (order_id,))
-        # commit by context manager
-
-def subscription_loop():
-    while True:
-        try:
-            check_subscriptions()
-        except Exception as e:
-            logger.exception("Subscription checker error: %s", e)
-        time.sleep(10)
+    return expiry_engine.expire_due()
 
 # ---------------------------
 # Plans and order logic
 # ---------------------------
 PLANS = PLANS
 
-def calculate_expiry_extended(plan_type: str, current_expiry):
-    now = datetime.now(timezone.utc)
-    base = now
-    if current_expiry:
-        try:
-            exp_dt = current_expiry
-            if isinstance(exp_dt, str):
-                exp_dt = datetime.fromisoformat(exp_dt)
-                if exp_dt.tzinfo is None:
-                    exp_dt = exp_dt.replace(tzinfo=timezone.utc)
-            if exp_dt > now:
-                base = exp_dt
-        except Exception:
-            pass
-    if plan_type == "month1":
-        return (base + relativedelta(months=1)).isoformat()
-    elif plan_type == "month6":
-        return (base + relativedelta(months=6)).isoformat()
-    elif plan_type == "year":
-        return (base + relativedelta(years=1)).isoformat()
-    return base.isoformat()
+calculate_expiry_extended = OrderService.calculate_expiry_extended
 
 order_service: OrderService = None
 
 def create_order_internal(email: str, plan_id: int, user_id: int = None, telegram_id: int = None):
     return order_service.create_order_internal(email, plan_id, user_id=user_id, telegram_id=telegram_id)
 
+def process_payment(cur, payment: dict):
+    """Применяет оплату из payment_events в транзакции обработчика (ровно один раз на платёж)"""
+    metadata = payment.get("metadata") or {}
+    email = metadata.get("email")
+    plan_id = metadata.get("plan_id")
+    if not email or not plan_id:
+        logger.warning("Payment %s without email/plan_id in metadata, nothing to apply", payment.get("id"))
+        return
+    order_id, plan_name, _ = order_service.apply_payment(cur, email, int(plan_id))
+    # Авторассылка в Telegram, если к заказу привязан telegram_id
+    cur.execute("SELECT conf_file, telegram_id FROM orders WHERE id=%s;", (order_id,))
+    conf_file, telegram_id = cur.fetchone()
+    if OUTBOX_BOT_TOKEN and telegram_id and conf_file and os.path.exists(conf_file):
+        send_telegram_doc_and_qr(cur, int(telegram_id), conf_file, plan_name, order_id)
+
 # ---------------------------
 # Flask app & routes
 # ---------------------------
 app = Flask(__name__)
-def send_telegram_doc_and_qr(bot_token: str, chat_id: int, conf_file: str, plan_name: str):
-    try:
-        api = f"https://api.telegram.org/bot{bot_token}"
-        caption = f"Тариф: {plan_name}\nИнструкция: установите WireGuard, импортируйте файл, включите."
-        # sendDocument
-        with open(conf_file, 'rb') as f:
-            files = {"document": (os.path.basename(conf_file), f, "text/plain")}
-            data = {"chat_id": str(chat_id), "caption": caption}
-            requests.post(f"{api}/sendDocument", data=data, files=files, timeout=20)
-        # sendPhoto (QR)
-        with open(conf_file, 'r') as f:
-            conf_text = f.read()
-        buf = BytesIO()
-        qrcode.make(conf_text).save(buf, "PNG")
-        buf.seek(0)
-        files = {"photo": (f"securelink_{chat_id}.png", buf, "image/png")}
-        data = {"chat_id": str(chat_id), "caption": "QR для импорта"}
-        requests.post(f"{api}/sendPhoto", data=data, files=files, timeout=20)
-    except Exception:
-        logger.exception("Failed to send to Telegram via HTTP API")
+def send_telegram_doc_and_qr(cur, chat_id: int, conf_file: str, plan_name: str, order_id: int):
+    """Ставит в outbox конфиг и QR для Telegram (в транзакции вызывающего)"""
+    caption = f"Тариф: {plan_name}\nИнструкция: установите WireGuard, импортируйте файл, включите."
+    enqueue(cur, "telegram", {"method": "sendDocument", "chat_id": chat_id, "conf_file": conf_file, "caption": caption})
+    enqueue(cur, "telegram", {
+        "method": "sendPhoto", "chat_id": chat_id, "conf_file": conf_file, "order_id": order_id, "caption": "QR для импорта",
+    })
 app.config["CONF_DIR"] = CONF_DIR
 
 # ProxyFix if behind nginx
 from werkzeug.middleware.proxy_fix import ProxyFix
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
 
+# Instrumentation: latency histogram per route template, stacks of slow requests
+profiler = SlowRequestProfiler(slow_ms=PROFILE_SLOW_MS, interval_ms=PROFILE_INTERVAL_MS)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    profiler.begin()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        METRICS.observe(
+            "http_request_duration_seconds", elapsed,
+            route=route, method=request.method, status=response.status_code,
+        )
+        profiler.end(route, elapsed)
+    return response
+
+@app.errorhandler(PoolTimeout)
+def pool_exhausted(e):
+    """Все соединения заняты дольше DB_POOL_TIMEOUT — отвечаем 503, а не висим"""
+    logger.warning("DB pool exhausted on %s: %s", request.path, e)
+    response = jsonify({"error": "Сервис перегружен, повторите позже"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
 # Helper: send email with conf attachment
-def send_conf_email(to_email, conf_path, expires_at=None):
-    try:
-        subject = "SecureLink — Ваша WireGuard конфигурация"
-        body = "Здравствуйте!\n\nВ приложении находится ваш новый конфигурационный файл WireGuard."
-
-        if expires_at:
-            dt_utc = expires_at
-            if isinstance(dt_utc, str):
-                dt_utc = datetime.fromisoformat(dt_utc)
-            if dt_utc.tzinfo is None:
-                dt_utc = dt_utc.replace(tzinfo=timezone.utc)
-            # локализуем в МСК
-            try:
-                from zoneinfo import ZoneInfo
-                dt_local = dt_utc.astimezone(ZoneInfo("Europe/Moscow"))
-            except Exception:
-                dt_local = dt_utc
-            body += f"\n\nСрок действия вашей подписки (МСК) до: {dt_local.strftime('%Y-%m-%d %H:%M:%S')}"
-
-        body += "\n\nПриятного пользования!"
-
-        msg = MIMEMultipart()
-        msg['From'] = FROM_EMAIL
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
-
-        with open(conf_path, "rb") as f:
-            part = MIMEApplication(f.read(), Name=os.path.basename(conf_path))
-        part['Content-Disposition'] = f'attachment; filename="{os.path.basename(conf_path)}"'
-        msg.attach(part)
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.sendmail(FROM_EMAIL, to_email, msg.as_string())
-
-        logger.info("Конфиг отправлен на почту: %s", to_email)
-    except Exception as e:
-        logger.exception("Ошибка при отправке конфигурации на почту: %s", e)
+def send_conf_email(cur, to_email, conf_path, expires_at=None):
+    """Ставит письмо с конфигом в outbox (в транзакции вызывающего); отправляет OutboxDispatcher"""
+    enqueue(cur, "email", {"to": to_email, "conf_path": conf_path, "expires_at": expires_at})
 
 # Basic auth for admin
 def check_auth(username, password):
@@ -397,6 +413,35 @@ def get_current_user_id():
         return request.current_user['user_id']
     return None
 
+def user_profile(user_data):
+    """Пользователь для /auth/me и /api/user/bootstrap"""
+    return {
+        "id": user_data['id'],
+        "username": user_data['username'],
+        "first_name": user_data['first_name'],
+        "last_name": user_data['last_name'],
+        "email": user_data['email'],
+        "language_code": user_data['language_code'],
+        "created_at": user_data['created_at'],
+        "last_login": user_data['last_login'],
+        "settings": user_data['settings']
+    }
+
+def config_from_order(order):
+    """Заказ с conf_file в виде элемента /api/user/configs"""
+    # Проверяем существование файла
+    has_file = os.path.exists(order["conf_file"]) if order["conf_file"] else False
+    return {
+        "id": order["id"],
+        "plan": order["plan"],
+        "created_at": order["created_at"].isoformat() if order["created_at"] else None,
+        "expires_at": order["expires_at"].isoformat() if order["expires_at"] else None,
+        "status": order["status"],
+        "has_file": has_file,
+        "download_url": url_for("download", order_id=order["id"]) if has_file else None,
+        "qr_url": url_for("qr", order_id=order["id"]) if has_file else None
+    }
+
 # Routes (kept logic similar to original)
 @app.route("/")
 def index():
@@ -434,24 +479,22 @@ def telegram_auth():
         if not TELEGRAM_BOT_TOKEN:
             return jsonify({"error": "Telegram Bot не настроен"}), 500
         
-        # Валидация данных от Telegram
-        if not user_manager.validate_telegram_data(init_data, TELEGRAM_BOT_TOKEN):
+        # Валидация подписи, возраста и повтора; разбор initData — один раз
+        fields = user_manager.verify_telegram_init_data(init_data, TELEGRAM_BOT_TOKEN)
+        if not fields:
             return jsonify({"error": "Недействительные данные от Telegram"}), 400
         
-        # Парсинг данных пользователя
-        telegram_user = user_manager.parse_telegram_user_data(init_data)
-        if not telegram_user:
+        telegram_user = fields.get("user")
+        if not telegram_user or not telegram_user.get("id"):
             return jsonify({"error": "Не удалось получить данные пользователя"}), 400
         
-        # Получение или создание пользователя
-        user_data = user_manager.get_or_create_telegram_user(telegram_user)
+        # Пользователь и сессия — одна транзакция; лог входа пишется пачкой в фоне
+        user_data, token = user_manager.login_telegram(telegram_user)
         if not user_data:
             return jsonify({"error": "Ошибка создания пользователя"}), 500
-        
-        # Создание JWT токена
-        token = user_manager.create_jwt_token(user_data['id'])
         if not token:
-            return jsonify({"error": "Ошибка создания токена"}), 500
+            return jsonify({"error": "Пользователь заблокирован"}), 403
+        activity_log.telegram_auth(user_data['id'], fields)
         
         return jsonify({
             "token": token,
@@ -496,19 +539,7 @@ def get_current_user():
         if not user_data:
             return jsonify({"error": "Пользователь не найден"}), 404
         
-        return jsonify({
-            "user": {
-                "id": user_data['id'],
-                "username": user_data['username'],
-                "first_name": user_data['first_name'],
-                "last_name": user_data['last_name'],
-                "email": user_data['email'],
-                "language_code": user_data['language_code'],
-                "created_at": user_data['created_at'],
-                "last_login": user_data['last_login'],
-                "settings": user_data['settings']
-            }
-        })
+        return jsonify({"user": user_profile(user_data)})
         
     except Exception as e:
         logger.exception("Ошибка получения данных пользователя: %s", e)
@@ -535,6 +566,43 @@ def get_user_subscriptions():
         logger.exception("Ошибка получения подписок: %s", e)
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+@app.route("/api/user/bootstrap", methods=["GET"])
+@require_user_auth
+def get_user_bootstrap():
+    """
+    Первая отрисовка кабинета одним запросом: пользователь, подписки, конфиги
+    и первая страница уведомлений (как /auth/me, /api/user/subscriptions,
+    /api/user/configs и /api/user/notifications) — одно соединение с БД.
+    
+    Сильный ETag — sha256 тела: повторный заход с If-None-Match получает 304.
+    Живые счётчики wg сюда не входят (ETag менялся бы каждую секунду) —
+    их дашборд берёт из /api/user/traffic параллельно.
+    """
+    try:
+        data = user_manager.get_dashboard(get_current_user_id(), notifications, NOTIFICATIONS_PAGE_SIZE)
+        if not data:
+            return jsonify({"error": "Пользователь не найден"}), 404
+        
+        subscriptions = [user_manager.subscription_from_order(order) for order in data["orders"]]
+        configs = [config_from_order(order) for order in data["orders"] if order["conf_file"]]
+        resp = jsonify({
+            "user": user_profile(data["user"]),
+            "subscriptions": subscriptions,
+            "configs": configs,
+            "notifications": data["notifications"]
+        })
+        
+    except Exception as e:
+        logger.exception("Ошибка загрузки кабинета: %s", e)
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+    
+    digest = hashlib.sha256(resp.get_data()).hexdigest()
+    if request.if_none_match.contains(digest):
+        resp = Response(status=304)
+    resp.set_etag(digest)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
 @app.route("/api/user/traffic", methods=["GET"])
 @require_user_auth
 def get_user_traffic():
@@ -542,48 +610,24 @@ def get_user_traffic():
     try:
         user_id = get_current_user_id()
         
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                # Получаем активные подписки пользователя
-                cur.execute("""
-                    SELECT public_key, client_ip, plan, expires_at
-                    FROM orders 
-                    WHERE user_id = %s AND status = 'paid'
-                    ORDER BY created_at DESC
-                """, (user_id,))
-                
-                traffic_data = []
-                wg_stats = get_wg_stats()
-                
-                for row in cur.fetchall():
-                    public_key, client_ip, plan, expires_at = row
-                    stats = wg_stats.get(public_key, {})
-                    
-                    # Проверяем, не истекла ли подписка
-                    is_expired = False
-                    if expires_at:
-                        try:
-                            exp_dt = expires_at
-                            if isinstance(exp_dt, str):
-                                exp_dt = datetime.fromisoformat(exp_dt)
-                                if exp_dt.tzinfo is None:
-                                    exp_dt = exp_dt.replace(tzinfo=timezone.utc)
-                            is_expired = datetime.now(timezone.utc) > exp_dt
-                        except Exception:
-                            pass
-                    
-                    traffic_data.append({
-                        "client_ip": client_ip,
-                        "plan": plan,
-                        "rx_bytes": stats.get("rx_bytes", 0),
-                        "tx_bytes": stats.get("tx_bytes", 0),
-                        "speed_rx": stats.get("speed_rx", 0),
-                        "speed_tx": stats.get("speed_tx", 0),
-                        "online": (time.time() - stats.get("last_seen", 0)) < 60 if stats.get("last_seen") else False,
-                        "last_seen": stats.get("last_seen", 0),
-                        "expires_at": expires_at.isoformat() if expires_at else None,
-                        "is_expired": is_expired
-                    })
+        traffic_data = []
+        wg_stats = get_wg_stats()
+        for sub in subscriptions.for_user(user_id):
+            if sub["status"] != "paid":
+                continue
+            stats = wg_stats.get(sub["public_key"], {})
+            traffic_data.append({
+                "client_ip": sub["client_ip"],
+                "plan": sub["plan"],
+                "rx_bytes": stats.get("rx_bytes", 0),
+                "tx_bytes": stats.get("tx_bytes", 0),
+                "speed_rx": stats.get("speed_rx", 0),
+                "speed_tx": stats.get("speed_tx", 0),
+                "online": (time.time() - stats.get("last_seen", 0)) < 60 if stats.get("last_seen") else False,
+                "last_seen": stats.get("last_seen", 0),
+                "expires_at": sub["expires_at"].isoformat() if sub["expires_at"] else None,
+                "is_expired": sub["is_expired"]
+            })
         
         return jsonify({
             "traffic": traffic_data,
@@ -595,6 +639,22 @@ def get_user_traffic():
         logger.exception("Ошибка получения статистики трафика: %s", e)
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+@app.route("/api/user/traffic/history", methods=["GET"])
+@require_user_auth
+def get_user_traffic_history():
+    """История трафика пользователя: ?period=today|week|month или ?from=&to=, опц. &resolution="""
+    try:
+        start, end = parse_range(request.args)
+        return jsonify(traffic_history.query(
+            start=start,
+            end=end,
+            user_id=get_current_user_id(),
+            resolution=request.args.get("resolution", type=int),
+        ))
+    except Exception as e:
+        logger.exception("Ошибка получения истории трафика: %s", e)
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
 @app.route("/api/user/configs", methods=["GET"])
 @require_user_auth
 def get_user_configs():
@@ -602,7 +662,7 @@ def get_user_configs():
     try:
         user_id = get_current_user_id()
         
-        with get_conn() as conn:
+        with get_read_conn(f"user:{user_id}") as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT id, plan, conf_file, created_at, expires_at, status
@@ -611,23 +671,8 @@ def get_user_configs():
                     ORDER BY created_at DESC
                 """, (user_id,))
                 
-                configs = []
-                for row in cur.fetchall():
-                    order_id, plan, conf_file, created_at, expires_at, status = row
-                    
-                    # Проверяем существование файла
-                    has_file = os.path.exists(conf_file) if conf_file else False
-                    
-                    configs.append({
-                        "id": order_id,
-                        "plan": plan,
-                        "created_at": created_at.isoformat() if created_at else None,
-                        "expires_at": expires_at.isoformat() if expires_at else None,
-                        "status": status,
-                        "has_file": has_file,
-                        "download_url": url_for("download", order_id=order_id) if has_file else None,
-                        "qr_url": url_for("qr", order_id=order_id) if has_file else None
-                    })
+                fields = [d[0] for d in cur.description]
+                configs = [config_from_order(dict(zip(fields, row))) for row in cur.fetchall()]
         
         return jsonify({
             "configs": configs,
@@ -641,65 +686,71 @@ def get_user_configs():
 @app.route("/api/user/notifications", methods=["GET"])
 @require_user_auth
 def get_user_notifications():
-    """Получение уведомлений пользователя"""
+    """Лента уведомлений: ?limit= и ?before=<id> (курсор next_before предыдущей страницы)"""
     try:
-        user_id = get_current_user_id()
-        
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, type, title, message, is_read, created_at, read_at
-                    FROM user_notifications 
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT 50
-                """, (user_id,))
-                
-                notifications = []
-                for row in cur.fetchall():
-                    notifications.append({
-                        "id": row[0],
-                        "type": row[1],
-                        "title": row[2],
-                        "message": row[3],
-                        "is_read": row[4],
-                        "created_at": row[5].isoformat() if row[5] else None,
-                        "read_at": row[6].isoformat() if row[6] else None
-                    })
-        
-        return jsonify({
-            "notifications": notifications,
-            "unread_count": sum(1 for n in notifications if not n["is_read"])
-        })
+        limit = min(max(request.args.get("limit", NOTIFICATIONS_PAGE_SIZE, type=int), 1), NOTIFICATIONS_MAX_PAGE)
+        return jsonify(notifications.page(
+            get_current_user_id(),
+            before=request.args.get("before", type=int),
+            limit=limit,
+        ))
         
     except Exception as e:
         logger.exception("Ошибка получения уведомлений: %s", e)
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+@app.route("/api/user/notifications/wait", methods=["GET"])
+@require_user_auth
+def wait_user_notifications():
+    """
+    Long-poll: ?after=<последний виденный id>[&unread=<счётчик клиента>][&timeout=]
+    
+    Отвечает, как только придёт новое уведомление или изменится счётчик,
+    иначе через timeout (не больше NOTIFICATIONS_WAIT_TIMEOUT) с changed=false.
+    """
+    try:
+        timeout = min(max(request.args.get("timeout", NOTIFICATIONS_WAIT_TIMEOUT, type=float), 0), NOTIFICATIONS_WAIT_TIMEOUT)
+        return jsonify(notifications.wait(
+            get_current_user_id(),
+            after=request.args.get("after", 0, type=int),
+            unread=request.args.get("unread", type=int),
+            timeout=timeout,
+            limit=NOTIFICATIONS_MAX_PAGE,
+        ))
+        
+    except Exception as e:
+        logger.exception("Ошибка ожидания уведомлений: %s", e)
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
 @app.route("/api/user/notifications/<int:notification_id>/read", methods=["POST"])
 @require_user_auth
 def mark_notification_read(notification_id):
     """Отметить уведомление как прочитанное"""
     try:
-        user_id = get_current_user_id()
+        unread = notifications.mark_read(get_current_user_id(), notification_id)
+        if unread is None:
+            return jsonify({"error": "Уведомление не найдено"}), 404
         
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE user_notifications 
-                    SET is_read = TRUE, read_at = %s
-                    WHERE id = %s AND user_id = %s
-                """, (datetime.now(timezone.utc), notification_id, user_id))
-                
-                if cur.rowcount == 0:
-                    return jsonify({"error": "Уведомление не найдено"}), 404
-        
-        return jsonify({"message": "Уведомление отмечено как прочитанное"})
+        return jsonify({"message": "Уведомление отмечено как прочитанное", "unread_count": unread})
         
     except Exception as e:
         logger.exception("Ошибка обновления уведомления: %s", e)
         return jsonify({"error": "Внутренняя ошибка сервера"}), 500
 
+@app.route("/api/user/notifications/read-all", methods=["POST"])
+@require_user_auth
+def mark_all_notifications_read():
+    """Отметить все уведомления прочитанными; {"up_to": id} — только виденные клиентом"""
+    try:
+        up_to = (request.get_json(silent=True) or {}).get("up_to")
+        if up_to is not None and not isinstance(up_to, int):
+            return jsonify({"error": "Неверный up_to"}), 400
+        return jsonify(notifications.mark_all_read(get_current_user_id(), up_to=up_to))
+        
+    except Exception as e:
+        logger.exception("Ошибка обновления уведомлений: %s", e)
+        return jsonify({"error": "Внутренняя ошибка сервера"}), 500
+
 @app.route("/create-order", methods=["POST"])
 def create_order():
     data = request.json or {}
@@ -752,38 +803,33 @@ def qr(order_id):
         with conn.cursor() as cur:
             cur.execute("SELECT conf_file FROM orders WHERE id=%s;", (order_id,))
             row = cur.fetchone()
-            if not row or not row[0] or not os.path.exists(row[0]):
-                return "Конфиг не найден", 404
-            conf_text = open(row[0]).read()
-    buf = BytesIO()
-    qrcode.make(conf_text).save(buf, "PNG")
-    buf.seek(0)
-    return send_file(buf, mimetype="image/png")
+    conf_file = row[0] if row else None
+    digest = qr_cache.digest_for_file(order_id, conf_file) if conf_file else None
+    if digest is None:
+        return "Конфиг не найден", 404
+    # Повторные запросы дашборда получают 304 без чтения PNG
+    if request.if_none_match.contains(digest):
+        resp = Response(status=304)
+    else:
+        cached = qr_cache.get_for_file(order_id, conf_file)
+        if cached is None:
+            return "Конфиг не найден", 404
+        png, digest = cached
+        resp = Response(png, mimetype="image/png")
+    resp.set_etag(digest)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
 
 @app.route("/check-subscription", methods=["POST"])
 def check_subscription():
     email = (request.json or {}).get("email")
     if not email:
         return jsonify({"error": "Email не указан"}), 400
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT status, expires_at FROM orders WHERE email=%s ORDER BY id DESC LIMIT 1;", (email,))
-            row = cur.fetchone()
-            if not row:
-                return jsonify({"status": "не найдена"}), 200
-            status, expires_at = row
-            if expires_at:
-                try:
-                    exp_dt = expires_at
-                    if isinstance(exp_dt, str):
-                        exp_dt = datetime.fromisoformat(exp_dt)
-                        if exp_dt.tzinfo is None:
-                            exp_dt = exp_dt.replace(tzinfo=timezone.utc)
-                    if datetime.now(timezone.utc) > exp_dt:
-                        status = "истекла"
-                except Exception:
-                    pass
-    return jsonify({"status": status, "expires_at": expires_at})
+    # из кеша SubscriptionState; сбрасывается триггером orders_changed
+    order = subscriptions.latest_by_email(email)
+    if not order:
+        return jsonify({"status": "не найдена"}), 200
+    return jsonify({"status": order["effective_status"], "expires_at": order["expires_at"]})
 
 # Yookassa integration
 @app.route("/create-payment", methods=["POST"])
@@ -804,13 +850,14 @@ def create_payment():
         # Передаём plan_id и phone (в нашем поле email) для последующей выдачи конфига
         return_url = f"https://t.me/{os.environ.get('BOT_USERNAME','Securelinkvpn_bot')}?start=paid_{plan_id}_{quote(email)}"
 
-        payment = Payment.create({
-            "amount": {"value": f"{price:.2f}", "currency": "RUB"},
-            "confirmation": {"type": "redirect", "return_url": return_url},
-            "capture": True,
-            "description": f"Оплата тарифа {plan_name} для {email}",
-            "metadata": {"email": email, "plan_id": plan_id},
-        })
+        with METRICS.timer("outbound_duration_seconds", target="yookassa", op="payment_create"):
+            payment = Payment.create({
+                "amount": {"value": f"{price:.2f}", "currency": "RUB"},
+                "confirmation": {"type": "redirect", "return_url": return_url},
+                "capture": True,
+                "description": f"Оплата тарифа {plan_name} для {email}",
+                "metadata": {"email": email, "plan_id": plan_id},
+            })
 
         logger.info("Created payment: %s", payment.id)
         return jsonify({"confirmation_url": payment.confirmation.confirmation_url})
@@ -842,40 +889,19 @@ def bot_link_email():
 @app.route("/yookassa-webhook", methods=["POST"])
 def yookassa_webhook():
     try:
-        event = request.json
+        event = request.get_json(silent=True)
         logger.info("Webhook received: %s", event)
 
-        if not event or "object" not in event:
+        # битое событие — 400, иначе ЮKassa повторяла бы его доставку после 500
+        if not isinstance(event, dict) or not isinstance(event.get("object"), dict) or not event["object"].get("id"):
             return jsonify({"error": "Неверный формат"}), 400
 
-        payment = event["object"]
-        if payment.get("status") == "succeeded":
-            email = payment.get("metadata", {}).get("email")
-            plan_id = payment.get("metadata", {}).get("plan_id")
-            if email and plan_id:
-                try:
-                    plan_id = int(plan_id)
-                    token, err = create_order_internal(email, plan_id)
-                    if err:
-                        logger.error("Ошибка при создании заказа из webhook: %s", err)
-                    # Авторассылка в Telegram, если к заказу привязан telegram_id
-                    try:
-                        with get_conn() as conn:
-                            with conn.cursor() as cur:
-                                cur.execute(
-                                    "SELECT id, conf_file, telegram_id, plan FROM orders WHERE email=%s AND status='paid' ORDER BY id DESC LIMIT 1;",
-                                    (email,)
-                                )
-                                row = cur.fetchone()
-                                if row:
-                                    order_id, conf_file, telegram_id, plan_name = row
-                                    bot_token = os.environ.get("BOT_TOKEN") or os.environ.get("TELEGRAM_BOT_TOKEN")
-                                    if bot_token and telegram_id and conf_file and os.path.exists(conf_file):
-                                        send_telegram_doc_and_qr(bot_token, int(telegram_id), conf_file, plan_name)
-                    except Exception:
-                        logger.exception("Failed to auto-send config to Telegram")
-                except Exception:
-                    logger.exception("Ошибка обработки webhook")
+        # Только фиксируем событие: заказ продлевает PaymentEventProcessor,
+        # повторные доставки того же платежа отбрасываются по первичному ключу
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                if not record_event(cur, event):
+                    logger.info("Duplicate webhook for payment %s", event["object"]["id"])
         return jsonify({"status": "ok"})
     except Exception:
         logger.exception("Ошибка в webhook")
@@ -956,94 +982,153 @@ def admin_dashboard():
 @app.route("/admin/stats")
 @requires_auth
 def admin_stats():
-    cpu = psutil.cpu_percent(interval=0.5)
-    ram = psutil.virtual_memory().percent
-    disk = psutil.disk_usage("/").percent
-
+    """Полная выгрузка (совместимость); админка использует /admin/host-metrics и /admin/clients"""
     wg_stats = get_wg_stats()
     now_ts = time.time()
-    clients = []
-    with get_conn() as conn:
+    with get_read_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT email, public_key, client_ip, plan, created_at, expires_at FROM orders WHERE status='paid';")
-            for row in cur.fetchall():
-                email, pubkey, ip, plan, created, expires = row
-                rx = wg_stats.get(pubkey, {}).get("rx_bytes", 0)
-                tx = wg_stats.get(pubkey, {}).get("tx_bytes", 0)
-                speed_rx = wg_stats.get(pubkey, {}).get("speed_rx", 0)
-                speed_tx = wg_stats.get(pubkey, {}).get("speed_tx", 0)
-                last_seen = wg_stats.get(pubkey, {}).get("last_seen", 0)
-                online = (now_ts - last_seen) < 60
-                clients.append({
-                    "email": email,
-                    "public_key": pubkey,
-                    "client_ip": ip,
-                    "plan": plan,
-                    "rx_bytes": rx,
-                    "tx_bytes": tx,
-                    "speed_rx": speed_rx,
-                    "speed_tx": speed_tx,
-                    "online": online,
-                    "last_seen": last_seen,
-                    "start_date": created,
-                    "end_date": expires
-                })
+            cur.execute("SELECT id, email, public_key, client_ip, plan, created_at, expires_at FROM orders WHERE status='paid';")
+            clients = [client_row(row, wg_stats, now_ts) for row in cur.fetchall()]
+    return jsonify({**host_metrics.snapshot(), "clients": clients})
+
+@app.route("/admin/stream")
+@requires_auth
+def admin_stream():
+    """SSE: только изменившиеся пиры, заказы и метрики хоста; id события — для досылки после разрыва"""
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    return Response(
+        stream_with_context(admin_events.stream(last_event_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/admin/host-metrics")
+@requires_auth
+def admin_host_metrics():
+    return jsonify(host_metrics.snapshot())
+
+@app.route("/admin/clients")
+@requires_auth
+def admin_clients():
+    """?limit=&cursor=&sort=id|email|created_at|expires_at&order=asc|desc&q=&online=1"""
+    try:
+        page = list_clients(
+            get_read_conn,
+            get_wg_stats(),
+            limit=request.args.get("limit", 50, type=int),
+            cursor=request.args.get("cursor") or None,
+            sort=request.args.get("sort", "id"),
+            order=request.args.get("order", "desc"),
+            q=request.args.get("q", ""),
+            online_only=request.args.get("online") in ("1", "true"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(page)
+
+@app.route("/admin/outbox")
+@requires_auth
+def admin_outbox():
+    return jsonify(outbox.stats())
+
+@app.route("/admin/payments")
+@requires_auth
+def admin_payments():
+    return jsonify(payment_processor.stats())
+
+@app.route("/admin/db-pool")
+@requires_auth
+def admin_db_pool():
+    """Состояние пула соединений этого воркера (сводка по всем — в /metrics)"""
+    return jsonify({"pid": os.getpid(), **_db.POOL.stats(), "reads": _db.READS.stats()})
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus: гистограммы всех воркеров gunicorn"""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Unauthorized", 401)
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/profiling", methods=["GET", "POST"])
+@requires_auth
+def admin_profiling():
+    """GET — настройки и последние профили; POST {"slow_ms": 500} — включить, {"slow_ms": 0} — выключить"""
+    if request.method == "POST":
+        data = request.json or {}
+        try:
+            settings = profiler.configure(float(data.get("slow_ms", 0)), data.get("interval_ms") and float(data["interval_ms"]))
+        except (TypeError, ValueError):
+            return jsonify({"error": "slow_ms и interval_ms должны быть числами"}), 400
+    else:
+        settings = profiler.settings()
+    try:
+        profiles = sorted(p for p in os.listdir(profiler.profile_dir) if p.endswith(".folded"))[-50:]
+    except FileNotFoundError:
+        profiles = []
+    return jsonify({**settings, "profiles": profiles[::-1]})
+
+@app.route("/admin/profiling/<name>")
+@requires_auth
+def admin_profile_download(name):
+    path = os.path.join(profiler.profile_dir, os.path.basename(name))
+    if not name.endswith(".folded") or not os.path.exists(path):
+        return jsonify({"error": "not found"}), 404
+    return send_file(path, mimetype="text/plain", as_attachment=True, download_name=os.path.basename(name))
+
+@app.route("/admin/cache-stats")
+@requires_auth
+def admin_cache_stats():
     return jsonify({
-        "cpu_percent": cpu,
-        "ram_percent": ram,
-        "disk_percent": disk,
-        "clients": clients
+        "sessions": user_manager.session_cache.stats(),
+        "subscriptions": subscriptions.stats(),
+        "activity_log": activity_log.stats(),
+        "notification_waiters": notifications.stats(),
     })
 
+@app.route("/admin/traffic/history")
+@requires_auth
+def admin_traffic_history():
+    """История трафика по всем клиентам или по одному (?public_key=)"""
+    start, end = parse_range(request.args)
+    return jsonify(traffic_history.query(
+        start=start,
+        end=end,
+        public_key=request.args.get("public_key") or None,
+        resolution=request.args.get("resolution", type=int),
+    ))
+
 @app.route("/admin/delete/<path:public_key>", methods=["POST"])
 @requires_auth
 def delete_client(public_key):
     try:
         public_key = unquote(public_key)
+        client_ip = None
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT conf_file FROM orders WHERE public_key=%s LIMIT 1;", (public_key,))
+                cur.execute("SELECT id, conf_file, client_ip FROM orders WHERE public_key=%s LIMIT 1;", (public_key,))
                 row = cur.fetchone()
                 if row:
-                    conf_file = row[0]
+                    order_id, conf_file, client_ip = row
                     wg_remove_peer(public_key)
+                    remove_peers_from_conf([public_key])
                     if conf_file and os.path.exists(conf_file):
                         os.remove(conf_file)
-                    cur.execute("UPDATE orders SET conf_file=NULL, status='expired' WHERE public_key=%s;", (public_key,))
+                    qr_cache.discard(order_id)
+                    cur.execute(
+                        "UPDATE orders SET conf_file=NULL, client_ip=NULL, status='expired' WHERE public_key=%s;",
+                        (public_key,)
+                    )
+        # Конфиг удалён — адрес больше никому не принадлежит, возвращаем его в пул
+        release_ip(client_ip)
         logger.info("Клиент %s удалён", public_key)
         return jsonify({"status": "ok"})
     except Exception:
         logger.exception("Ошибка при удалении клиента")
         return jsonify({"status": "error"}), 500
 
-# WG stats (transfer)
-wg_prev_stats = {}
-wg_prev_time = time.time()
-
+# WG stats (transfer) — читаем снимок, который публикует единственный сэмплер
 def get_wg_stats():
-    global wg_prev_stats, wg_prev_time
-    stats = {}
-    res = subprocess.run(["wg", "show", WG_INTERFACE, "transfer"], capture_output=True, text=True)
-    now = time.time()
-    if res.returncode == 0:
-        for line in res.stdout.strip().split("\n"):
-            parts = line.split()
-            if len(parts) == 3:
-                pubkey, rx, tx = parts
-                try:
-                    rx = int(rx); tx = int(tx)
-                except Exception:
-                    continue
-                prev = wg_prev_stats.get(pubkey, {"rx": rx, "tx": tx, "last_seen": now})
-                dt = max(now - wg_prev_time, 1)
-                speed_rx = (rx - prev["rx"]) / dt
-                speed_tx = (tx - prev["tx"]) / dt
-                stats[pubkey] = {"rx_bytes": rx, "tx_bytes": tx, "speed_rx": speed_rx, "speed_tx": speed_tx, "last_seen": prev.get("last_seen", now)}
-                if speed_rx > 0 or speed_tx > 0:
-                    stats[pubkey]["last_seen"] = now
-    wg_prev_stats = {k: {"rx": v["rx_bytes"], "tx": v["tx_bytes"], "last_seen": v["last_seen"]} for k,v in stats.items()}
-    wg_prev_time = now
-    return stats
+    return wgmod.get_wg_stats()
 
 # Free trial endpoint
 @app.route("/free-trial", methods=["POST"])
@@ -1053,7 +1138,7 @@ def free_trial():
     if not email:
         return jsonify({"error": "Email не указан"}), 400
 
-    with get_conn() as conn:
+    with order_service.provisioning(), get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT 1 FROM orders WHERE email=%s AND plan=%s LIMIT 1;", (email, "3 дня бесплатно"))
             if cur.fetchone():
@@ -1069,13 +1154,9 @@ def free_trial():
                 (email, plan_name, price, "paid", now.isoformat(), expires_at)
             )
             order_id = cur.fetchone()[0]
-            conf_path, public_key, client_ip = create_client_conf(order_id, email, plan_name)
+            conf_path, public_key, client_ip = order_service.create_client_conf(cur, order_id, email, plan_name)
             cur.execute("UPDATE orders SET conf_file=%s, public_key=%s, client_ip=%s WHERE id=%s;", (conf_path, public_key, client_ip, order_id))
-
-    try:
-        send_conf_email(email, conf_path, expires_at)
-    except Exception:
-        logger.exception("Failed to send free-trial email")
+            send_conf_email(cur, email, conf_path, expires_at)
 
     return jsonify({"message": "Бесплатный пробный период активирован! Конфигурация отправлена на email (Иногда письмо приходит в СПАМ)."})
 
@@ -1083,9 +1164,45 @@ def free_trial():
 # Startup
 # ---------------------------
 def start_background_tasks():
-    t = threading.Thread(target=subscription_loop, daemon=True)
-    t.start()
+    global expiry_engine
+    # Запускается в каждом воркере, но истекает заказы только лидер (advisory lock)
+    expiry_engine = ExpiryEngine(
+        get_conn,
+        connect_dedicated=connect_dedicated,
+        remove_peers=remove_expired_peers,
+    ).start()
     logger.info("Subscription checker started")
+    # История трафика пишется только из процесса, который реально сэмплирует wg
+    wgmod.start_stats_sampler(listeners=[traffic_history.record])
+    host_metrics.start()
+    METRICS.start()
+    # Лента админки: заказы — через LISTEN/NOTIFY, пиры — из снимка статистики
+    admin_events.start()
+    listener = get_listener()
+    # Новая оплата или продление могут истечь раньше, чем лидер собирался проснуться
+    listener.subscribe(ORDERS_CHANNEL, expiry_engine.wake)
+    listener.on_reconnect(expiry_engine.wake)
+    listener.subscribe(ORDERS_CHANNEL, admin_events.on_order_notify)
+    listener.on_reconnect(admin_events.resync)
+    user_manager.attach_listener(listener)
+    # Истёкшие сессии удаляются пачками; воркеры делят строки через SKIP LOCKED
+    user_manager.start_session_sweeper()
+    # Чтения с реплики: после записей любого процесса ключ на время читается с primary
+    _db.attach_read_listener(listener)
+    # Кеш статусов подписок: сброс по orders_changed (после прилипания к primary)
+    subscriptions.attach_listener(listener)
+    # Long-poll уведомлений: будится по notifications_changed (после прилипания к primary)
+    notifications.attach_listener(listener)
+    # Лог активности и данных входа: пачки раз в ACTIVITY_LOG_FLUSH_INTERVAL, остаток — при выходе воркера
+    activity_log.start()
+    atexit.register(activity_log.stop)
+    # Outbox разбирает один процесс-лидер; NOTIFY будит его сразу после COMMIT
+    outbox.start()
+    listener.subscribe(OUTBOX_CHANNEL, outbox.wake)
+    # Оплаты разбирают все воркеры: FOR UPDATE SKIP LOCKED делит события между ними
+    payment_processor.start()
+    listener.subscribe(PAYMENT_EVENTS_CHANNEL, payment_processor.wake)
+    listener.on_reconnect(payment_processor.wake)
 
 
 # ProxyFix if behind nginx
@@ -1096,7 +1213,39 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
 if True:
     init_db_pool()
     init_db()
-    user_manager = UserManager(get_conn)
+    wgmod.init_ip_allocator()
+    wgkeys.init_key_pool()
+    subscriptions = SubscriptionState(get_read_conn, ttl=SUBSCRIPTION_CACHE_TTL, max_size=SUBSCRIPTION_CACHE_SIZE)
+    activity_log = ActivityLog(
+        get_conn,
+        flush_interval=ACTIVITY_LOG_FLUSH_INTERVAL,
+        activity_retention_months=ACTIVITY_LOG_RETENTION_MONTHS,
+        auth_retention_months=TELEGRAM_AUTH_RETENTION_MONTHS,
+    )
+    METRICS.register_collector(activity_log.metrics)
+    notifications = NotificationService(get_conn, get_read_conn, max_waiters=NOTIFICATIONS_MAX_WAITERS)
+    user_manager = UserManager(get_conn, get_read_conn, subscriptions=subscriptions, activity_log=activity_log)
+    traffic_history = TrafficHistory(get_conn)
+    senders = {
+        "email": lambda: SMTPSender(
+            SMTP_SERVER, SMTP_PORT, user=SMTP_USER, password=SMTP_PASSWORD,
+            from_email=FROM_EMAIL, starttls=SMTP_STARTTLS,
+        ),
+    }
+    if OUTBOX_BOT_TOKEN:
+        senders["telegram"] = lambda: TelegramSender(OUTBOX_BOT_TOKEN, api_url=TELEGRAM_API_URL, qr_cache=qr_cache)
+    outbox = OutboxDispatcher(
+        get_conn,
+        connect_dedicated=connect_dedicated,
+        senders=senders,
+        workers={"email": OUTBOX_EMAIL_WORKERS, "telegram": OUTBOX_TELEGRAM_WORKERS},
+        rates={"email": OUTBOX_EMAIL_RATE, "telegram": OUTBOX_TELEGRAM_RATE},
+    )
+    admin_events = AdminEventFeed(
+        get_conn,
+        wg_snapshot=wgmod.STATS_READER.snapshot,
+        host_metrics=host_metrics.snapshot,
+    )
     # Инициализация общего OrderService
     order_service = OrderService(
         get_conn,
@@ -1111,6 +1260,12 @@ if True:
         server_public_key=SERVER_PUBLIC_KEY,
         server_endpoint=SERVER_ENDPOINT,
         dns_addr=DNS_ADDR,
+        qr_cache=qr_cache,
+        remove_peers_from_conf=remove_peers_from_conf,
+        release_ip=release_ip,
+    )
+    payment_processor = PaymentEventProcessor(
+        get_conn, handle=process_payment, provisioning=order_service.provisioning, workers=PAYMENT_WORKERS,
     )
     start_background_tasks()
 
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env
@@ -20,6 +21,21 @@ PG_PORT = int(os.getenv("PG_PORT", 5432))
 PG_DB = os.getenv("PG_DB", "securelink")
 PG_USER = os.getenv("PG_USER", "securelink")
 PG_PASSWORD = os.getenv("PG_PASSWORD")
+# Пул: acquire ждёт до DB_POOL_TIMEOUT секунд, удержание дольше DB_POOL_LEAK_SECONDS — в лог со стеком
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+DB_POOL_LEAK_SECONDS = float(os.getenv("DB_POOL_LEAK_SECONDS", 30))
+DB_POOL_IDLE_CHECK = float(os.getenv("DB_POOL_IDLE_CHECK", 30))
+DB_POOL_TRACE_BORROW = os.getenv("DB_POOL_TRACE_BORROW", "false").lower() in ("true", "1", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+# Реплика для чтений; после записи ключ читается с primary DB_READ_STICKY_SECONDS,
+# при отставании реплики больше DB_REPLICA_MAX_LAG секунд — все чтения с primary
+DB_REPLICA_URL = os.getenv("DB_REPLICA_URL", "")
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", DB_POOL_MAX))
+DB_REPLICA_POOL_TIMEOUT = float(os.getenv("DB_REPLICA_POOL_TIMEOUT", 1))
+DB_READ_STICKY_SECONDS = float(os.getenv("DB_READ_STICKY_SECONDS", 5))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", DB_READ_STICKY_SECONDS))
 
 # -------------------
 # WireGuard
@@ -30,6 +46,11 @@ SERVER_ENDPOINT = os.getenv("SERVER_ENDPOINT")  # <- подтянется из .
 DNS_ADDR = os.getenv("DNS_ADDR", "8.8.8.8")
 WG_CLIENT_NETWORK_CIDR = os.getenv("WG_CLIENT_NETWORK_CIDR", "10.0.0.0/24")
 WG_CLIENT_NETWORK6_CIDR = os.getenv("WG_CLIENT_NETWORK6_CIDR", "")
+WG_BACKEND = os.getenv("WG_BACKEND", "subprocess")  # subprocess | fake
+WG_STATS_SNAPSHOT = os.getenv("WG_STATS_SNAPSHOT", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "securelink_wg_stats.json"
+))
+WG_STATS_INTERVAL = float(os.getenv("WG_STATS_INTERVAL", 5))
 
 # -------------------
 # YooKassa
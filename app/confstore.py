@@ -0,0 +1,166 @@
+"""
+Хранилище wg0.conf с индексом пиров.
+
+Индекс «публичный ключ -> (смещение, длина, AllowedIPs)» строится один раз
+и дальше обновляется инкрементально: если файл только дописывали (тот же
+inode, размер вырос), разбирается лишь новый хвост. Удаление пиров —
+компактизация: файл переписывается без удалённых блоков во временный файл
+и атомарно подменяется через os.replace. Все записи идут под flock на
+отдельном .lock-файле, поэтому воркеры gunicorn не перемешивают блоки.
+"""
+import fcntl
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Set, Tuple
+
+from .ipalloc import split_ips
+
+
+logger = logging.getLogger("securelink")
+
+
+class WGConfStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._index: Dict[str, Tuple[int, int, str]] = {}
+        self._interface_ips: Set[str] = set()
+        self._stat = None  # (st_ino, st_size, st_mtime_ns) на момент индексации
+        self._mutex = threading.Lock()
+
+    # ---------- блокировки и разбор ----------
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._mutex:
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _parse(self, data: bytes, base: int):
+        """Разбирает блоки начиная со смещения base; возвращает записи индекса."""
+        entries = {}
+        interface_ips = set()
+        section, start, key, ips = None, base, None, ""
+
+        def flush(end):
+            if section == "peer" and key:
+                entries[key] = (start, end - start, ips)
+
+        pos = base
+        for raw in data.splitlines(keepends=True):
+            line = raw.decode(errors="replace").strip()
+            if line.startswith("["):
+                flush(pos)
+                section = "peer" if line.lower() == "[peer]" else "interface" if line.lower() == "[interface]" else None
+                start, key, ips = pos, None, ""
+            elif "=" in line and not line.startswith("#"):
+                name, value = (part.strip() for part in line.split("=", 1))
+                if section == "peer" and name == "PublicKey":
+                    key = value
+                elif section == "peer" and name == "AllowedIPs":
+                    ips = value
+                elif section == "interface" and name == "Address":
+                    interface_ips.update(split_ips(value))
+            pos += len(raw)
+        flush(pos)
+        return entries, interface_ips
+
+    def _refresh(self):
+        """Подтягивает изменения, сделанные другими процессами (под блокировкой)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._index, self._interface_ips, self._stat = {}, set(), None
+            return
+        snapshot = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if snapshot == self._stat:
+            return
+        appended = self._stat is not None and st.st_ino == self._stat[0] and st.st_size > self._stat[1]
+        with open(self.path, "rb") as f:
+            if appended:
+                f.seek(self._stat[1])
+                entries, interface_ips = self._parse(f.read(), self._stat[1])
+                self._index.update(entries)
+                self._interface_ips |= interface_ips
+            else:
+                self._index, self._interface_ips = self._parse(f.read(), 0)
+        self._stat = snapshot
+
+    def _remember_stat(self):
+        st = os.stat(self.path)
+        self._stat = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    # ---------- публичное API ----------
+    def has_peer(self, public_key: str) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with self._locked(exclusive=False):
+            self._refresh()
+            return public_key in self._index
+
+    def append_peer(self, public_key: str, allowed_ips: str) -> bool:
+        """Дописывает [Peer]; False — пир уже есть в файле."""
+        with self._locked(exclusive=True):
+            self._refresh()
+            if public_key in self._index:
+                return False
+            block = f"\n[Peer]\nPublicKey = {public_key}\nAllowedIPs = {allowed_ips}\n".encode()
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(block)
+            # пустая строка-разделитель не входит в блок
+            self._index[public_key] = (offset + 1, len(block) - 1, allowed_ips)
+            self._remember_stat()
+            return True
+
+    def remove_peers(self, public_keys: Iterable[str]) -> int:
+        """Компактизация: переписывает файл без указанных пиров. Возвращает число удалённых."""
+        keys = set(public_keys)
+        if not keys or not os.path.exists(self.path):
+            return 0
+        with self._locked(exclusive=True):
+            self._refresh()
+            doomed = sorted(self._index[k][:2] for k in keys if k in self._index)
+            if not doomed:
+                return 0
+            with open(self.path, "rb") as f:
+                data = f.read()
+            chunks, pos = [], 0
+            for offset, length in doomed:
+                chunks.append(data[pos:offset])
+                pos = offset + length
+            chunks.append(data[pos:])
+            tmp_path = f"{self.path}.tmp.{os.getpid()}"
+            st = os.stat(self.path)
+            with open(tmp_path, "wb") as f:
+                f.write(b"".join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, st.st_mode & 0o777)
+            os.replace(tmp_path, self.path)
+            self._stat = None
+            self._refresh()
+            logger.info("Compacted %s: removed %s peers", self.path, len(doomed))
+            return len(doomed)
+
+    def used_ips(self) -> Set[str]:
+        if not os.path.exists(self.path):
+            return set()
+        with self._locked(exclusive=False):
+            self._refresh()
+            ips = set(self._interface_ips)
+            for _, _, allowed in self._index.values():
+                ips.update(split_ips(allowed))
+            return ips
+
+    def peers(self) -> Dict[str, str]:
+        if not os.path.exists(self.path):
+            return {}
+        with self._locked(exclusive=False):
+            self._refresh()
+            return {key: allowed for key, (_, _, allowed) in self._index.items()}
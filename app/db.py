@@ -1,27 +1,87 @@
 from contextlib import contextmanager
 import psycopg2
-import psycopg2.pool
 from . import config
+from .metrics import METRICS
+from .pool import ConnectionPool, PoolTimeout  # noqa: F401  (PoolTimeout — для вызывающих)
+from .replica import ReadRouter, note_write, set_local_router, stick_local  # noqa: F401  (note_write, stick_local — для вызывающих)
 
 
 POOL = None
+REPLICA_POOL = None
+READS = None
+
+
+def get_dsn() -> str:
+    if config.DATABASE_URL:
+        return config.DATABASE_URL
+    return f"host={config.PG_HOST} port={config.PG_PORT} dbname={config.PG_DB} user={config.PG_USER} password={config.PG_PASSWORD}"
+
+
+def connect_dedicated(autocommit: bool = True):
+    """Отдельное соединение вне пула — для долгоживущих сессий (advisory lock, LISTEN)."""
+    conn = psycopg2.connect(get_dsn())
+    conn.autocommit = autocommit
+    return conn
 
 
 def init_db_pool():
     global POOL
     if POOL is not None:
         return POOL
-    if config.DATABASE_URL:
-        dsn = config.DATABASE_URL
-    else:
-        dsn = f"host={config.PG_HOST} port={config.PG_PORT} dbname={config.PG_DB} user={config.PG_USER} password={config.PG_PASSWORD}"
-    POOL = psycopg2.pool.ThreadedConnectionPool(minconn=1, maxconn=10, dsn=dsn)
+    POOL = ConnectionPool(
+        get_dsn(),
+        minconn=config.DB_POOL_MIN,
+        maxconn=config.DB_POOL_MAX,
+        timeout=config.DB_POOL_TIMEOUT,
+        leak_seconds=config.DB_POOL_LEAK_SECONDS,
+        idle_check=config.DB_POOL_IDLE_CHECK,
+        statement_timeout_ms=config.DB_STATEMENT_TIMEOUT_MS,
+        trace_borrow=config.DB_POOL_TRACE_BORROW,
+    )
+    METRICS.register_collector(POOL.metrics)
+    init_replica_pool()
     return POOL
 
 
+def init_replica_pool():
+    """Пул реплики (DB_REPLICA_URL) и маршрутизатор чтений; без реплики чтения идут на primary."""
+    global REPLICA_POOL, READS
+    if READS is not None:
+        return READS
+    if config.DB_REPLICA_URL:
+        # minconn=0: недоступная при старте реплика не мешает запуску, чтения уйдут на primary
+        REPLICA_POOL = ConnectionPool(
+            config.DB_REPLICA_URL,
+            minconn=0,
+            maxconn=config.DB_REPLICA_POOL_MAX,
+            timeout=config.DB_REPLICA_POOL_TIMEOUT,
+            leak_seconds=config.DB_POOL_LEAK_SECONDS,
+            idle_check=config.DB_POOL_IDLE_CHECK,
+            statement_timeout_ms=config.DB_STATEMENT_TIMEOUT_MS,
+            trace_borrow=config.DB_POOL_TRACE_BORROW,
+            name="replica",
+        )
+        METRICS.register_collector(REPLICA_POOL.metrics)
+    READS = ReadRouter(
+        POOL,
+        REPLICA_POOL,
+        sticky_seconds=config.DB_READ_STICKY_SECONDS,
+        max_lag=config.DB_REPLICA_MAX_LAG,
+    )
+    METRICS.register_collector(READS.metrics)
+    set_local_router(READS)
+    return READS
+
+
+def attach_read_listener(listener):
+    """Прилипание чтений к primary после записей любого процесса (LISTEN)."""
+    if READS is not None:
+        READS.attach_listener(listener)
+
+
 @contextmanager
 def get_conn():
-    conn = POOL.getconn()
+    conn = POOL.acquire()
     conn.autocommit = False
     try:
         yield conn
@@ -30,5 +90,9 @@ def get_conn():
         conn.rollback()
         raise
     finally:
-        POOL.putconn(conn)
+        POOL.release(conn)
+
 
+def get_read_conn(*keys):
+    """Read-only транзакция на реплике; keys (user:<id>, email:…, tg:…) — чьи свежие записи нужно увидеть."""
+    return READS.connection(*keys)
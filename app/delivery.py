@@ -0,0 +1,202 @@
+"""
+Отправители исходящих сообщений для outbox (services/outbox.py).
+
+Каждый отправитель держит своё долгоживущее соединение: SMTP-сессия
+переиспользуется между письмами (STARTTLS и LOGIN один раз), Telegram API
+вызывается через requests.Session с keep-alive. Отправитель используется
+одним потоком. Ошибки делятся на временные (повтор с backoff), RetryLater
+(повтор через заданное время) и PermanentError (повторять бессмысленно).
+"""
+import logging
+import os
+import smtplib
+import time
+from datetime import datetime, timezone
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import METRICS
+
+
+logger = logging.getLogger("securelink")
+
+
+class PermanentError(Exception):
+    """Сообщение не будет доставлено никогда (нет файла, адрес отклонён, бот заблокирован)."""
+
+
+class RetryLater(Exception):
+    def __init__(self, message: str, delay: Optional[float] = None):
+        super().__init__(message)
+        self.delay = delay
+
+
+def build_conf_email(from_email: str, to_email: str, conf_path: str, expires_at=None) -> MIMEMultipart:
+    subject = "SecureLink — Ваша WireGuard конфигурация"
+    body = "Здравствуйте!\n\nВ приложении находится ваш новый конфигурационный файл WireGuard."
+
+    if expires_at:
+        dt_utc = expires_at
+        if isinstance(dt_utc, str):
+            dt_utc = datetime.fromisoformat(dt_utc)
+        if dt_utc.tzinfo is None:
+            dt_utc = dt_utc.replace(tzinfo=timezone.utc)
+        # локализуем в МСК
+        try:
+            from zoneinfo import ZoneInfo
+            dt_local = dt_utc.astimezone(ZoneInfo("Europe/Moscow"))
+        except Exception:
+            dt_local = dt_utc
+        body += f"\n\nСрок действия вашей подписки (МСК) до: {dt_local.strftime('%Y-%m-%d %H:%M:%S')}"
+
+    body += "\n\nПриятного пользования!"
+
+    msg = MIMEMultipart()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+
+    with open(conf_path, "rb") as f:
+        part = MIMEApplication(f.read(), Name=os.path.basename(conf_path))
+    part['Content-Disposition'] = f'attachment; filename="{os.path.basename(conf_path)}"'
+    msg.attach(part)
+    return msg
+
+
+class SMTPSender:
+    """Письма с конфигом через одно постоянное SMTP-соединение."""
+
+    def __init__(self, host: str, port: int, *, user: str = None, password: str = None,
+                 from_email: str = None, starttls: bool = True, timeout: float = 30.0,
+                 idle_check: float = 60.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.from_email = from_email or user
+        self.starttls = starttls
+        self.timeout = timeout
+        # после такого простоя соединение проверяется NOOP перед отправкой
+        self.idle_check = idle_check
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        with METRICS.timer("outbound_duration_seconds", target="smtp", op="connect"):
+            return self._open()
+
+    def _open(self) -> smtplib.SMTP:
+        if self.port == 465:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+        logger.info("SMTP connection to %s:%s opened", self.host, self.port)
+        return smtp
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_check:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self.close()
+            except smtplib.SMTPException:
+                self.close()
+            except OSError:
+                self.close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, payload: Dict[str, Any]):
+        try:
+            msg = build_conf_email(self.from_email, payload["to"], payload["conf_path"], payload.get("expires_at"))
+        except FileNotFoundError:
+            raise PermanentError(f"config {payload.get('conf_path')} not found")
+        for attempt in (1, 2):
+            try:
+                smtp = self._connection()
+                with METRICS.timer("outbound_duration_seconds", target="smtp", op="sendmail"):
+                    smtp.sendmail(self.from_email, payload["to"], msg.as_string())
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # сервер закрыл простаивающее соединение — переподключаемся один раз
+                self.close()
+                if attempt == 2:
+                    raise
+            except smtplib.SMTPRecipientsRefused as e:
+                raise PermanentError(f"recipient refused: {e.recipients}")
+            except smtplib.SMTPAuthenticationError:
+                self.close()
+                raise
+            except smtplib.SMTPResponseException as e:
+                self.close()
+                if 500 <= e.smtp_code < 600:
+                    raise PermanentError(f"SMTP {e.smtp_code}: {e.smtp_error!r}")
+                raise
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+
+
+class TelegramSender:
+    """Документы и QR в Telegram через keep-alive сессию Bot API."""
+
+    def __init__(self, bot_token: str, *, api_url: str = "https://api.telegram.org",
+                 qr_cache=None, timeout: float = 20.0):
+        self.base = f"{api_url.rstrip('/')}/bot{bot_token}"
+        self.qr_cache = qr_cache
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+    def _post(self, method: str, data: Dict[str, Any], files: Dict[str, Any]):
+        with METRICS.timer("outbound_duration_seconds", target="telegram", op=method):
+            resp = self.session.post(f"{self.base}/{method}", data=data, files=files, timeout=self.timeout)
+        if resp.status_code == 429:
+            try:
+                delay = resp.json().get("parameters", {}).get("retry_after")
+            except ValueError:
+                delay = None
+            raise RetryLater("Telegram rate limit", delay)
+        if resp.status_code in (400, 403, 404):
+            raise PermanentError(f"Telegram {method} {resp.status_code}: {resp.text[:200]}")
+        resp.raise_for_status()
+
+    def send(self, payload: Dict[str, Any]):
+        method = payload["method"]
+        data = {"chat_id": str(payload["chat_id"]), "caption": payload.get("caption", "")}
+        conf_file = payload["conf_file"]
+        try:
+            if method == "sendDocument":
+                with open(conf_file, "rb") as f:
+                    self._post(method, data, {"document": (os.path.basename(conf_file), f, "text/plain")})
+            elif method == "sendPhoto":
+                cached = self.qr_cache.get_for_file(payload["order_id"], conf_file)
+                if cached is None:
+                    raise FileNotFoundError(conf_file)
+                photo = BytesIO(cached[0])
+                self._post(method, data, {"photo": (f"securelink_{payload['chat_id']}.png", photo, "image/png")})
+            else:
+                raise PermanentError(f"unknown Telegram method {method}")
+        except FileNotFoundError:
+            raise PermanentError(f"config {conf_file} not found")
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,53 @@
+"""
+Фоновый сэмплер метрик хоста для админки.
+
+psutil.cpu_percent(interval=0.5) блокировал каждый запрос на полсекунды;
+здесь cpu_percent(interval=None) вызывается раз в interval секунд из своего
+потока и отдаёт загрузку за прошедший интервал, а обработчик лишь читает
+последнее значение.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import psutil
+
+
+logger = logging.getLogger("securelink")
+
+
+class HostMetricsSampler:
+    def __init__(self, interval: float = 5.0, disk_path: str = "/"):
+        self.interval = interval
+        self.disk_path = disk_path
+        self._metrics: Dict[str, Any] = {"cpu_percent": 0.0, "ram_percent": 0.0, "disk_percent": 0.0, "ts": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> Dict[str, Any]:
+        self._metrics = {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "ram_percent": psutil.virtual_memory().percent,
+            "disk_percent": psutil.disk_usage(self.disk_path).percent,
+            "ts": time.time(),
+        }
+        return self._metrics
+
+    def _loop(self):
+        # первый вызов cpu_percent(None) всегда 0.0 — он лишь задаёт точку отсчёта
+        psutil.cpu_percent(interval=None)
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.exception("Host metrics sampling error: %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="host-metrics", daemon=True)
+            self._thread.start()
+        return self
+
+    def snapshot(self) -> Dict[str, Any]:
+        return dict(self._metrics)
@@ -0,0 +1,285 @@
+"""
+Аллокатор клиентских адресов WireGuard.
+
+Пул держит битовую карту занятых адресов сети (для огромных IPv6-сетей —
+разреженное множество) и курсор следующего свободного адреса, поэтому
+выдача адреса не требует ни перечитывания wg0.conf, ни полного SELECT по
+orders. Между воркерами gunicorn согласованность обеспечивает таблица
+ip_leases: адрес считается выданным только после успешного INSERT в неё
+(PRIMARY KEY по адресу), проигравший гонку воркер просто берёт следующий.
+INSERT идёт курсором вызывающего, в транзакции заказа: откат заказа
+снимает и аренду, а бит в карте процесса возвращает release().
+"""
+import ipaddress
+import logging
+import re
+import threading
+from typing import Iterable, Optional
+
+from . import config
+from .db import get_conn
+
+
+logger = logging.getLogger("securelink")
+
+# Сети больше этого числа адресов храним разреженно (IPv6 /64 и т.п.)
+BITMAP_MAX_HOSTS = 1 << 24
+
+_NOT_FULL_BYTE = re.compile(rb"[^\xff]")
+
+
+class IPPool:
+    """Пул адресов одной сети: битовая карта + курсор + список освобождённых."""
+
+    def __init__(self, cidr: str):
+        self.network = ipaddress.ip_network(cidr, strict=False)
+        self.prefix = self.network.max_prefixlen
+        size = self.network.num_addresses
+        # Те же границы, что и у network.hosts(): без адреса сети,
+        # а для IPv4 ещё и без broadcast
+        if self.network.version == 4 and size > 2:
+            self.first, self.last = 1, size - 2
+        elif self.network.version == 6 and size > 1:
+            self.first, self.last = 1, size - 1
+        else:
+            self.first, self.last = 0, size - 1
+        self.capacity = self.last - self.first + 1
+        self._base = int(self.network.network_address)
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._released = []
+        self._used_count = 0
+        if self.capacity <= BITMAP_MAX_HOSTS:
+            self._bits = bytearray((self.capacity + 7) // 8)
+            self._sparse = None
+        else:
+            self._bits = None
+            self._sparse = set()
+
+    # ---------- битовые операции ----------
+    def _offset(self, ip: str) -> Optional[int]:
+        try:
+            addr = ipaddress.ip_address(ip.split("/")[0].strip())
+        except ValueError:
+            return None
+        if addr.version != self.network.version or addr not in self.network:
+            return None
+        idx = int(addr) - self._base - self.first
+        if idx < 0 or idx >= self.capacity:
+            return None
+        return idx
+
+    def _is_set(self, idx: int) -> bool:
+        if self._bits is None:
+            return idx in self._sparse
+        return bool(self._bits[idx >> 3] & (1 << (idx & 7)))
+
+    def _set(self, idx: int):
+        if self._is_set(idx):
+            return
+        if self._bits is None:
+            self._sparse.add(idx)
+        else:
+            self._bits[idx >> 3] |= 1 << (idx & 7)
+        self._used_count += 1
+
+    def _clear(self, idx: int) -> bool:
+        if not self._is_set(idx):
+            return False
+        if self._bits is None:
+            self._sparse.discard(idx)
+        else:
+            self._bits[idx >> 3] &= ~(1 << (idx & 7)) & 0xFF
+        self._used_count -= 1
+        return True
+
+    def _find_free_from(self, start: int) -> Optional[int]:
+        if self._bits is None:
+            idx = start
+            while idx < self.capacity and idx in self._sparse:
+                idx += 1
+            return idx if idx < self.capacity else None
+        idx = start
+        # добиваем текущий байт побитно, дальше ищем неполный байт regex-ом (C-скорость)
+        while idx < self.capacity and idx & 7:
+            if not self._is_set(idx):
+                return idx
+            idx += 1
+        while idx < self.capacity:
+            m = _NOT_FULL_BYTE.search(self._bits, idx >> 3)
+            if not m:
+                return None
+            idx = m.start() << 3
+            for bit in range(8):
+                if idx + bit >= self.capacity:
+                    return None
+                if not self._is_set(idx + bit):
+                    return idx + bit
+            idx += 8
+        return None
+
+    def _to_ip(self, idx: int) -> str:
+        return str(ipaddress.ip_address(self._base + self.first + idx))
+
+    # ---------- публичное API ----------
+    def mark_used(self, ips: Iterable[str]):
+        with self._lock:
+            for ip in ips:
+                idx = self._offset(ip)
+                if idx is not None:
+                    self._set(idx)
+
+    def allocate(self) -> Optional[str]:
+        """Резервирует адрес локально; None — сеть исчерпана."""
+        with self._lock:
+            while self._released:
+                idx = self._released.pop()
+                if not self._is_set(idx):
+                    self._set(idx)
+                    return self._to_ip(idx)
+            idx = self._find_free_from(self._cursor)
+            if idx is None and self._cursor:
+                idx = self._find_free_from(0)
+            if idx is None:
+                return None
+            self._set(idx)
+            self._cursor = idx + 1
+            return self._to_ip(idx)
+
+    def release(self, ip: str) -> bool:
+        with self._lock:
+            idx = self._offset(ip)
+            if idx is None or not self._clear(idx):
+                return False
+            self._released.append(idx)
+            return True
+
+    def contains(self, ip: str) -> bool:
+        return self._offset(ip) is not None
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self._used_count
+
+
+def split_ips(value: str):
+    """'10.0.0.2/32, fd00::2/128' -> ['10.0.0.2', 'fd00::2']"""
+    if not value:
+        return []
+    return [part.strip().split("/")[0] for part in value.split(",") if part.strip()]
+
+
+# ---------- аренда адресов в БД ----------
+def _try_lease(ip: str, cur=None) -> bool:
+    """Аренда в транзакции cur; без курсора — отдельной транзакцией (скрипты)."""
+    if cur is None:
+        with get_conn() as conn:
+            with conn.cursor() as own:
+                return _try_lease(ip, own)
+    # чужая незакоммиченная аренда того же адреса держит INSERT до её COMMIT/ROLLBACK
+    cur.execute(
+        "INSERT INTO ip_leases(ip) VALUES (%s) ON CONFLICT (ip) DO NOTHING RETURNING ip;",
+        (ip,)
+    )
+    return cur.fetchone() is not None
+
+
+def _drop_lease(ip: str, cur=None):
+    if cur is None:
+        with get_conn() as conn:
+            with conn.cursor() as own:
+                return _drop_lease(ip, own)
+    cur.execute("DELETE FROM ip_leases WHERE ip=%s;", (ip,))
+
+
+def _load_db_used_ips():
+    ips = set()
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT client_ip FROM orders WHERE client_ip IS NOT NULL;")
+            for (value,) in cur.fetchall():
+                ips.update(split_ips(value))
+            cur.execute("SELECT ip FROM ip_leases;")
+            ips.update(row[0] for row in cur.fetchall())
+    return ips
+
+
+class IPAllocator:
+    """IPv4 (+ опционально IPv6) пулы с арендой адресов через ip_leases."""
+
+    def __init__(self, cidr4: str, cidr6: str = ""):
+        self.pool4 = IPPool(cidr4)
+        self.pool6 = IPPool(cidr6) if cidr6 else None
+
+    def seed(self, used_ips: Iterable[str]):
+        used_ips = list(used_ips)
+        self.pool4.mark_used(used_ips)
+        if self.pool6:
+            self.pool6.mark_used(used_ips)
+
+    def _allocate_from(self, pool: IPPool, cur=None) -> str:
+        while True:
+            ip = pool.allocate()
+            if ip is None:
+                raise RuntimeError("No free IP addresses left in network " + str(pool.network))
+            if _try_lease(ip, cur):
+                return f"{ip}/{pool.prefix}"
+            # адрес уже занят другим воркером — бит остаётся выставленным
+            logger.info("IP %s already leased by another worker, trying next", ip)
+
+    def allocate(self, cur=None) -> str:
+        """
+        Возвращает строку AllowedIPs/Address: '10.0.0.5/32' или '10.0.0.5/32, fd00::5/128'.
+        cur — транзакция заказа: аренда коммитится и откатывается вместе с ним;
+        при откате вызывающий возвращает адрес в пул через release().
+        """
+        addresses = [self._allocate_from(self.pool4, cur)]
+        try:
+            if self.pool6:
+                addresses.append(self._allocate_from(self.pool6, cur))
+        except Exception:
+            if cur is None:
+                self.release(addresses[0])
+            else:
+                # аренда IPv4 уйдёт с откатом транзакции вызывающего
+                self.pool4.release(split_ips(addresses[0])[0])
+            raise
+        return ", ".join(addresses)
+
+    def release(self, client_ip: str, cur=None):
+        """
+        cur — транзакция вызывающего: аренда снимается вместе с её COMMIT. Бит
+        в пуле освобождается сразу; если транзакция откатится, аренда останется
+        и следующий allocate() просто пропустит этот адрес.
+        """
+        for ip in split_ips(client_ip):
+            if cur is not None:
+                _drop_lease(ip, cur)
+            else:
+                try:
+                    _drop_lease(ip)
+                except Exception:
+                    logger.exception("Failed to drop IP lease %s", ip)
+            for pool in (self.pool4, self.pool6):
+                if pool and pool.contains(ip):
+                    pool.release(ip)
+
+
+ALLOCATOR: Optional[IPAllocator] = None
+_init_lock = threading.Lock()
+
+
+def init_ip_allocator(extra_used: Iterable[str] = ()) -> IPAllocator:
+    """Создаёт пулы и один раз засевает их адресами из БД и wg0.conf."""
+    global ALLOCATOR
+    with _init_lock:
+        if ALLOCATOR is not None:
+            return ALLOCATOR
+        allocator = IPAllocator(config.WG_CLIENT_NETWORK_CIDR, config.WG_CLIENT_NETWORK6_CIDR)
+        allocator.seed(_load_db_used_ips())
+        allocator.seed(extra_used)
+        ALLOCATOR = allocator
+        logger.info(
+            "IP allocator seeded: %s free in %s", allocator.pool4.free, allocator.pool4.network
+        )
+        return ALLOCATOR
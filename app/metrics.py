@@ -0,0 +1,266 @@
+"""
+Метрики запросов и горячих путей в формате Prometheus.
+
+Каждый воркер gunicorn копит гистограммы у себя в памяти и раз в
+METRICS_FLUSH_INTERVAL секунд атомарно публикует их JSON-файлом в
+METRICS_DIR (по умолчанию в /dev/shm, как снимок статистики wg). /metrics,
+в каком бы воркере он ни выполнился, складывает файлы всех воркеров —
+собственный перед этим публикуется заново, так что свежие данные не теряются.
+
+Измеряется: длительность запроса по шаблону маршрута, ожидание соединения
+из пула, каждый SQL-оператор (по глаголу и таблице), вызовы внешних
+команд (wg), исходящие SMTP/HTTP и рендер QR.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Tuple
+
+import psycopg2.extensions
+
+
+logger = logging.getLogger("securelink")
+
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "securelink_metrics"
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# файлы умерших воркеров старше этого удаляются (Prometheus увидит сброс счётчика)
+METRICS_STALE_SECONDS = 3600
+
+# Границы корзин, секунды: от быстрых SQL до медленных SMTP
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_request_duration_seconds": "Длительность обработки HTTP-запроса по маршруту",
+    "db_pool_wait_seconds": "Ожидание соединения из пула Postgres",
+    "db_query_duration_seconds": "Длительность SQL-оператора",
+    "subprocess_duration_seconds": "Длительность внешней команды",
+    "outbound_duration_seconds": "Длительность исходящего SMTP/HTTP-вызова",
+    "qr_render_seconds": "Рендер QR-кода",
+    "db_pool_hold_seconds": "Сколько соединение было занято заёмщиком",
+    "db_pool_connections": "Соединения пула по состоянию",
+    "db_pool_waiting": "Потоки, ждущие соединение",
+    "db_pool_timeouts_total": "Отказы по таймауту ожидания соединения",
+    "db_pool_leaks_total": "Соединения, удерживаемые дольше порога утечки",
+    "db_pool_healthcheck_failures_total": "Мёртвые соединения, отброшенные при выдаче",
+    "db_reads_total": "Read-only транзакции по выбранному серверу и причине",
+    "db_replica_lag_seconds": "Отставание реплики при последней проверке",
+    "activity_log_buffered": "Строки лога активности, ждущие записи",
+    "activity_log_written_total": "Строки лога активности, записанные пачками",
+    "activity_log_dropped_total": "Строки лога активности, вытесненные из переполненного буфера",
+    "activity_log_rejected_total": "Строки лога активности, отвергнутые INSERT (ошибка данных)",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self, directory: str = METRICS_DIR):
+        self.directory = directory
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+        # функции -> [(type, name, value, labels)]: gauge/counter снимаются в момент публикации
+        self._collectors = []
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple]]):
+        self._collectors.append(collector)
+
+    # ---------- Публикация между воркерами ----------
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"{os.getpid()}.json")
+
+    def flush(self):
+        with self._lock:
+            data = [
+                {"type": "histogram", "name": name, "labels": dict(labels),
+                 "counts": h.counts, "sum": h.total, "count": h.count}
+                for (name, labels), h in self._histograms.items()
+            ]
+        for collector in self._collectors:
+            try:
+                for kind, name, value, labels in collector():
+                    data.append({"type": kind, "name": name, "labels": labels, "value": value})
+            except Exception:
+                logger.exception("Metrics collector failed")
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".metrics.", dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path())
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Metrics flush failed")
+
+    def start(self):
+        """Фоновая публикация; вызывается в каждом воркере после fork."""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+        return self
+
+    def collect(self) -> Dict[Tuple[str, Labels], object]:
+        """Сумма метрик всех воркеров: Histogram или (type, значение) для gauge/counter."""
+        try:
+            self.flush()
+        except OSError:
+            logger.exception("Metrics flush failed")
+        merged: Dict[Tuple[str, Labels], object] = {}
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json") or entry.name.startswith("."):
+                continue
+            try:
+                if now - entry.stat().st_mtime > METRICS_STALE_SECONDS and not _alive(int(entry.name[:-5])):
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for item in data:
+                key = (item["name"], tuple(sorted((k, str(v)) for k, v in item["labels"].items())))
+                if item.get("type", "histogram") != "histogram":
+                    kind, total = merged.get(key, (item["type"], 0))
+                    merged[key] = (kind, total + item["value"])
+                    continue
+                hist = merged.setdefault(key, Histogram())
+                hist.counts = [a + b for a, b in zip(hist.counts, item["counts"])]
+                hist.total += item["sum"]
+                hist.count += item["count"]
+        return merged
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        by_name: Dict[str, list] = {}
+        for (name, labels), value in sorted(self.collect().items(), key=lambda item: item[0]):
+            by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, series in by_name.items():
+            metric = f"securelink_{name}"
+            kind = "histogram" if isinstance(series[0][1], Histogram) else series[0][1][0]
+            lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for labels, hist in series:
+                if not isinstance(hist, Histogram):
+                    lines.append(f"{metric}{_fmt(labels)} {hist[1]}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_fmt(labels, ('le', repr(bound)))} {cumulative}")
+                lines.append(f"{metric}_bucket{_fmt(labels, ('le', '+Inf'))} {hist.count}")
+                lines.append(f"{metric}_sum{_fmt(labels)} {hist.total}")
+                lines.append(f"{metric}_count{_fmt(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt(labels: Iterable[Tuple[str, str]], extra: Tuple[str, str] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+METRICS = Registry()
+
+
+# ---------- SQL ----------
+_VERB_RE = re.compile(r"^\s*([A-Za-z]+)(?:\s+([A-Za-z_]\w*))?")
+# первая таблица после FROM/INTO/UPDATE/JOIN; вызовы функций (EXTRACT(EPOCH FROM NOW())) пропускаются
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([a-z_][a-z0-9_]*)\b(?!\()", re.IGNORECASE)
+
+
+def statement_label(sql) -> str:
+    """«SELECT orders», «INSERT outbox», «EXECUTE bot_upsert_user» — без параметров и литералов."""
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors="replace")
+    if not isinstance(sql, str):
+        return "OTHER"
+    head = sql[:2000]
+    match = _VERB_RE.match(head)
+    if not match:
+        return "OTHER"
+    verb = match.group(1).upper()
+    if verb in ("EXECUTE", "PREPARE"):
+        return f"{verb} {match.group(2)}" if match.group(2) else verb
+    table = _TABLE_RE.search(head)
+    return f"{verb} {table.group(1).lower()}" if table else verb
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Курсор, измеряющий каждый execute/executemany (cursor_factory пула)."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            METRICS.observe("db_query_duration_seconds", time.perf_counter() - started,
+                            statement=statement_label(query))
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            METRICS.observe("db_query_duration_seconds", time.perf_counter() - started,
+                            statement=statement_label(query))
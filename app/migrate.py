@@ -0,0 +1,112 @@
+"""
+Версионные миграции схемы: migrations/NNN_описание.sql.
+
+database_migration.sql остаётся базовой схемой; всё, что меняется поверх
+неё, кладётся отдельным файлом со следующим номером. Каждый файл
+применяется один раз в своей транзакции, номер записывается в
+schema_migrations. Воркеры gunicorn стартуют одновременно, поэтому прогон
+сериализован advisory-локом: первый применяет, остальные видят готовое.
+
+    python -m app.migrate          # применить недостающие
+    python -m app.migrate --status # показать применённые и ожидающие
+"""
+import argparse
+import glob
+import logging
+import os
+import re
+from typing import List, Tuple
+
+from . import db
+
+
+logger = logging.getLogger("securelink")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+MIGRATE_LOCK_KEY = 0x5EC0_0003
+
+_FILE_RE = re.compile(r"^(\d+)_[\w-]+\.sql$")
+
+
+def discover(directory: str = MIGRATIONS_DIR) -> List[Tuple[int, str]]:
+    found = []
+    for path in glob.glob(os.path.join(directory, "*.sql")):
+        match = _FILE_RE.match(os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    found.sort()
+    versions = [version for version, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration numbers in {directory}")
+    return found
+
+
+def _ensure_table(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        """
+    )
+
+
+def applied_versions(cur) -> set:
+    _ensure_table(cur)
+    cur.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def apply_migrations(get_conn=None, directory: str = MIGRATIONS_DIR) -> List[str]:
+    """Применяет недостающие миграции по порядку; возвращает имена применённых."""
+    get_conn = get_conn or db.get_conn
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # параллельный CREATE TABLE IF NOT EXISTS из нескольких воркеров конфликтует
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATE_LOCK_KEY,))
+            done = applied_versions(cur)
+    applied = []
+    for version, path in discover(directory):
+        if version in done:
+            continue
+        name = os.path.basename(path)
+        with open(path) as f:
+            sql = f.read()
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATE_LOCK_KEY,))
+                # другой процесс мог успеть, пока мы ждали лок
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version=%s;", (version,))
+                if cur.fetchone():
+                    continue
+                # CREATE INDEX на больших таблицах дольше DB_STATEMENT_TIMEOUT_MS пула
+                cur.execute("SET LOCAL statement_timeout = 0;")
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+        logger.info("Applied migration %s", name)
+        applied.append(name)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Версионные миграции SecureLink")
+    parser.add_argument("--status", action="store_true", help="показать состояние и выйти")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    db.init_db_pool()
+    if args.status:
+        with db.get_conn() as conn:
+            with conn.cursor() as cur:
+                done = applied_versions(cur)
+        for version, path in discover():
+            print(f"{'applied' if version in done else 'pending'}\t{os.path.basename(path)}")
+        return
+    applied = apply_migrations()
+    print(f"Applied {len(applied)} migration(s)" + (": " + ", ".join(applied) if applied else ""))
+
+
+if __name__ == "__main__":
+    main()
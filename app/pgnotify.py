@@ -0,0 +1,121 @@
+"""
+LISTEN/NOTIFY для Postgres: один поток и одно выделенное соединение на процесс.
+
+Подписчики регистрируют колбэк на канал; пока уведомлений нет, поток спит
+в select() и нагрузки на БД не создаёт. После переподключения вызываются
+on_reconnect-колбэки — уведомления, пришедшие в разрыве, потеряны, и кеши
+должны сброситься целиком.
+"""
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from .db import connect_dedicated
+
+
+logger = logging.getLogger("securelink")
+
+
+class PGListener:
+    def __init__(self, connect: Callable = connect_dedicated, poll_timeout: float = 5.0):
+        self.connect = connect
+        self.poll_timeout = poll_timeout
+        self._callbacks: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+        self._reconnect_callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pending_listen: List[str] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        with self._lock:
+            new_channel = channel not in self._callbacks
+            self._callbacks[channel].append(callback)
+            if new_channel:
+                self._pending_listen.append(channel)
+        self.start()
+
+    def on_reconnect(self, callback: Callable[[], None]):
+        with self._lock:
+            self._reconnect_callbacks.append(callback)
+
+    def _listen_pending(self):
+        with self._lock:
+            channels, self._pending_listen = self._pending_listen, []
+        with self._conn.cursor() as cur:
+            for channel in channels:
+                cur.execute(f'LISTEN "{channel}";')
+
+    def _dispatch(self, channel: str, payload: str):
+        for callback in list(self._callbacks.get(channel, ())):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("NOTIFY handler for %s failed", channel)
+
+    def _run(self):
+        backoff = 1.0
+        first = True
+        while True:
+            try:
+                self._conn = self.connect(autocommit=True)
+                with self._lock:
+                    self._pending_listen = list(self._callbacks)
+                self._listen_pending()
+                if not first:
+                    for callback in list(self._reconnect_callbacks):
+                        try:
+                            callback()
+                        except Exception:
+                            logger.exception("NOTIFY reconnect handler failed")
+                first = False
+                backoff = 1.0
+                while True:
+                    if self._pending_listen:
+                        self._listen_pending()
+                    ready, _, _ = select.select([self._conn], [], [], self.poll_timeout)
+                    self._conn.poll()
+                    while self._conn.notifies:
+                        notify = self._conn.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+                    if not ready:
+                        # проверка, что соединение живо
+                        with self._conn.cursor() as cur:
+                            cur.execute("SELECT 1;")
+            except Exception as e:
+                logger.warning("NOTIFY listener connection lost: %s", e)
+                try:
+                    if self._conn is not None:
+                        self._conn.close()
+                except Exception:
+                    pass
+                self._conn = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+                self._thread.start()
+        return self
+
+
+LISTENER: Optional[PGListener] = None
+_listener_lock = threading.Lock()
+
+
+def get_listener() -> PGListener:
+    global LISTENER
+    with _listener_lock:
+        if LISTENER is None:
+            LISTENER = PGListener()
+        return LISTENER
+
+
+def notify(cur, channel: str, payload: str = ""):
+    """NOTIFY в текущей транзакции (уходит подписчикам только после COMMIT)."""
+    cur.execute("SELECT pg_notify(%s, %s);", (channel, payload))
@@ -0,0 +1,258 @@
+"""
+Пул соединений Postgres с ожиданием, учётом удержания и поиском утечек.
+
+В отличие от psycopg2.pool.ThreadedConnectionPool, который при исчерпании
+сразу бросает PoolError, acquire() ждёт освободившееся соединение до
+timeout секунд. Соединение, простоявшее дольше idle_check, перед выдачей
+проверяется SELECT 1 — оборванное сервером заменяется новым. Каждая выдача
+запоминается (поток, время); фоновый сторож пишет в лог предупреждение со
+стеком потока-заёмщика, если соединение удерживается дольше leak_seconds.
+statement_timeout задаётся при подключении (options=-c statement_timeout).
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from .metrics import METRICS, InstrumentedCursor
+
+
+logger = logging.getLogger("securelink")
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Свободное соединение не появилось за timeout секунд."""
+
+
+class _Borrow:
+    __slots__ = ("thread_id", "thread_name", "since", "stack", "reported")
+
+    def __init__(self, stack: Optional[List[str]]):
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.since = time.monotonic()
+        self.stack = stack
+        self.reported = False
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        minconn: int = 1,
+        maxconn: int = 10,
+        timeout: float = 5.0,
+        leak_seconds: float = 30.0,
+        idle_check: float = 30.0,
+        statement_timeout_ms: int = 0,
+        trace_borrow: bool = False,
+        name: str = "main",
+    ) -> None:
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.leak_seconds = leak_seconds
+        self.idle_check = idle_check
+        self.statement_timeout_ms = statement_timeout_ms
+        # стек места выдачи стоит ~десятков мкс на запрос, поэтому по умолчанию выключен:
+        # в предупреждении об утечке и так есть текущий стек заёмщика
+        self.trace_borrow = trace_borrow
+        self.name = name
+        self._cond = threading.Condition()
+        self._idle: deque = deque()  # (conn, monotonic времени возврата)
+        self._borrowed: Dict[int, _Borrow] = {}
+        self._size = 0
+        self._waiting = 0
+        self._closed = False
+        self._watchdog: Optional[threading.Thread] = None
+        self.counters = {"acquired": 0, "created": 0, "timeouts": 0, "leaks": 0, "healthcheck_failures": 0}
+        self.max_wait = 0.0
+        for _ in range(minconn):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    # ---------- Соединения ----------
+    def _connect(self):
+        kwargs: Dict[str, Any] = {"cursor_factory": InstrumentedCursor}
+        if self.statement_timeout_ms:
+            kwargs["options"] = f"-c statement_timeout={int(self.statement_timeout_ms)}"
+        conn = psycopg2.connect(self.dsn, **kwargs)
+        self.counters["created"] += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.idle_check:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # ---------- Выдача и возврат ----------
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        while True:
+            conn = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"pool {self.name}: all {self.maxconn} connections busy for {self.timeout:.1f}s"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(conn, idle_since):
+                logger.warning("Pool %s: dropping dead connection", self.name)
+                self._close(conn)
+                with self._cond:
+                    self.counters["healthcheck_failures"] += 1
+                    self._size -= 1
+                continue
+            break
+
+        waited = time.monotonic() - started
+        stack = traceback.format_stack(limit=16)[:-1] if self.trace_borrow else None
+        with self._cond:
+            self._borrowed[id(conn)] = _Borrow(stack)
+            self.counters["acquired"] += 1
+            self.max_wait = max(self.max_wait, waited)
+        METRICS.observe("db_pool_wait_seconds", waited, pool=self.name)
+        self._start_watchdog()
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        with self._cond:
+            borrow = self._borrowed.pop(id(conn), None)
+        if borrow is not None:
+            METRICS.observe("db_pool_hold_seconds", time.monotonic() - borrow.since, pool=self.name)
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    # ---------- Утечки ----------
+    def _start_watchdog(self):
+        if self._watchdog is None and self.leak_seconds:
+            with self._cond:
+                if self._watchdog is not None:
+                    return
+                self._watchdog = threading.Thread(target=self._watch, name=f"db-pool-{self.name}-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        while not self._closed:
+            time.sleep(max(1.0, min(5.0, self.leak_seconds / 2)))
+            now = time.monotonic()
+            with self._cond:
+                overdue = [b for b in self._borrowed.values() if not b.reported and now - b.since > self.leak_seconds]
+                for borrow in overdue:
+                    borrow.reported = True
+                    self.counters["leaks"] += 1
+            if not overdue:
+                continue
+            frames = sys._current_frames()
+            for borrow in overdue:
+                frame = frames.get(borrow.thread_id)
+                current = "".join(traceback.format_stack(frame, limit=24)) if frame else "(thread finished)\n"
+                message = (
+                    f"Pool {self.name}: connection held for {now - borrow.since:.1f}s by thread "
+                    f"{borrow.thread_name}; borrower is now at:\n{current}"
+                )
+                if borrow.stack:
+                    message += "borrowed at:\n" + "".join(borrow.stack)
+                logger.warning(message)
+
+    # ---------- Мониторинг ----------
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._cond:
+            holds = [now - b.since for b in self._borrowed.values()]
+            return {
+                "name": self.name,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._borrowed),
+                "waiting": self._waiting,
+                "longest_hold_seconds": round(max(holds, default=0.0), 3),
+                "max_wait_seconds": round(self.max_wait, 3),
+                "timeout_seconds": self.timeout,
+                "statement_timeout_ms": self.statement_timeout_ms,
+                **self.counters,
+            }
+
+    def metrics(self):
+        """Коллектор для METRICS: gauge/counter пула этого процесса."""
+        stats = self.stats()
+        labels = {"pool": self.name}
+        return [
+            ("gauge", "db_pool_connections", stats["in_use"], {**labels, "state": "in_use"}),
+            ("gauge", "db_pool_connections", stats["idle"], {**labels, "state": "idle"}),
+            ("gauge", "db_pool_waiting", stats["waiting"], labels),
+            ("counter", "db_pool_timeouts_total", stats["timeouts"], labels),
+            ("counter", "db_pool_leaks_total", stats["leaks"], labels),
+            ("counter", "db_pool_healthcheck_failures_total", stats["healthcheck_failures"], labels),
+        ]
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close(conn)
+            self._cond.notify_all()
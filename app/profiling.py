@@ -0,0 +1,147 @@
+"""
+Выборочный профилировщик медленных запросов.
+
+Пока профилирование включено, отдельный поток воркера раз в interval_ms
+снимает стеки (sys._current_frames) потоков, которые сейчас обрабатывают
+запрос. Если запрос шёл дольше slow_ms, его стеки пишутся в PROFILE_DIR
+в «свёрнутом» формате (frame;frame;frame N) — файл сразу годится для
+flamegraph.pl или speedscope. Быстрые запросы отбрасываются.
+
+Включается PROFILE_SLOW_MS=<мс> при старте или на лету через
+/admin/profiling: настройка лежит файлом рядом с метриками, и каждый
+воркер перечитывает её не чаще раза в секунду.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from .metrics import METRICS_DIR
+
+
+logger = logging.getLogger("securelink")
+
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(METRICS_DIR, "profiles")
+PROFILE_KEEP = 200
+SETTINGS_PATH = os.path.join(METRICS_DIR, "profiling.json")
+
+
+class SlowRequestProfiler:
+    def __init__(self, slow_ms: float = 0.0, interval_ms: float = 5.0,
+                 settings_path: str = SETTINGS_PATH, profile_dir: str = PROFILE_DIR):
+        self.settings_path = settings_path
+        self.profile_dir = profile_dir
+        self.default = {"slow_ms": slow_ms, "interval_ms": interval_ms}
+        self.slow_ms = slow_ms
+        self.interval_ms = interval_ms
+        # thread id -> стеки текущего запроса
+        self._active: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._settings_mtime = None
+        self._sampler: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_ms > 0
+
+    # ---------- Настройки ----------
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < 1.0:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.settings_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._settings_mtime:
+            return
+        self._settings_mtime = mtime
+        settings = dict(self.default)
+        if mtime is not None:
+            try:
+                with open(self.settings_path) as f:
+                    settings.update(json.load(f))
+            except (OSError, ValueError):
+                logger.warning("Ignoring unreadable profiler settings %s", self.settings_path)
+        self.slow_ms = float(settings.get("slow_ms") or 0)
+        self.interval_ms = max(1.0, float(settings.get("interval_ms") or 5))
+
+    def configure(self, slow_ms: float, interval_ms: float = None):
+        """Включает (slow_ms > 0) или выключает профилирование во всех воркерах."""
+        settings = {"slow_ms": slow_ms, "interval_ms": interval_ms or self.interval_ms}
+        os.makedirs(os.path.dirname(self.settings_path), exist_ok=True)
+        tmp_path = f"{self.settings_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(settings, f)
+        os.replace(tmp_path, self.settings_path)
+        self._checked = 0.0
+        self._refresh()
+        return self.settings()
+
+    def settings(self) -> dict:
+        return {"slow_ms": self.slow_ms, "interval_ms": self.interval_ms, "profile_dir": self.profile_dir}
+
+    # ---------- Сэмплирование ----------
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval_ms / 1000)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_fold(frame)] += 1
+
+    def begin(self):
+        self._refresh()
+        if not self.enabled:
+            return
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="slow-request-profiler", daemon=True)
+            self._sampler.start()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, route: str, seconds: float):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+        if not stacks or seconds * 1000 < self.slow_ms:
+            return
+        try:
+            self._write(route, seconds, stacks)
+        except OSError:
+            logger.exception("Failed to write profile for %s", route)
+
+    def _write(self, route: str, seconds: float, stacks: Counter):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}-{int(seconds * 1000)}ms.folded"
+        with open(os.path.join(self.profile_dir, name), "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info("Slow request %s took %.0f ms, profile saved as %s", route, seconds * 1000, name)
+        profiles = sorted(p for p in os.listdir(self.profile_dir) if p.endswith(".folded"))
+        for old in profiles[:-PROFILE_KEEP]:
+            try:
+                os.remove(os.path.join(self.profile_dir, old))
+            except OSError:
+                pass
+
+
+def _fold(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        # строка начала функции, а не текущая: иначе одна функция дробится на много кадров
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
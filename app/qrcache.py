@@ -0,0 +1,140 @@
+"""
+Кеш QR-кодов клиентских конфигов.
+
+Ключ — id заказа и sha256 текста конфига: перевыпущенный конфиг получает
+новый хеш, старый рендер просто перестаёт совпадать. PNG хранятся на диске
+(<CONF_DIR>/.qr, права как у самих конфигов — в QR приватный ключ) и в
+небольшом LRU в памяти; хеш же служит ETag для ответов /qr.
+"""
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Optional, Tuple
+
+import qrcode
+
+from .metrics import METRICS
+
+
+logger = logging.getLogger("securelink")
+
+
+def default_cache_dir(conf_dir: str) -> str:
+    return os.getenv("QR_CACHE_DIR") or os.path.join(conf_dir, ".qr")
+
+
+def render_png(conf_text: str) -> bytes:
+    with METRICS.timer("qr_render_seconds"):
+        buf = BytesIO()
+        qrcode.make(conf_text).save(buf, "PNG")
+        return buf.getvalue()
+
+
+def content_hash(conf_text: str) -> str:
+    return hashlib.sha256(conf_text.encode()).hexdigest()[:32]
+
+
+class QRCache:
+    def __init__(self, cache_dir: str, max_memory: int = 256):
+        self.cache_dir = cache_dir
+        self.max_memory = max_memory
+        self._memory: "OrderedDict[Tuple[int, str], bytes]" = OrderedDict()
+        # order_id -> (путь, mtime_ns, размер, хеш): повторный запрос не перечитывает конфиг
+        self._files = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    def _path(self, order_id: int, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"wg_{order_id}.{digest}.png")
+
+    def _remember(self, key, png: bytes):
+        with self._lock:
+            self._memory[key] = png
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+
+    def _write(self, order_id: int, digest: str, png: bytes):
+        fd, tmp_path = tempfile.mkstemp(prefix=".qr.", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, self._path(order_id, digest))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # прежние рендеры этого заказа больше не нужны
+        for old in glob.glob(os.path.join(self.cache_dir, f"wg_{order_id}.*.png")):
+            if not old.endswith(f".{digest}.png"):
+                os.remove(old)
+
+    def get(self, order_id: int, conf_text: str) -> Tuple[bytes, str]:
+        """(PNG, хеш) для текста конфига; рендерит только при промахе памяти и диска."""
+        digest = content_hash(conf_text)
+        key = (order_id, digest)
+        with self._lock:
+            png = self._memory.get(key)
+            if png is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return png, digest
+        try:
+            with open(self._path(order_id, digest), "rb") as f:
+                png = f.read()
+            self.hits += 1
+        except FileNotFoundError:
+            self.misses += 1
+            png = render_png(conf_text)
+            try:
+                self._write(order_id, digest, png)
+            except OSError:
+                logger.warning("Failed to store QR render for order %s", order_id)
+        self._remember(key, png)
+        return png, digest
+
+    def digest_for_file(self, order_id: int, conf_path: str) -> Optional[str]:
+        """Хеш конфига по stat без чтения файла, если файл не менялся; None — файла нет."""
+        try:
+            st = os.stat(conf_path)
+        except FileNotFoundError:
+            return None
+        cached = self._files.get(order_id)
+        if cached and cached[:3] == (conf_path, st.st_mtime_ns, st.st_size):
+            return cached[3]
+        with open(conf_path) as f:
+            digest = content_hash(f.read())
+        self._files[order_id] = (conf_path, st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def get_for_file(self, order_id: int, conf_path: str) -> Optional[Tuple[bytes, str]]:
+        try:
+            with open(conf_path) as f:
+                conf_text = f.read()
+        except FileNotFoundError:
+            return None
+        return self.get(order_id, conf_text)
+
+    def precompute(self, order_id: int, conf_text: str):
+        try:
+            self.get(order_id, conf_text)
+        except Exception:
+            logger.exception("QR precompute failed for order %s", order_id)
+
+    def discard(self, order_id: int):
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == order_id]:
+                del self._memory[key]
+            self._files.pop(order_id, None)
+        for path in glob.glob(os.path.join(self.cache_dir, f"wg_{order_id}.*.png")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,218 @@
+"""
+Чтения с реплики Postgres с гарантией read-your-writes.
+
+ReadRouter выдаёт read-only транзакцию на реплике (DB_REPLICA_URL), если
+это безопасно, и на primary — если нет:
+
+* ключ чтения (user:<id>, email:<адрес>, tg:<telegram_id>) «прилип» после
+  записи: в течение sticky_seconds после COMMIT такие чтения идут на
+  primary. О записи узнают все процессы — через NOTIFY: триггеры orders и
+  users уже шлют orders_changed/users_changed, остальные записи вызывают
+  note_write() в своей транзакции. Свой процесс прилипает сразу, не дожидаясь
+  возврата NOTIFY через поток LISTEN (note_write, stick_local) — иначе
+  следующий запрос того же клиента мог бы уйти на отстающую реплику;
+* реплика отстаёт больше max_lag (проверяется не чаще раза в
+  lag_check_interval на выданном соединении) — тогда прилипание по окну
+  ничего не гарантирует, и все чтения идут на primary;
+* реплика недоступна или её пул исчерпан.
+
+После переподключения LISTEN уведомления могли потеряться, поэтому на
+sticky_seconds прилипает всё.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("securelink")
+
+STICKY_CHANNEL = "read_sticky"
+# триггеры из migrations/002_orders_notify_telegram_id.sql и 006_users_notify.sql
+ORDERS_CHANNEL = "orders_changed"
+USERS_CHANNEL = "users_changed"
+
+LAG_SQL = """
+SELECT COALESCE(CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+END, 0);
+"""
+
+
+# маршрутизатор этого процесса (app.db.init_replica_pool)
+_local_router: Optional["ReadRouter"] = None
+
+
+def set_local_router(router: Optional["ReadRouter"]):
+    global _local_router
+    _local_router = router
+
+
+def stick_local(*keys: str):
+    """Прилипание в своём процессе сразу — для записей, о которых NOTIFY шлют триггеры."""
+    if _local_router is not None:
+        _local_router.stick(*keys)
+
+
+def note_write(cur, *keys: str):
+    """В транзакции записи: после COMMIT чтения по этим ключам во всех процессах идут на primary."""
+    keys = [k for k in keys if k]
+    if keys:
+        cur.execute("SELECT pg_notify(%s, %s);", (STICKY_CHANNEL, json.dumps(keys)))
+        # до COMMIT — лишь чуть раньше на primary; после него NOTIFY может ещё не дойти
+        stick_local(*keys)
+
+
+class ReadRouter:
+    def __init__(self, primary, replica=None, *, sticky_seconds: float = 5.0,
+                 max_lag: float = 5.0, lag_check_interval: float = 1.0):
+        self.primary = primary
+        self.replica = replica
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._sticky: Dict[str, float] = {}
+        self._sticky_all_until = 0.0
+        self._lock = threading.Lock()
+        self.lag: Optional[float] = None
+        self._lag_checked = 0.0
+        self.counters = {"replica": 0, "primary_sticky": 0, "primary_lag": 0, "primary_unavailable": 0, "primary": 0}
+
+    # ---------- Прилипание ----------
+    def stick(self, *keys: str):
+        until = time.monotonic() + self.sticky_seconds
+        with self._lock:
+            for key in keys:
+                if key:
+                    self._sticky[key] = until
+            if len(self._sticky) > 10000:
+                now = time.monotonic()
+                self._sticky = {k: v for k, v in self._sticky.items() if v > now}
+
+    def stick_all(self):
+        self._sticky_all_until = time.monotonic() + self.sticky_seconds
+
+    def is_sticky(self, keys) -> bool:
+        now = time.monotonic()
+        if now < self._sticky_all_until:
+            return True
+        with self._lock:
+            return any(self._sticky.get(key, 0) > now for key in keys)
+
+    def on_sticky_notify(self, payload: str):
+        try:
+            self.stick(*json.loads(payload))
+        except (ValueError, TypeError):
+            self.stick_all()
+
+    def on_orders_notify(self, payload: str):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return self.stick_all()
+        self.stick(
+            data.get("user_id") and f"user:{data['user_id']}",
+            data.get("email") and f"email:{data['email']}",
+            data.get("telegram_id") and f"tg:{data['telegram_id']}",
+        )
+
+    def on_users_notify(self, payload: str):
+        try:
+            self.stick(f"user:{json.loads(payload)['id']}")
+        except (ValueError, KeyError, TypeError):
+            self.stick_all()
+
+    def attach_listener(self, listener):
+        """Подписка на записи всех процессов (app.pgnotify.PGListener); без реплики не нужна."""
+        if self.replica is None:
+            return
+        listener.subscribe(STICKY_CHANNEL, self.on_sticky_notify)
+        listener.subscribe(ORDERS_CHANNEL, self.on_orders_notify)
+        listener.subscribe(USERS_CHANNEL, self.on_users_notify)
+        listener.on_reconnect(self.stick_all)
+
+    # ---------- Выбор сервера ----------
+    def _replica_fresh(self, conn) -> bool:
+        now = time.monotonic()
+        if now - self._lag_checked >= self.lag_check_interval:
+            self._lag_checked = now
+            with conn.cursor() as cur:
+                cur.execute(LAG_SQL)
+                self.lag = float(cur.fetchone()[0])
+            conn.rollback()
+            if self.lag > self.max_lag:
+                logger.warning("Replica lags %.1fs (max %.1fs), reading from primary", self.lag, self.max_lag)
+        return self.lag is None or self.lag <= self.max_lag
+
+    def _acquire(self, keys):
+        if self.replica is None:
+            self.counters["primary"] += 1
+            return self.primary, self.primary.acquire()
+        if self.is_sticky(keys):
+            self.counters["primary_sticky"] += 1
+            return self.primary, self.primary.acquire()
+        if self.lag is not None and self.lag > self.max_lag and \
+                time.monotonic() - self._lag_checked < self.lag_check_interval:
+            self.counters["primary_lag"] += 1
+            return self.primary, self.primary.acquire()
+        try:
+            conn = self.replica.acquire()
+        except Exception as e:
+            # psycopg2.OperationalError или PoolTimeout: реплика не должна ронять чтения
+            logger.warning("Replica unavailable, reading from primary: %s", e)
+            self.counters["primary_unavailable"] += 1
+            return self.primary, self.primary.acquire()
+        try:
+            fresh = self._replica_fresh(conn)
+        except Exception as e:
+            logger.warning("Replica lag check failed, reading from primary: %s", e)
+            self.replica.release(conn, discard=True)
+            self.counters["primary_unavailable"] += 1
+            return self.primary, self.primary.acquire()
+        if not fresh:
+            self.replica.release(conn)
+            self.counters["primary_lag"] += 1
+            return self.primary, self.primary.acquire()
+        self.counters["replica"] += 1
+        return self.replica, conn
+
+    @contextmanager
+    def connection(self, *keys: str):
+        """Read-only транзакция; keys — чьи недавние записи должен увидеть запрос."""
+        pool, conn = self._acquire([k for k in keys if k])
+        try:
+            conn.autocommit = False
+            conn.readonly = True
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if not conn.closed:
+                # соединения primary общие с записью
+                conn.readonly = None
+            pool.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            sticky = sum(1 for until in self._sticky.values() if until > now)
+        return {
+            "replica": self.replica.stats() if self.replica is not None else None,
+            "lag_seconds": self.lag,
+            "max_lag_seconds": self.max_lag,
+            "sticky_seconds": self.sticky_seconds,
+            "sticky_keys": sticky,
+            "reads": dict(self.counters),
+        }
+
+    def metrics(self):
+        """Коллектор для METRICS: чтения по причине выбора сервера."""
+        items = [("counter", "db_reads_total", value, {"target": target}) for target, value in self.counters.items()]
+        if self.lag is not None:
+            items.append(("gauge", "db_replica_lag_seconds", self.lag, {}))
+        return items
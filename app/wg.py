@@ -1,9 +1,13 @@
 import os
-import ipaddress
 import subprocess
 from typing import Set
 from dotenv import load_dotenv
 from .db import get_conn
+from . import ipalloc, wgkeys
+from .wgbackend import make_backend
+from .confstore import WGConfStore
+from .config import WG_STATS_INTERVAL, WG_STATS_SNAPSHOT
+from .wgstats import StatsReader, StatsSampler
 
 # Загружаем .env
 load_dotenv()
@@ -17,36 +21,59 @@ SERVER_ENDPOINT = os.getenv("SERVER_ENDPOINT")
 DNS_ADDR = os.getenv("DNS_ADDR", "8.8.8.8")
 WG_CLIENT_NETWORK_CIDR = os.getenv("WG_CLIENT_NETWORK_CIDR", "10.0.0.0/24")
 WG_CLIENT_NETWORK6_CIDR = os.getenv("WG_CLIENT_NETWORK6_CIDR", "")
+WG_BACKEND = os.getenv("WG_BACKEND", "subprocess")
 
-
-def run_cmd(cmd):
-    return subprocess.run(cmd, capture_output=True, text=True)
+BACKEND = make_backend(WG_BACKEND, WG_INTERFACE)
+CONF_STORE = WGConfStore(WG_CONFIG_PATH)
+STATS_READER = StatsReader(WG_STATS_SNAPSHOT, interval=WG_STATS_INTERVAL)
 
 
 def wg_set_peer(public_key: str, allowed_ips: str) -> bool:
-    res = run_cmd(["wg", "set", WG_INTERFACE, "peer", public_key, "allowed-ips", allowed_ips])
-    return res.returncode == 0
+    return BACKEND.set_peer(public_key, allowed_ips)
 
 
 def wg_remove_peer(public_key: str) -> bool:
-    res = run_cmd(["wg", "set", WG_INTERFACE, "peer", public_key, "remove"])
-    return res.returncode == 0
+    return BACKEND.remove_peer(public_key)
+
+
+def wg_peer_batch():
+    """Пакет изменений пиров: `with wg_peer_batch() as b: b.remove_peer(k)` — один вызов wg."""
+    return BACKEND.batch()
+
+
+def start_stats_sampler(listeners=()) -> StatsSampler:
+    """Запускается в каждом воркере; сэмплирует только держатель flock."""
+    return StatsSampler(BACKEND, WG_STATS_SNAPSHOT, interval=WG_STATS_INTERVAL, listeners=listeners).start()
+
+
+def get_wg_stats():
+    return STATS_READER.peers()
 
 
 def wg_gen_keypair():
+    if wgkeys.KEY_POOL is not None:
+        return wgkeys.KEY_POOL.get()
+    return wgkeys.generate_keypair()
+
+
+def wg_gen_keypair_subprocess():
+    """Прежний путь через `wg genkey`/`wg pubkey` (оставлен для сравнения и отладки)."""
     private = subprocess.check_output(["wg", "genkey"]).decode().strip()
     public = subprocess.check_output(["wg", "pubkey"], input=private.encode()).decode().strip()
     return private, public
 
 
+def wg_pubkey(private_key: str) -> str:
+    return wgkeys.derive_public_key(private_key)
+
+
 def append_peer_to_conf(public_key: str, client_ip: str):
-    if os.path.exists(WG_CONFIG_PATH):
-        with open(WG_CONFIG_PATH, "r") as f:
-            contents = f.read()
-        if public_key in contents:
-            return
-    with open(WG_CONFIG_PATH, "a") as f:
-        f.write(f"\n[Peer]\nPublicKey = {public_key}\nAllowedIPs = {client_ip}\n")
+    CONF_STORE.append_peer(public_key, client_ip)
+
+
+def remove_peers_from_conf(public_keys) -> int:
+    """Убирает пиров из wg0.conf одной атомарной перезаписью файла."""
+    return CONF_STORE.remove_peers(public_keys)
 
 
 def parse_conf(conf_path: str):
@@ -62,29 +89,31 @@ def parse_conf(conf_path: str):
     return result
 
 
+def get_conf_used_ips() -> Set[str]:
+    """Адреса из wg0.conf (по индексу хранилища): AllowedIPs пиров и Address интерфейса."""
+    return CONF_STORE.used_ips()
+
+
 def get_used_ips() -> Set[str]:
-    ips = set()
-    if os.path.exists(WG_CONFIG_PATH):
-        with open(WG_CONFIG_PATH) as f:
-            for line in f:
-                if line.strip().startswith("AllowedIPs"):
-                    ip = line.split("=", 1)[1].strip().split("/")[0]
-                    ips.add(ip)
+    ips = get_conf_used_ips()
     with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT client_ip FROM orders WHERE client_ip IS NOT NULL;")
             for row in cur.fetchall():
-                ip = row[0]
-                if ip:
-                    ips.add(ip.split("/")[0])
+                ips.update(ipalloc.split_ips(row[0]))
     return ips
 
 
-def get_next_free_ip() -> str:
-    network = ipaddress.ip_network(WG_CLIENT_NETWORK_CIDR, strict=False)
-    used = get_used_ips()
-    for host in network.hosts():
-        ip_str = str(host)
-        if ip_str not in used:
-            return f"{ip_str}/32"
-    raise RuntimeError("No free IP addresses left in network " + WG_CLIENT_NETWORK_CIDR)
\ No newline at end of file
+def init_ip_allocator():
+    return ipalloc.init_ip_allocator(get_conf_used_ips())
+
+
+def get_next_free_ip(cur=None) -> str:
+    allocator = ipalloc.ALLOCATOR or init_ip_allocator()
+    return allocator.allocate(cur)
+
+
+def release_ip(client_ip: str, cur=None):
+    if client_ip:
+        allocator = ipalloc.ALLOCATOR or init_ip_allocator()
+        allocator.release(client_ip, cur)
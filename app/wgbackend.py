@@ -0,0 +1,182 @@
+"""
+Бэкенды управления пирами WireGuard.
+
+SubprocessBackend — прежний путь через утилиту `wg`, но пакет изменений
+уходит одним вызовом `wg set <iface> peer A ... peer B remove ...`
+(с разбиением на чанки, чтобы не упереться в ARG_MAX).
+FakeBackend хранит пиров в памяти и нужен там, где нет модуля ядра.
+"""
+import abc
+import logging
+import subprocess
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .metrics import METRICS
+
+
+logger = logging.getLogger("securelink")
+
+# Сколько пиров отправлять в одном вызове `wg set`
+BATCH_CHUNK = 500
+
+
+def run_cmd(cmd, input_text: Optional[str] = None):
+    started = time.perf_counter()
+    try:
+        return subprocess.run(cmd, capture_output=True, text=True, input=input_text)
+    finally:
+        # «wg set», «wg show»: без аргументов, чтобы не плодить метки
+        METRICS.observe("subprocess_duration_seconds", time.perf_counter() - started, cmd=" ".join(cmd[:2]))
+
+
+class PeerDump(NamedTuple):
+    public_key: str
+    endpoint: str
+    allowed_ips: str
+    latest_handshake: int
+    rx_bytes: int
+    tx_bytes: int
+
+
+def parse_dump(output: str) -> List[PeerDump]:
+    """Разбор `wg show <iface> dump`: первая строка — интерфейс, дальше по строке на пира."""
+    peers = []
+    for line in output.splitlines()[1:]:
+        parts = line.split("\t")
+        if len(parts) < 8:
+            continue
+        try:
+            peers.append(PeerDump(parts[0], parts[2], parts[3], int(parts[4]), int(parts[5]), int(parts[6])))
+        except ValueError:
+            continue
+    return peers
+
+
+class PeerBatch:
+    """Накопитель изменений пиров; применяется одним вызовом бэкенда."""
+
+    def __init__(self, backend: "WGBackend"):
+        self.backend = backend
+        self.adds: Dict[str, str] = {}
+        self.removes: Dict[str, None] = {}
+
+    def set_peer(self, public_key: str, allowed_ips: str):
+        self.removes.pop(public_key, None)
+        self.adds[public_key] = allowed_ips
+
+    def remove_peer(self, public_key: str):
+        self.adds.pop(public_key, None)
+        self.removes[public_key] = None
+
+    def __len__(self):
+        return len(self.adds) + len(self.removes)
+
+    def apply(self) -> bool:
+        if not self:
+            return True
+        ok = self.backend.apply(list(self.adds.items()), list(self.removes))
+        self.adds.clear()
+        self.removes.clear()
+        return ok
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            pending = len(self)
+            if not self.apply():
+                # часть чанков `wg set` не прошла — молча терять пакет нельзя
+                logger.error("wg peer batch on %s failed (%s changes)", self.backend.interface, pending)
+
+
+class WGBackend(abc.ABC):
+    def __init__(self, interface: str):
+        self.interface = interface
+
+    @abc.abstractmethod
+    def apply(self, adds: List[Tuple[str, str]], removes: List[str]) -> bool:
+        """Добавить/обновить пиров из adds и удалить removes; False — хотя бы одна операция не прошла."""
+
+    def set_peer(self, public_key: str, allowed_ips: str) -> bool:
+        return self.apply([(public_key, allowed_ips)], [])
+
+    def remove_peer(self, public_key: str) -> bool:
+        return self.apply([], [public_key])
+
+    def batch(self) -> PeerBatch:
+        return PeerBatch(self)
+
+    @abc.abstractmethod
+    def dump(self) -> Optional[List[PeerDump]]:
+        """Состояние пиров интерфейса (аналог `wg show <iface> dump`); None — ошибка."""
+
+
+class SubprocessBackend(WGBackend):
+    def apply(self, adds, removes) -> bool:
+        ops = [["peer", key, "allowed-ips", ips.replace(" ", "")] for key, ips in adds]
+        ops += [["peer", key, "remove"] for key in removes]
+        ok = True
+        for start in range(0, len(ops), BATCH_CHUNK):
+            chunk = ops[start:start + BATCH_CHUNK]
+            cmd = ["wg", "set", self.interface]
+            for op in chunk:
+                cmd.extend(op)
+            res = run_cmd(cmd)
+            if res.returncode != 0:
+                logger.error("wg set failed (%s peers): %s", len(chunk), res.stderr.strip())
+                ok = False
+        return ok
+
+    def dump(self):
+        res = run_cmd(["wg", "show", self.interface, "dump"])
+        if res.returncode != 0:
+            logger.error("wg show dump failed: %s", res.stderr.strip())
+            return None
+        return parse_dump(res.stdout)
+
+
+class FakeBackend(WGBackend):
+    """Пиры в памяти; calls считает «форки», которые сделал бы настоящий бэкенд."""
+
+    def __init__(self, interface: str):
+        super().__init__(interface)
+        self.peers: Dict[str, str] = {}
+        # public_key -> (latest_handshake, rx_bytes, tx_bytes); задаётся извне (бенчмарки, отладка)
+        self.counters: Dict[str, Tuple[int, int, int]] = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def apply(self, adds, removes) -> bool:
+        with self._lock:
+            self.calls += 1
+            for key, ips in adds:
+                self.peers[key] = ips
+            for key in removes:
+                self.peers.pop(key, None)
+                self.counters.pop(key, None)
+        return True
+
+    def dump(self):
+        with self._lock:
+            return [
+                PeerDump(key, "(none)", ips, *self.counters.get(key, (0, 0, 0)))
+                for key, ips in self.peers.items()
+            ]
+
+
+BACKENDS = {
+    "subprocess": SubprocessBackend,
+    "fake": FakeBackend,
+}
+
+
+def make_backend(name: str, interface: str) -> WGBackend:
+    try:
+        return BACKENDS[name](interface)
+    except KeyError:
+        logger.warning("Unknown WG_BACKEND %r, falling back to subprocess", name)
+        return SubprocessBackend(interface)
+
@@ -0,0 +1,148 @@
+"""
+Генерация ключей WireGuard (X25519) внутри процесса.
+
+Заменяет пару форков `wg genkey` + `wg pubkey`. Если установлен пакет
+cryptography — используется его реализация (OpenSSL), иначе чистый Python
+по RFC 7748. Ключи совместимы с `wg`: 32 байта в base64, приватный ключ
+«зажат» (clamped) так же, как это делает `wg genkey`.
+
+KeyPool держит запас заранее сгенерированных пар и пополняет его в фоновом
+потоке, чтобы create_client_conf не ждал генерации внутри транзакции.
+"""
+import base64
+import logging
+import os
+import threading
+from collections import deque
+from typing import Optional, Tuple
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives import serialization
+except ImportError:  # cryptography не установлен — работаем на чистом Python
+    X25519PrivateKey = None
+
+
+logger = logging.getLogger("securelink")
+
+_P = 2 ** 255 - 19
+_A24 = 121665
+
+
+def _clamp(key: bytes) -> bytes:
+    k = bytearray(key)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+
+def _x25519_base(scalar: bytes) -> bytes:
+    """Умножение базовой точки (u=9) на скаляр, лестница Монтгомери (RFC 7748)."""
+    k = int.from_bytes(_clamp(scalar), "little")
+    x1 = 9
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in range(254, -1, -1):
+        k_t = (k >> t) & 1
+        swap ^= k_t
+        if swap:
+            x2, x3 = x3, x2
+            z2, z3 = z3, z2
+        swap = k_t
+        a = (x2 + z2) % _P
+        aa = a * a % _P
+        b = (x2 - z2) % _P
+        bb = b * b % _P
+        e = (aa - bb) % _P
+        c = (x3 + z3) % _P
+        d = (x3 - z3) % _P
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) % _P
+        x3 = x3 * x3 % _P
+        z3 = (da - cb) % _P
+        z3 = x1 * (z3 * z3 % _P) % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, x3 = x3, x2
+        z2, z3 = z3, z2
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def _public_bytes(private: bytes) -> bytes:
+    if X25519PrivateKey is not None:
+        return X25519PrivateKey.from_private_bytes(private).public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+    return _x25519_base(private)
+
+
+def derive_public_key(private_key: str) -> str:
+    """Аналог `wg pubkey`: base64 приватного ключа -> base64 публичного."""
+    private = base64.b64decode(private_key.strip())
+    if len(private) != 32:
+        raise ValueError("WireGuard private key must be 32 bytes")
+    return base64.b64encode(_public_bytes(private)).decode()
+
+
+def generate_keypair() -> Tuple[str, str]:
+    """Аналог `wg genkey | wg pubkey`: (private_b64, public_b64)."""
+    private = _clamp(os.urandom(32))
+    return base64.b64encode(private).decode(), base64.b64encode(_public_bytes(private)).decode()
+
+
+class KeyPool:
+    """Запас готовых пар ключей с фоновым пополнением."""
+
+    def __init__(self, size: int = 64, low_watermark: Optional[int] = None):
+        self.size = size
+        self.low_watermark = size // 2 if low_watermark is None else low_watermark
+        self._keys = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop, name="wg-keypool", daemon=True)
+            self._thread.start()
+            self._wakeup.set()
+        return self
+
+    def _refill_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                while len(self._keys) < self.size:
+                    self._keys.append(generate_keypair())
+            except Exception:
+                logger.exception("Key pool refill failed")
+
+    def get(self) -> Tuple[str, str]:
+        try:
+            pair = self._keys.popleft()
+            self.hits += 1
+        except IndexError:
+            # пул пуст (старт или всплеск) — генерируем на месте
+            pair = generate_keypair()
+            self.misses += 1
+        if len(self._keys) <= self.low_watermark:
+            self._wakeup.set()
+        return pair
+
+    def __len__(self):
+        return len(self._keys)
+
+
+KEY_POOL: Optional[KeyPool] = None
+
+
+def init_key_pool(size: int = 64) -> KeyPool:
+    global KEY_POOL
+    if KEY_POOL is None:
+        KEY_POOL = KeyPool(size).start()
+    return KEY_POOL
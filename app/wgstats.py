@@ -0,0 +1,164 @@
+"""
+Сэмплер статистики WireGuard, общий для всех воркеров.
+
+Ровно один процесс (тот, кто взял flock на <snapshot>.lock) раз в
+WG_STATS_INTERVAL секунд вызывает `wg show <iface> dump`, считает
+сглаженные (EWMA) скорости и атомарно публикует снимок JSON-файлом.
+Обработчики запросов только читают снимок — с кешем по mtime, так что
+повторные чтения между сэмплами не трогают даже диск. Снимок старше
+нескольких интервалов (сэмплер умер, а новый ещё не взял flock) считается
+устаревшим: читатели получают пустой список пиров, а не замершие скорости.
+"""
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from .wgbackend import WGBackend
+
+
+logger = logging.getLogger("securelink")
+
+# Через сколько пропущенных интервалов снимок считается устаревшим
+STALE_INTERVALS = 3
+
+
+class StatsSampler:
+    def __init__(self, backend: WGBackend, snapshot_path: str, interval: float = 5.0, alpha: float = 0.3,
+                 listeners: Iterable[Callable[[Dict[str, Any]], None]] = ()):
+        self.backend = backend
+        # вызываются с каждым снимком, только в процессе-сэмплере (история трафика и т.п.)
+        self.listeners = list(listeners)
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.alpha = alpha
+        self._prev: Dict[str, Dict[str, Any]] = {}
+        self._prev_time: Optional[float] = None
+        self._lock_file = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _try_lead(self) -> bool:
+        if self._lock_file is not None:
+            return True
+        lock_file = open(self.snapshot_path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info("WG stats sampler running in pid %s", os.getpid())
+        return True
+
+    def sample(self) -> Optional[Dict[str, Any]]:
+        peers = self.backend.dump()
+        if peers is None:
+            return None
+        now = time.time()
+        dt = max(now - self._prev_time, 1e-3) if self._prev_time else None
+        stats = {}
+        for peer in peers:
+            prev = self._prev.get(peer.public_key)
+            speed_rx = speed_tx = 0.0
+            last_seen = peer.latest_handshake
+            if prev is not None and dt:
+                # счётчики обнуляются при перезапуске интерфейса — тогда дельта = текущее значение
+                d_rx = peer.rx_bytes - prev["rx_bytes"] if peer.rx_bytes >= prev["rx_bytes"] else peer.rx_bytes
+                d_tx = peer.tx_bytes - prev["tx_bytes"] if peer.tx_bytes >= prev["tx_bytes"] else peer.tx_bytes
+                speed_rx = self.alpha * (d_rx / dt) + (1 - self.alpha) * prev["speed_rx"]
+                speed_tx = self.alpha * (d_tx / dt) + (1 - self.alpha) * prev["speed_tx"]
+                last_seen = max(last_seen, prev["last_seen"])
+                if d_rx or d_tx:
+                    last_seen = int(now)
+            stats[peer.public_key] = {
+                "rx_bytes": peer.rx_bytes,
+                "tx_bytes": peer.tx_bytes,
+                "speed_rx": round(speed_rx, 1),
+                "speed_tx": round(speed_tx, 1),
+                "last_handshake": peer.latest_handshake,
+                "last_seen": last_seen,
+                "endpoint": peer.endpoint,
+            }
+        self._prev = stats
+        self._prev_time = now
+        snapshot = {"ts": now, "interval": self.interval, "peers": stats}
+        self._publish(snapshot)
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logger.exception("WG stats listener %r failed", listener)
+        return snapshot
+
+    def _publish(self, snapshot: Dict[str, Any]):
+        directory = os.path.dirname(self.snapshot_path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".wgstats.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f, separators=(",", ":"))
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _loop(self):
+        while True:
+            if not self._try_lead():
+                # сэмплер уже работает в другом процессе; flock без ожидания дёшев, поэтому
+                # проверяем чаще, чем StatsReader сочтёт снимок устаревшим: после смерти
+                # лидера новый снимок появляется раньше, чем читатели останутся без пиров
+                time.sleep(self.interval * 2)
+                continue
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                logger.exception("WG stats sampling error: %s", e)
+            time.sleep(max(self.interval - (time.monotonic() - started), 0.1))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="wg-stats", daemon=True)
+            self._thread.start()
+        return self
+
+
+class StatsReader:
+    """Чтение опубликованного снимка с кешем по mtime."""
+
+    def __init__(self, snapshot_path: str, interval: float = 5.0, stale_intervals: int = STALE_INTERVALS):
+        self.snapshot_path = snapshot_path
+        self.max_age = interval * stale_intervals
+        self._mtime = None
+        self._snapshot: Dict[str, Any] = {"ts": 0, "peers": {}}
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = self._load()
+        if time.time() - snapshot.get("ts", 0) > self.max_age:
+            return {"ts": snapshot.get("ts", 0), "peers": {}, "stale": True}
+        return snapshot
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            return self._snapshot
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        with open(self.snapshot_path) as f:
+                            self._snapshot = json.load(f)
+                        self._mtime = mtime
+                    except (OSError, ValueError):
+                        logger.warning("Failed to read WG stats snapshot %s", self.snapshot_path)
+        return self._snapshot
+
+    def peers(self) -> Dict[str, Dict[str, Any]]:
+        return self.snapshot().get("peers", {})
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота: тысячи одновременных /start, латентность хендлера.
+
+Апдейты подаются прямо в Dispatcher (dp.feed_update), Telegram API заменён
+фейковой сессией с задержкой --api-latency, БД — настоящая (PG_* / DATABASE_URL).
+Режим --inline выполняет запросы прямо в event loop, как было до BotDB,
+чтобы сравнить хвосты латентности.
+
+    python bench/bench_bot_start.py -n 5000 -c 1000
+    python bench/bench_bot_start.py -n 5000 -c 1000 --inline
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Bot() проверяет формат токена; в сеть бенчмарк не ходит
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:BENCHMARK-token")
+
+from aiogram import types  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+
+import simple_bot  # noqa: E402
+from app.db import init_db_pool, get_conn  # noqa: E402
+
+# Синтетические telegram_id, чтобы не пересечься с настоящими пользователями
+BASE_TELEGRAM_ID = 9_000_000_000
+
+
+class FakeSession(BaseSession):
+    """Отвечает на вызовы Bot API без сети, с заданной задержкой."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMessage):
+            return types.Message(
+                message_id=self.calls,
+                date=datetime.now(timezone.utc),
+                chat=types.Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_update(i: int) -> types.Update:
+    telegram_id = BASE_TELEGRAM_ID + i
+    return types.Update.model_validate({
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "Load", "username": f"load{i}"},
+            "text": "/start",
+        },
+    }, context={"bot": simple_bot.bot})
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run(args):
+    simple_bot.bot.session = FakeSession(args.api_latency)
+    if args.inline:
+        # прежнее поведение: блокирующий запрос прямо в event loop
+        async def inline_run(func, *fargs):
+            return simple_bot.db._call(func, fargs)
+        simple_bot.db.run = inline_run
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await simple_bot.dp.feed_update(simple_bot.bot, make_update(i % args.users))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.n)))
+    elapsed = time.perf_counter() - started
+
+    mode = "inline (блокирующий)" if args.inline else f"BotDB, {simple_bot.db.max_workers} потоков"
+    print(f"режим: {mode}; апдейтов {args.n}, одновременно до {args.concurrency}")
+    print(f"время {elapsed:.2f} c, {args.n / elapsed:.1f} апдейтов/с")
+    for p in (50, 90, 99):
+        print(f"p{p:<3} {percentile(latencies, p) * 1000:9.1f} мс")
+    print(f"max  {max(latencies) * 1000:9.1f} мс")
+
+
+def cleanup(users: int):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM users WHERE telegram_id >= %s AND telegram_id < %s;",
+                (BASE_TELEGRAM_ID, BASE_TELEGRAM_ID + users)
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", type=int, default=5000, help="число апдейтов /start")
+    parser.add_argument("-c", "--concurrency", type=int, default=1000, help="одновременных апдейтов")
+    parser.add_argument("--users", type=int, default=2000, help="разных пользователей (остальные — повторные /start)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="задержка фейкового Bot API, c")
+    parser.add_argument("--inline", action="store_true", help="запросы в event loop (как до BotDB)")
+    parser.add_argument("--keep", action="store_true", help="не удалять синтетических пользователей")
+    args = parser.parse_args()
+
+    init_db_pool()
+    simple_bot.db.start()
+    try:
+        asyncio.run(run(args))
+    finally:
+        simple_bot.db.close()
+        if not args.keep:
+            cleanup(args.users)
+
+
+if __name__ == "__main__":
+    main()
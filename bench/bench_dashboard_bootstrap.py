@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк загрузки личного кабинета: запросов, SQL и серверного времени на страницу.
+
+«До» — прежняя загрузка dashboard.js: /auth/me, /api/user/subscriptions,
+/api/user/traffic, /api/user/notifications и /api/user/configs, каждый со
+своей проверкой JWT и своим соединением из пула. «После» — /api/user/bootstrap
+параллельно с /api/user/traffic (живые счётчики wg в bootstrap не входят).
+«Повторный заход» — то же с If-None-Match от прошлого ответа: bootstrap
+отвечает 304 без тела.
+
+Серверная сторона берётся из /metrics (сумма по всем воркерам): разница
+http_request_duration_seconds_sum, db_query_duration_seconds_count и
+db_pool_hold_seconds_count до и после сценария. Поэтому сервер должен быть
+свободен от посторонней нагрузки, а между замерами выдерживается
+--settle секунд (METRICS_FLUSH_INTERVAL остальных воркеров). Пользователи и
+JWT — из bench/seed_data.py; перед замерами каждый токен один раз проходит
+/api/user/bootstrap, чтобы кеш сессий был прогрет одинаково для всех
+сценариев.
+
+    python bench/seed_data.py --users 100000 --live-sessions 500
+    python bench/bench_dashboard_bootstrap.py -n 2000 -c 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp  # noqa: E402
+
+DEFAULT_TOKENS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".seed_tokens.json")
+
+LEGACY_ENDPOINTS = (
+    "/auth/me",
+    "/api/user/subscriptions",
+    "/api/user/traffic",
+    "/api/user/notifications",
+    "/api/user/configs",
+)
+
+_SAMPLE_RE = re.compile(r"^securelink_(\w+?)(_sum|_count)(?:\{[^}]*\})? (\S+)$")
+# http-время считается только по маршрутам кабинета, без самого /metrics
+_HTTP_ROUTE_RE = re.compile(r'route="(/auth/me|/api/user/[^"]*)"')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def scrape(session: aiohttp.ClientSession, base_url: str, token: str = None) -> dict:
+    """Суммы гистограмм /metrics по имени метрики (для http — только маршруты кабинета)."""
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    async with session.get(base_url + "/metrics", headers=headers) as resp:
+        if resp.status != 200:
+            raise SystemExit(f"/metrics: HTTP {resp.status} (нужен --metrics-token?)")
+        text = await resp.text()
+    totals = defaultdict(float)
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        name, suffix, value = match.groups()
+        if name == "http_request_duration_seconds" and not _HTTP_ROUTE_RE.search(line):
+            continue
+        totals[name + suffix] += float(value)
+    return totals
+
+
+class PageLoad:
+    """Одна загрузка кабинета по сценарию; запросы, байты и 304 копятся в счётчиках."""
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str):
+        self.session = session
+        self.base_url = base_url
+        self.etags = {}
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.errors = defaultdict(int)
+
+    async def get(self, path: str, token: str, etag: str = None):
+        headers = {"Authorization": f"Bearer {token}"}
+        if etag:
+            headers["If-None-Match"] = etag
+        async with self.session.get(self.base_url + path, headers=headers) as resp:
+            body = await resp.read()
+            self.requests += 1
+            self.bytes += len(body)
+            if resp.status == 304:
+                self.not_modified += 1
+            elif resp.status != 200:
+                self.errors[f"{path} {resp.status}"] += 1
+            return resp.headers.get("ETag")
+
+    async def legacy(self, token: str):
+        # как прежний dashboard.js: по очереди, каждый со своей проверкой JWT
+        for path in LEGACY_ENDPOINTS:
+            await self.get(path, token)
+
+    async def bootstrap(self, token: str):
+        etag, _ = await asyncio.gather(self.get("/api/user/bootstrap", token), self.get("/api/user/traffic", token))
+        self.etags[token] = etag
+
+    async def revisit(self, token: str):
+        etag, _ = await asyncio.gather(
+            self.get("/api/user/bootstrap", token, self.etags.get(token)),
+            self.get("/api/user/traffic", token),
+        )
+        self.etags[token] = etag
+
+
+async def run_scenario(args, session: aiohttp.ClientSession, loader: PageLoad, name: str, tokens: list) -> dict:
+    method = getattr(loader, name)
+    loader.requests = loader.not_modified = loader.bytes = 0
+    loader.errors.clear()
+    before = await scrape(session, args.base_url, args.metrics_token)
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(args.pages):
+        queue.put_nowait(tokens[i % len(tokens)])
+
+    async def worker():
+        while not queue.empty():
+            token = queue.get_nowait()
+            started = time.perf_counter()
+            await method(token)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(args.settle)
+    after = await scrape(session, args.base_url, args.metrics_token)
+
+    pages = len(latencies)
+    delta = {key: after[key] - before.get(key, 0.0) for key in after}
+    return {
+        "pages": pages,
+        "pages_per_s": pages / elapsed,
+        "requests_per_page": loader.requests / pages,
+        "not_modified_ratio": loader.not_modified / loader.requests,
+        "bytes_per_page": loader.bytes / pages,
+        "client_p50_ms": percentile(latencies, 50) * 1000,
+        "client_p95_ms": percentile(latencies, 95) * 1000,
+        "server_ms_per_page": delta.get("http_request_duration_seconds_sum", 0.0) / pages * 1000,
+        "sql_per_page": delta.get("db_query_duration_seconds_count", 0.0) / pages,
+        "connections_per_page": delta.get("db_pool_hold_seconds_count", 0.0) / pages,
+        "errors": dict(loader.errors),
+    }
+
+
+async def run(args, tokens: list) -> dict:
+    connector = aiohttp.TCPConnector(limit=args.concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    results = {}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        loader = PageLoad(session, args.base_url)
+        print(f"[bootstrap] warming session cache for {len(tokens)} tokens")
+        for token in tokens:
+            await loader.get("/api/user/bootstrap", token)
+        await asyncio.sleep(args.settle)
+        for name in ("legacy", "bootstrap", "revisit"):
+            results[name] = await run_scenario(args, session, loader, name, tokens)
+            print(f"[bootstrap] {name}: {json.dumps(results[name], ensure_ascii=False)}", flush=True)
+    return results
+
+
+def report(results: dict):
+    rows = (
+        ("requests_per_page", "запросов на страницу", "{:.2f}"),
+        ("connections_per_page", "соединений из пула", "{:.2f}"),
+        ("sql_per_page", "SQL-операторов", "{:.2f}"),
+        ("server_ms_per_page", "серверное время, мс", "{:.2f}"),
+        ("client_p50_ms", "клиент p50, мс", "{:.1f}"),
+        ("client_p95_ms", "клиент p95, мс", "{:.1f}"),
+        ("bytes_per_page", "байт на страницу", "{:.0f}"),
+        ("not_modified_ratio", "доля 304", "{:.2f}"),
+        ("pages_per_s", "страниц/с", "{:.1f}"),
+    )
+    print(f"{'':<24}{'до':>12}{'bootstrap':>12}{'повторно':>12}")
+    for key, title, fmt in rows:
+        print(f"{title:<24}" + "".join(f"{fmt.format(results[name][key]):>12}"
+                                       for name in ("legacy", "bootstrap", "revisit")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://127.0.0.1:9000")
+    parser.add_argument("-n", "--pages", type=int, default=1000, help="загрузок кабинета на сценарий")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--tokens", default=DEFAULT_TOKENS_PATH, help="файл из seed_data.py")
+    parser.add_argument("--metrics-token", default=os.environ.get("METRICS_TOKEN"))
+    parser.add_argument("--settle", type=float, default=float(os.environ.get("METRICS_FLUSH_INTERVAL", 5)) + 1,
+                        help="пауза перед чтением /metrics, c")
+    parser.add_argument("--timeout", type=float, default=30.0, help="таймаут запроса, c")
+    parser.add_argument("--json-out", help="сохранить результаты")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+
+    with open(args.tokens) as f:
+        tokens = [item["token"] for item in json.load(f)["tokens"]]
+    if not tokens:
+        raise SystemExit(f"{args.tokens} has no live sessions: rerun bench/seed_data.py")
+
+    results = asyncio.run(run(args, tokens))
+    report(results)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "metrics_token"}, **results},
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк генерации ключей WireGuard: пар ключей в секунду.
+
+Сравнивает прежний путь (`wg genkey` + `wg pubkey`, два форка на пару),
+генерацию внутри процесса и выдачу из KeyPool.
+
+    python bench/bench_keygen.py -n 2000
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import wgkeys  # noqa: E402
+from app.wg import wg_gen_keypair_subprocess  # noqa: E402
+
+
+def measure(name, func, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {n:>7} пар  {elapsed:8.3f} c  {n / elapsed:10.1f} пар/с")
+    return n / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", type=int, default=1000, help="число пар для in-process вариантов")
+    parser.add_argument("--subprocess-n", type=int, default=200, help="число пар для `wg` (медленно)")
+    args = parser.parse_args()
+
+    backend = "cryptography" if wgkeys.X25519PrivateKey is not None else "pure python"
+    print(f"X25519 backend: {backend}")
+
+    results = {}
+    if shutil.which("wg"):
+        results["subprocess"] = measure("wg genkey | wg pubkey", wg_gen_keypair_subprocess, args.subprocess_n)
+    else:
+        print("wg не найден — путь через subprocess пропущен")
+
+    results["inprocess"] = measure("in-process X25519", wgkeys.generate_keypair, args.n)
+
+    # Пул заранее заполнен: меряем то, что видит create_client_conf
+    pool = wgkeys.KeyPool(size=args.n)
+    while len(pool) < args.n:
+        pool._keys.append(wgkeys.generate_keypair())
+    results["pool"] = measure("KeyPool.get (прогретый)", pool.get, args.n)
+
+    if "subprocess" in results:
+        print(f"ускорение in-process vs subprocess: x{results['inprocess'] / results['subprocess']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Стресс-тест пула соединений: потоков больше, чем соединений.
+
+Каждый из --threads потоков в цикле берёт соединение через ConnectionPool,
+держит его --hold мс (pg_sleep на сервере — как медленный запрос) и
+возвращает. Печатает пропускную способность, перцентили ожидания в
+acquire() и число отказов по таймауту, затем stats() пула. С --leak один
+поток не отдаёт соединение дольше порога утечки — в лог должно попасть
+предупреждение со стеком этого потока.
+
+    python bench/bench_pool.py --threads 32 --max 8 --hold 20 --duration 10
+    python bench/bench_pool.py --leak --leak-seconds 2
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import get_dsn  # noqa: E402
+from app.pool import ConnectionPool, PoolTimeout  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def worker(pool, hold, stop_at, waits, counts, lock):
+    while time.monotonic() < stop_at:
+        started = time.monotonic()
+        try:
+            conn = pool.acquire()
+        except PoolTimeout:
+            with lock:
+                counts["timeouts"] += 1
+            continue
+        waited = time.monotonic() - started
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_sleep(%s);", (hold,))
+            conn.commit()
+        finally:
+            pool.release(conn)
+        with lock:
+            waits.append(waited)
+            counts["ok"] += 1
+
+
+def leaker(pool, seconds):
+    conn = pool.acquire()
+    try:
+        time.sleep(seconds)  # «забытое» соединение: сторож пула должен показать этот кадр
+    finally:
+        pool.release(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--max", type=int, default=8, help="размер пула")
+    parser.add_argument("--hold", type=float, default=20, help="удержание соединения, мс")
+    parser.add_argument("--timeout", type=float, default=1.0, help="таймаут acquire, с")
+    parser.add_argument("--duration", type=float, default=10, help="длительность, с")
+    parser.add_argument("--leak", action="store_true", help="один поток удерживает соединение дольше порога")
+    parser.add_argument("--leak-seconds", type=float, default=3, help="порог предупреждения об утечке, с")
+    parser.add_argument("--statement-timeout", type=int, default=0, help="statement_timeout, мс")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    pool = ConnectionPool(
+        get_dsn(), minconn=1, maxconn=args.max, timeout=args.timeout,
+        leak_seconds=args.leak_seconds, statement_timeout_ms=args.statement_timeout,
+        trace_borrow=args.leak, name="bench",
+    )
+    waits, counts, lock = [], {"ok": 0, "timeouts": 0}, threading.Lock()
+    stop_at = time.monotonic() + args.duration
+    threads = [
+        threading.Thread(target=worker, args=(pool, args.hold / 1000, stop_at, waits, counts, lock), daemon=True)
+        for _ in range(args.threads)
+    ]
+    if args.leak:
+        # первым, пока пул не насыщен: иначе сам «утечник» получит PoolTimeout
+        threads.insert(0, threading.Thread(target=leaker, args=(pool, args.leak_seconds * 2 + 5), name="leaker", daemon=True))
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    ideal = args.max / (args.hold / 1000) if args.hold else float("inf")
+    print(f"threads={args.threads} pool={args.max} hold={args.hold:.0f}ms")
+    print(f"acquired {counts['ok']} за {elapsed:.1f} c: {counts['ok'] / elapsed:.1f}/с (предел ~{ideal:.0f}/с)")
+    print(f"timeouts {counts['timeouts']}")
+    print("wait ms  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+        *(1000 * percentile(waits, q) for q in (0.5, 0.95, 0.99, 1.0))
+    ))
+    print(json.dumps(pool.stats(), ensure_ascii=False, indent=2))
+    pool.closeall()
+    return 1 if args.leak and not pool.counters["leaks"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
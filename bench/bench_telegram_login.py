@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк входа через Telegram Web App: входов в секунду до и после.
+
+«До» — прежний путь /auth/telegram, воспроизведённый здесь: секрет
+HMAC считается на каждый вызов, SELECT пользователя, UPDATE или INSERT,
+SELECT log_user_activity, COMMIT и вторая транзакция с INSERT в
+user_sessions. «После» — UserManager.verify_telegram_init_data +
+login_telegram: один оператор INSERT ... ON CONFLICT ... RETURNING с
+сессией в той же транзакции, лог входа — пачками через ActivityLog.
+
+Каждый вход — свежие initData (свой query_id), подписанные --bot-token, по
+--users пользователям с telegram_id 8_000_000_000 + N; в конце они
+удаляются вместе с сессиями и логом (ON DELETE CASCADE).
+
+    python bench/bench_telegram_login.py -n 5000 --users 500 --threads 8
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt  # noqa: E402
+
+from app.db import init_db_pool, get_conn  # noqa: E402
+from services.activity import ActivityLog  # noqa: E402
+from user_manager import (  # noqa: E402
+    JWT_ALGORITHM, JWT_EXPIRATION_HOURS, JWT_SECRET, UserManager, token_digest, webapp_secret,
+)
+
+TELEGRAM_BASE = 8_000_000_000
+
+
+def make_init_data(bot_token: str, n: int, seq: int) -> str:
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"bench-{n}-{seq}",
+        "user": json.dumps({"id": TELEGRAM_BASE + n, "first_name": "Bench", "username": f"bench_{n}",
+                            "language_code": "ru"}),
+    }
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    fields["hash"] = hmac.new(webapp_secret(bot_token), data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+# ---------- «До»: прежний путь, шаг за шагом ----------
+def legacy_login(init_data: str, bot_token: str):
+    parsed = parse_qs(init_data)
+    received_hash = parsed["hash"][0]
+    secret_key = hmac.new("WebAppData".encode(), bot_token.encode(), hashlib.sha256).digest()
+    hmac.new(secret_key, init_data.replace(f"&hash={received_hash}", "").encode(), hashlib.sha256).hexdigest()
+    user = json.loads(parse_qs(init_data)["user"][0])
+    now = datetime.now(timezone.utc)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, telegram_id, username, first_name, last_name, email,
+                       language_code, created_at, last_login, is_active, settings
+                FROM users WHERE telegram_id = %s
+            """, (user["id"],))
+            row = cur.fetchone()
+            if row:
+                user_id = row[0]
+                cur.execute("""
+                    UPDATE users SET username = %s, first_name = %s, last_name = %s,
+                        language_code = %s, last_login = %s
+                    WHERE telegram_id = %s
+                """, (user.get("username"), user.get("first_name", ""), user.get("last_name", ""),
+                      user.get("language_code", "ru"), now, user["id"]))
+            else:
+                cur.execute("""
+                    INSERT INTO users (telegram_id, username, first_name, last_name, language_code, last_login)
+                    VALUES (%s, %s, %s, %s, %s, %s) RETURNING id, created_at
+                """, (user["id"], user.get("username"), user.get("first_name", ""), user.get("last_name", ""),
+                      user.get("language_code", "ru"), now))
+                user_id = cur.fetchone()[0]
+            cur.execute("SELECT log_user_activity(%s, %s, %s, %s, %s)",
+                        (user_id, "login", json.dumps({"method": "telegram"}), None, None))
+    expires_at = now + timedelta(hours=JWT_EXPIRATION_HOURS)
+    token = jwt.encode({"user_id": user_id, "iat": now, "exp": expires_at, "type": "access_token",
+                        "jti": os.urandom(6).hex()}, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # столбец теперь token_hash (migrations/004); остальной путь — как был
+            cur.execute("INSERT INTO user_sessions (user_id, token_hash, expires_at) VALUES (%s, %s, %s)",
+                        (user_id, token_digest(token), expires_at))
+    return token
+
+
+def run(name, login, args):
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(args.n))
+    failures = [0]
+
+    def worker():
+        for seq in counter:
+            init_data = make_init_data(args.bot_token, seq % args.users, seq)
+            started = time.perf_counter()
+            ok = login(init_data)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - started
+    latencies.sort()
+    p = lambda q: 1000 * latencies[min(len(latencies) - 1, int(q * len(latencies)))]  # noqa: E731
+    print(f"{name:<8} {args.n / total:9.1f} входов/с  p50 {p(0.5):6.2f} мс  p95 {p(0.95):6.2f} мс  "
+          f"ошибок {failures[0]}")
+    return args.n / total
+
+
+def cleanup(users: int):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM users WHERE telegram_id BETWEEN %s AND %s;",
+                        (TELEGRAM_BASE, TELEGRAM_BASE + users))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", type=int, default=2000, help="число входов на вариант")
+    parser.add_argument("--users", type=int, default=200, help="разных пользователей (повторные входы — UPDATE)")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--bot-token", default="123456:bench-token")
+    args = parser.parse_args()
+
+    init_db_pool()
+    activity_log = ActivityLog(get_conn).start()
+    manager = UserManager(get_conn, activity_log=activity_log)
+
+    def current_login(init_data):
+        fields = manager.verify_telegram_init_data(init_data, args.bot_token)
+        return fields and manager.login_telegram(fields["user"])[1]
+
+    cleanup(args.users)
+    try:
+        before = run("before", lambda data: legacy_login(data, args.bot_token), args)
+        # первые входы «после» заново создают пользователей, как и «до»
+        cleanup(args.users)
+        after = run("after", current_login, args)
+    finally:
+        activity_log.stop()
+        cleanup(args.users)
+    print(f"speedup x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+    main()
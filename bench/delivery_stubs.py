@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Локальные заглушки для outbox: SMTP-сервер и фейковый Telegram Bot API.
+
+Запуск заглушек для ручной проверки приложения:
+
+    python bench/delivery_stubs.py --fail-rate 0.2 --rate-limit 0.1
+    SMTP_SERVER=127.0.0.1 SMTP_PORT=2525 SMTP_STARTTLS=false \\
+    TELEGRAM_API_URL=http://127.0.0.1:8081 gunicorn ... App:app
+
+Самопроверка отправителей (без БД): письма идут через одно SMTP-соединение,
+429 превращается в RetryLater, 403 — в PermanentError.
+
+    python bench/delivery_stubs.py --selftest -n 200
+"""
+import argparse
+import json
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATS = {"smtp_connections": 0, "smtp_messages": 0, "tg_requests": 0, "tg_429": 0, "tg_500": 0}
+_stats_lock = threading.Lock()
+
+
+def bump(key: str):
+    with _stats_lock:
+        STATS[key] += 1
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    """Минимальный ESMTP без TLS/AUTH: принимает и отбрасывает письма."""
+
+    def reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        bump("smtp_connections")
+        self.reply("220 stub ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-stub")
+                self.reply("250 8BITMIME")
+            elif command.startswith(("HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                if command.startswith("RCPT") and "REJECT" in command:
+                    self.reply("550 mailbox unavailable")
+                else:
+                    self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                bump("smtp_messages")
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class ThreadingSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_telegram_handler(fail_rate: float, rate_limit: float):
+    class TelegramStubHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def respond(self, code: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            bump("tg_requests")
+            roll = random.random()
+            if self.path.startswith("/botblocked/"):
+                self.respond(403, {"ok": False, "description": "Forbidden: bot was blocked by the user"})
+            elif roll < rate_limit:
+                bump("tg_429")
+                self.respond(429, {"ok": False, "parameters": {"retry_after": 1}})
+            elif roll < rate_limit + fail_rate:
+                bump("tg_500")
+                self.respond(500, {"ok": False})
+            else:
+                self.respond(200, {"ok": True, "result": {"message_id": STATS["tg_requests"]}})
+
+    return TelegramStubHandler
+
+
+def start_stubs(smtp_port: int, tg_port: int, fail_rate: float, rate_limit: float):
+    smtp = ThreadingSMTPServer(("127.0.0.1", smtp_port), SMTPStubHandler)
+    tg = ThreadingHTTPServer(("127.0.0.1", tg_port), make_telegram_handler(fail_rate, rate_limit))
+    for server in (smtp, tg):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return smtp, tg
+
+
+def selftest(args):
+    from app.delivery import PermanentError, RetryLater, SMTPSender, TelegramSender
+
+    conf = tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False)
+    conf.write("[Interface]\nPrivateKey = stub\n")
+    conf.close()
+
+    sender = SMTPSender("127.0.0.1", args.smtp_port, from_email="noreply@example.com", starttls=False)
+    started = time.perf_counter()
+    for i in range(args.n):
+        sender.send({"to": f"user{i}@example.com", "conf_path": conf.name})
+    elapsed = time.perf_counter() - started
+    try:
+        sender.send({"to": "reject@example.com", "conf_path": conf.name})
+        rejected = "не отклонён"
+    except PermanentError:
+        rejected = "PermanentError"
+    sender.close()
+    print(f"SMTP: {args.n} писем за {elapsed:.3f} c через {STATS['smtp_connections']} соединение(й); "
+          f"отказ адресата -> {rejected}")
+
+    tg = TelegramSender("123:stub", api_url=f"http://127.0.0.1:{args.tg_port}")
+    outcomes = {"ok": 0, "retry_later": 0, "error": 0}
+    started = time.perf_counter()
+    for i in range(args.n):
+        try:
+            tg.send({"method": "sendDocument", "chat_id": i, "conf_file": conf.name})
+            outcomes["ok"] += 1
+        except RetryLater:
+            outcomes["retry_later"] += 1
+        except Exception:
+            outcomes["error"] += 1
+    elapsed = time.perf_counter() - started
+    tg.close()
+    try:
+        TelegramSender("blocked", api_url=f"http://127.0.0.1:{args.tg_port}").send(
+            {"method": "sendDocument", "chat_id": 1, "conf_file": conf.name})
+        blocked = "не отклонён"
+    except PermanentError:
+        blocked = "PermanentError"
+    print(f"Telegram: {args.n} запросов за {elapsed:.3f} c (keep-alive), исходы: {outcomes}; "
+          f"бот заблокирован -> {blocked}")
+    os.unlink(conf.name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--smtp-port", type=int, default=2525)
+    parser.add_argument("--tg-port", type=int, default=8081)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов 500 от Telegram")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="доля ответов 429 от Telegram")
+    parser.add_argument("--selftest", action="store_true", help="прогнать отправители против заглушек и выйти")
+    parser.add_argument("-n", type=int, default=100, help="сообщений в самопроверке")
+    args = parser.parse_args()
+
+    start_stubs(args.smtp_port, args.tg_port, args.fail_rate, args.rate_limit)
+    if args.selftest:
+        selftest(args)
+        return
+    print(f"SMTP stub on 127.0.0.1:{args.smtp_port}, Telegram stub on http://127.0.0.1:{args.tg_port}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(STATS))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
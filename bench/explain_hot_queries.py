@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Аудит индексов: EXPLAIN горячих запросов к orders, ошибка при Seq Scan.
+
+Запросы выполняются на настоящей БД (PG_* / DATABASE_URL) с применёнными
+миграциями (python -m app.migrate); параметры берутся из существующей
+строки orders. С --seed N в той же транзакции вставляются N синтетических
+заказов и делается ANALYZE, а в конце всё откатывается: на таблице из
+нескольких страниц планировщик законно выбирает Seq Scan, так что без
+данных результат ничего не говорит.
+
+    python bench/explain_hot_queries.py --seed 50000
+    python bench/explain_hot_queries.py --verbose   # печатать планы
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db import init_db_pool, get_conn  # noqa: E402
+
+# (имя, SQL, ключи параметров из образца)
+HOT_QUERIES = [
+    ("latest order by email (create_order_internal)",
+     "SELECT id, conf_file, public_key, client_ip, status, expires_at "
+     "FROM orders WHERE email=%s ORDER BY id DESC LIMIT 1;",
+     ("email",)),
+    ("check_subscription",
+     "SELECT status, expires_at FROM orders WHERE email=%s ORDER BY id DESC LIMIT 1;",
+     ("email",)),
+    ("free_trial already used",
+     "SELECT 1 FROM orders WHERE email=%s AND plan=%s LIMIT 1;",
+     ("email", "plan")),
+    ("paid order by email and plan",
+     "SELECT id FROM orders WHERE email=%s AND plan=%s AND status='paid' ORDER BY id DESC LIMIT 1;",
+     ("email", "plan")),
+    ("bot paid config by email",
+     "SELECT id, conf_file, plan FROM orders "
+     "WHERE email = %s AND status = 'paid' AND conf_file IS NOT NULL ORDER BY id DESC LIMIT 1;",
+     ("email",)),
+    ("expire due (ExpiryEngine)",
+     "SELECT id, public_key FROM orders "
+     "WHERE status='paid' AND expires_at <= NOW() AND public_key IS NOT NULL;",
+     ()),
+    ("next expiry (ExpiryEngine)",
+     "SELECT MIN(expires_at) FROM orders WHERE status='paid' AND public_key IS NOT NULL;",
+     ()),
+    ("delete_client by public_key",
+     "SELECT id, conf_file, client_ip FROM orders WHERE public_key=%s LIMIT 1;",
+     ("public_key",)),
+    ("config_page by access_token",
+     "SELECT id, conf_file FROM orders WHERE access_token=%s AND status='paid';",
+     ("access_token",)),
+    ("bot latest config by telegram_id",
+     "SELECT id, conf_file, plan FROM orders "
+     "WHERE telegram_id = %s AND status = 'paid' AND conf_file IS NOT NULL ORDER BY created_at DESC LIMIT 1;",
+     ("telegram_id",)),
+    ("user subscriptions",
+     "SELECT id, plan, price, status, created_at, expires_at FROM orders "
+     "WHERE user_id = %s ORDER BY created_at DESC;",
+     ("user_id",)),
+]
+
+SEED_SQL = """
+INSERT INTO orders (email, plan, price, status, conf_file, created_at, expires_at,
+                    public_key, client_ip, access_token, telegram_id)
+SELECT
+    'seed' || (i %% %(emails)s) || '@example.com',
+    (ARRAY['1 месяц', '3 месяца', '6 месяцев', '3 дня бесплатно'])[1 + i %% 4],
+    (ARRAY[199, 499, 899, 0])[1 + i %% 4],
+    CASE WHEN i %% 5 = 0 THEN 'expired' WHEN i %% 17 = 0 THEN 'pending' ELSE 'paid' END,
+    '/tmp/seed/wg_' || i || '.conf',
+    NOW() - make_interval(mins => i %% 525600),
+    -- просроченные оплаченные ExpiryEngine снимает раз в минуту, поэтому paid — в будущем
+    CASE WHEN i %% 5 = 0 THEN NOW() - make_interval(mins => 1 + i %% 43200)
+         ELSE NOW() + make_interval(mins => 1 + (i * 7919) %% 129600) END,
+    'seed-key-' || md5(i::text),
+    '10.' || (i / 65536) %% 256 || '.' || (i / 256) %% 256 || '.' || i %% 256,
+    CASE WHEN i %% 3 = 0 THEN md5('token' || i) END,
+    CASE WHEN i %% 2 = 0 THEN 900000000 + i %% %(emails)s END
+FROM generate_series(1, %(rows)s) AS i;
+"""
+
+
+def find_seq_scans(plan, found=None):
+    found = [] if found is None else found
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        find_seq_scans(child, found)
+    return found
+
+
+def sample_params(cur) -> dict:
+    cur.execute(
+        "SELECT email, plan, public_key, access_token, telegram_id, user_id FROM orders "
+        "ORDER BY (public_key IS NOT NULL AND access_token IS NOT NULL AND telegram_id IS NOT NULL) DESC, id DESC "
+        "LIMIT 1;"
+    )
+    row = cur.fetchone()
+    if row is None:
+        raise SystemExit("orders is empty: run with --seed N")
+    sample = dict(zip(("email", "plan", "public_key", "access_token", "telegram_id", "user_id"), row))
+    # отсутствующие в образце значения — заведомо несуществующие, план от этого не меняется
+    defaults = {"public_key": "missing", "access_token": "missing", "telegram_id": -1, "user_id": -1}
+    return {k: v if v is not None else defaults.get(k) for k, v in sample.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seed", type=int, default=0, help="вставить N синтетических заказов (откатываются)")
+    parser.add_argument("--verbose", action="store_true", help="печатать планы")
+    args = parser.parse_args()
+
+    init_db_pool()
+    failures = []
+    with get_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                if args.seed:
+                    cur.execute(SEED_SQL, {"rows": args.seed, "emails": max(1, args.seed // 3)})
+                    cur.execute("ANALYZE orders;")
+                params = sample_params(cur)
+                for name, sql, keys in HOT_QUERIES:
+                    cur.execute("EXPLAIN (FORMAT JSON) " + sql, tuple(params[k] for k in keys))
+                    plan = cur.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    root = plan[0]["Plan"]
+                    scans = [rel for rel in find_seq_scans(root) if rel == "orders"]
+                    status = "SEQ SCAN" if scans else "ok"
+                    print(f"{status:8} cost={root['Total Cost']:>10.2f}  {name}")
+                    if args.verbose or scans:
+                        print(json.dumps(root, indent=2, ensure_ascii=False))
+                    if scans:
+                        failures.append(name)
+        finally:
+            # синтетические строки и статистика не должны попасть в базу
+            conn.rollback()
+    if failures:
+        print(f"\n{len(failures)} hot query(ies) do a sequential scan on orders:")
+        for name in failures:
+            print(f"  - {name}")
+        sys.exit(1)
+    print(f"\nAll {len(HOT_QUERIES)} hot queries use indexes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест HTTP API: пропускная способность и перцентили по эндпоинтам.
+
+Асинхронный клиент (aiohttp, приходит вместе с aiogram) держит --concurrency
+одновременных запросов в течение --duration секунд, выбирая эндпоинт по
+весам --mix. Данные — из bench/seed_data.py: личный кабинет ходит с
+выпущенными там JWT, /check-subscription и webhook — по синтетическим
+email, /free-trial каждый раз с новым адресом.
+
+С --spawn тест сам поднимает gunicorn (как start.sh) с фейковой утилитой
+wg из bench/fakewg в PATH, заглушками SMTP/Telegram из
+bench/delivery_stubs.py и временными CONF_DIR/WG_CONFIG_PATH; БД —
+настоящая (PG_* / DATABASE_URL).
+
+    python bench/seed_data.py --users 100000
+    python bench/load_test.py --spawn --duration 60 -c 64
+    python bench/load_test.py --base-url http://127.0.0.1:9000 --json-out before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+DEFAULT_TOKENS_PATH = os.path.join(BENCH_DIR, ".seed_tokens.json")
+DEFAULT_MIX = "subscriptions=30,traffic=25,check=25,webhook=10,free_trial=5,admin_stats=5"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Scenario:
+    def __init__(self, base_url: str, seed: dict, admin_auth: aiohttp.BasicAuth, duplicate_rate: float):
+        self.base_url = base_url.rstrip("/")
+        self.tokens = seed["tokens"]
+        self.users = seed["users"]
+        self.domain = seed["domain"]
+        self.admin_auth = admin_auth
+        self.duplicate_rate = duplicate_rate
+        self.recent_payments = []
+
+    def seeded_email(self) -> str:
+        return f"user{random.randint(1, self.users)}@{self.domain}"
+
+    def bearer(self) -> dict:
+        return {"Authorization": f"Bearer {random.choice(self.tokens)['token']}"}
+
+    def webhook_body(self) -> dict:
+        # часть уведомлений — повторная доставка уже принятого платежа
+        if self.recent_payments and random.random() < self.duplicate_rate:
+            payment_id = random.choice(self.recent_payments)
+        else:
+            payment_id = str(uuid.uuid4())
+            self.recent_payments = (self.recent_payments + [payment_id])[-1000:]
+        return {
+            "type": "notification",
+            "event": "payment.succeeded",
+            "object": {
+                "id": payment_id,
+                "status": "succeeded",
+                "metadata": {"email": self.seeded_email(), "plan_id": str(random.choice((1, 2, 3)))},
+            },
+        }
+
+    def request(self, name: str):
+        """(method, url, kwargs) для эндпоинта."""
+        url = self.base_url
+        if name == "subscriptions":
+            return "GET", url + "/api/user/subscriptions", {"headers": self.bearer()}
+        if name == "traffic":
+            return "GET", url + "/api/user/traffic", {"headers": self.bearer()}
+        if name == "admin_stats":
+            return "GET", url + "/admin/stats", {"auth": self.admin_auth}
+        if name == "check":
+            return "POST", url + "/check-subscription", {"json": {"email": self.seeded_email()}}
+        if name == "free_trial":
+            return "POST", url + "/free-trial", {"json": {"email": f"trial-{uuid.uuid4().hex[:12]}@{self.domain}"}}
+        if name == "webhook":
+            return "POST", url + "/yookassa-webhook", {"json": self.webhook_body()}
+        raise ValueError(f"unknown endpoint {name}")
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def run_load(args, scenario: Scenario, mix: dict):
+    latencies = defaultdict(list)
+    errors = defaultdict(lambda: defaultdict(int))
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + args.warmup + args.duration
+    measure_from = time.perf_counter() + args.warmup
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            while True:
+                started = time.perf_counter()
+                if started >= deadline:
+                    return
+                name = random.choices(names, weights)[0]
+                method, url, kwargs = scenario.request(name)
+                try:
+                    async with session.request(method, url, **kwargs) as resp:
+                        await resp.read()
+                        status = resp.status
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - started
+                if started < measure_from:
+                    continue
+                latencies[name].append(elapsed)
+                # 400 у free_trial/check — штатные ответы, а не ошибки
+                if not (isinstance(status, int) and status < 500 and status not in (401, 403, 404)):
+                    errors[name][str(status)] += 1
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return latencies, errors
+
+
+def report(latencies, errors, duration: float) -> dict:
+    result = {}
+    print(f"{'endpoint':<15}{'req':>8}{'req/s':>9}{'err':>6}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    total = 0
+    for name in sorted(latencies):
+        values = latencies[name]
+        total += len(values)
+        row = {
+            "requests": len(values),
+            "rps": len(values) / duration,
+            "errors": dict(errors[name]),
+            **{f"p{p}_ms": percentile(values, p) * 1000 for p in (50, 90, 99)},
+            "max_ms": max(values) * 1000,
+        }
+        result[name] = row
+        print(f"{name:<15}{row['requests']:>8}{row['rps']:>9.1f}{sum(row['errors'].values()):>6}"
+              f"{row['p50_ms']:>9.1f}{row['p90_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+        if row["errors"]:
+            print(f"{'':<15}ошибки: {row['errors']}")
+    print(f"{'total':<15}{total:>8}{total / duration:>9.1f}")
+    return result
+
+
+def spawn_app(args) -> subprocess.Popen:
+    """gunicorn с фейковым wg и заглушками доставки во временном каталоге."""
+    from bench.delivery_stubs import start_stubs
+
+    workdir = tempfile.mkdtemp(prefix="securelink-load-")
+    conf_dir = os.path.join(workdir, "configs")
+    os.makedirs(conf_dir)
+    wg_conf = os.path.join(workdir, "wg0.conf")
+    open(wg_conf, "w").close()
+    start_stubs(args.smtp_port, args.tg_port, 0.0, 0.0)
+
+    env = dict(os.environ)
+    env.update({
+        "PATH": os.path.join(BENCH_DIR, "fakewg") + os.pathsep + env.get("PATH", ""),
+        "WG_BACKEND": "subprocess",
+        "FAKE_WG_STATE": os.path.join(workdir, "fakewg.json"),
+        "WG_CONFIG_PATH": wg_conf,
+        "WG_STATS_SNAPSHOT": os.path.join(workdir, "wg_stats.json"),
+        "CONF_DIR": conf_dir,
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(args.smtp_port),
+        "SMTP_STARTTLS": "false",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.tg_port}",
+        "DEBUG": "false",
+    })
+    env.setdefault("SERVER_PUBLIC_KEY", "c2VjdXJlbGluay1sb2FkLXRlc3Qtc2VydmVyLWtleT0=")
+    env.setdefault("SERVER_ENDPOINT", "127.0.0.1:51820")
+    cmd = ["gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+           "-b", args.base_url.split("://", 1)[-1], "App:app"]
+    print(f"[load] {' '.join(cmd)} (workdir {workdir})")
+    proc = subprocess.Popen(cmd, cwd=ROOT_DIR, env=env, start_new_session=True)
+    proc.workdir = workdir
+    return proc
+
+
+async def wait_ready(base_url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.post(base_url + "/check-subscription", json={"email": "probe@example.com"}) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise SystemExit(f"{base_url} is not responding")
+
+
+async def payments_backlog(base_url: str, auth: aiohttp.BasicAuth):
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(base_url + "/admin/payments", auth=auth) as resp:
+                return await resp.json() if resp.status == 200 else None
+    except aiohttp.ClientError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://127.0.0.1:9000")
+    parser.add_argument("--duration", type=float, default=30.0, help="секунд измерения")
+    parser.add_argument("--warmup", type=float, default=5.0, help="секунд прогрева (не учитываются)")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--timeout", type=float, default=30.0, help="таймаут запроса, c")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса эндпоинтов")
+    parser.add_argument("--duplicate-rate", type=float, default=0.1, help="доля повторных webhook")
+    parser.add_argument("--tokens", default=DEFAULT_TOKENS_PATH, help="файл из seed_data.py")
+    parser.add_argument("--admin-user", default=os.environ.get("ADMIN_USER"))
+    parser.add_argument("--admin-pass", default=os.environ.get("ADMIN_PASS"))
+    parser.add_argument("--json-out", help="сохранить результаты для сравнения прогонов")
+    parser.add_argument("--spawn", action="store_true", help="поднять gunicorn с фейковым wg")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--smtp-port", type=int, default=2525)
+    parser.add_argument("--tg-port", type=int, default=8081)
+    args = parser.parse_args()
+    if not args.admin_user or not args.admin_pass:
+        raise SystemExit("ADMIN_USER/ADMIN_PASS (or --admin-user/--admin-pass) must be set")
+
+    with open(args.tokens) as f:
+        seed = json.load(f)
+    if not seed["tokens"]:
+        raise SystemExit(f"{args.tokens} has no live sessions: rerun bench/seed_data.py")
+    mix = parse_mix(args.mix)
+    auth = aiohttp.BasicAuth(args.admin_user, args.admin_pass)
+    scenario = Scenario(args.base_url, seed, auth, args.duplicate_rate)
+
+    proc = spawn_app(args) if args.spawn else None
+    try:
+        asyncio.run(wait_ready(scenario.base_url))
+        print(f"[load] {args.concurrency} concurrent clients, {args.duration:.0f} s (+{args.warmup:.0f} s warmup), mix {mix}")
+        latencies, errors = asyncio.run(run_load(args, scenario, mix))
+        result = {"endpoints": report(latencies, errors, args.duration)}
+        backlog = asyncio.run(payments_backlog(scenario.base_url, auth))
+        if backlog is not None:
+            result["payments"] = backlog
+            print(f"[load] payment queue after run: depth {backlog['queue_depth']}, "
+                  f"oldest {backlog['oldest_pending_seconds']:.1f} s, "
+                  f"lag p95 {backlog['last_hour']['lag_p95_seconds']:.2f} s")
+        if args.json_out:
+            result["args"] = {k: v for k, v in vars(args).items() if k != "admin_pass"}
+            with open(args.json_out, "w") as f:
+                json.dump(result, f, indent=2, ensure_ascii=False)
+    finally:
+        if proc is not None:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=30)
+            shutil.rmtree(proc.workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
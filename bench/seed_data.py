@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических данных для нагрузочных тестов.
+
+Заполняет users, orders, user_sessions и user_notifications (10^5–10^6
+строк) запросами INSERT ... SELECT generate_series на стороне сервера,
+порциями по --chunk пользователей. Все синтетические пользователи имеют
+email user<N>@seed.securelink.test и telegram_id 7_000_000_000 + N —
+по ним bench/load_test.py выбирает адресатов запросов, а --purge удаляет
+данные целиком.
+
+Для --live-sessions пользователей выпускаются настоящие JWT (JWT_SECRET
+приложения) и пишутся в --tokens-out, остальные сессии — заполнитель со
+случайными токенами, часть из них просрочена.
+
+    python bench/seed_data.py --users 200000
+    python bench/seed_data.py --purge
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt  # noqa: E402
+
+from app.db import init_db_pool, get_conn  # noqa: E402
+from user_manager import JWT_ALGORITHM, JWT_SECRET, token_digest  # noqa: E402
+
+SEED_DOMAIN = "seed.securelink.test"
+TELEGRAM_BASE = 7_000_000_000
+DEFAULT_TOKENS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".seed_tokens.json")
+
+USERS_SQL = f"""
+INSERT INTO users (telegram_id, username, first_name, last_name, email, language_code, created_at, last_login)
+SELECT
+    {TELEGRAM_BASE} + i,
+    'seed_user_' || i,
+    (ARRAY['Иван', 'Анна', 'Пётр', 'Мария', 'Alex', 'Kate'])[1 + i %% 6],
+    'Seed',
+    'user' || i || '@{SEED_DOMAIN}',
+    (ARRAY['ru', 'ru', 'ru', 'en'])[1 + i %% 4],
+    NOW() - make_interval(days => i %% 730),
+    NOW() - make_interval(mins => i %% 100000)
+FROM generate_series(%(start)s, %(stop)s) AS i;
+"""
+
+# У пользователя 0–3 заказа: старые истёкшие и, у большинства, действующий оплаченный
+ORDERS_SQL = f"""
+INSERT INTO orders (email, plan, price, status, conf_file, created_at, expires_at,
+                    public_key, client_ip, access_token, user_id, telegram_id)
+SELECT
+    u.email,
+    (ARRAY['1 месяц', '6 месяцев', '1 год', '3 дня бесплатно'])[1 + (u.id + n) %% 4],
+    (ARRAY[99, 499, 999, 0])[1 + (u.id + n) %% 4],
+    CASE WHEN n = 1 AND u.id %% 10 <> 0 THEN 'paid' ELSE 'expired' END,
+    NULL,
+    NOW() - make_interval(days => n * 90 + u.id %% 60),
+    CASE WHEN n = 1 AND u.id %% 10 <> 0
+         THEN NOW() + make_interval(mins => 60 + (u.id * 7919) %% 129600)
+         ELSE NOW() - make_interval(days => n * 60 + u.id %% 30) END,
+    'seed' || md5(u.id || ':' || n),
+    '10.' || 100 + (u.id * 3 + n) / 65536 %% 100 || '.' || (u.id * 3 + n) / 256 %% 256 || '.' || (u.id * 3 + n) %% 256,
+    md5('seed-token' || u.id || ':' || n),
+    u.id,
+    u.telegram_id
+FROM users u
+CROSS JOIN LATERAL generate_series(1, u.id %% 4) AS n
+WHERE u.telegram_id BETWEEN {TELEGRAM_BASE} + %(start)s AND {TELEGRAM_BASE} + %(stop)s;
+"""
+
+SESSIONS_SQL = f"""
+INSERT INTO user_sessions (user_id, token_hash, expires_at, created_at, last_activity, user_agent, ip_address)
+SELECT
+    u.id,
+    sha256(convert_to('seed-' || md5(random()::text || u.id || ':' || n), 'UTF8')),
+    CASE WHEN n %% 3 = 0 THEN NOW() - interval '1 day' ELSE NOW() + interval '7 days' END,
+    NOW() - make_interval(hours => n * 24),
+    NOW() - make_interval(mins => (u.id + n) %% 1440),
+    'Mozilla/5.0 (seed)',
+    ('192.0.2.' || (u.id %% 250 + 1))::inet
+FROM users u
+CROSS JOIN LATERAL generate_series(1, 1 + u.id %% 3) AS n
+WHERE u.telegram_id BETWEEN {TELEGRAM_BASE} + %(start)s AND {TELEGRAM_BASE} + %(stop)s;
+"""
+
+NOTIFICATIONS_SQL = f"""
+INSERT INTO user_notifications (user_id, type, title, message, is_read, created_at, read_at)
+SELECT
+    u.id,
+    (ARRAY['subscription_expiring', 'payment_success', 'traffic_limit', 'news'])[1 + n %% 4],
+    (ARRAY['Подписка скоро истечёт', 'Оплата прошла', 'Трафик', 'Новости SecureLink'])[1 + n %% 4],
+    'Синтетическое уведомление #' || n,
+    n > 2,
+    NOW() - make_interval(hours => n * 12 + u.id %% 12),
+    CASE WHEN n > 2 THEN NOW() - make_interval(hours => n * 6) END
+FROM users u
+CROSS JOIN LATERAL generate_series(1, u.id %% 10) AS n
+WHERE u.telegram_id BETWEEN {TELEGRAM_BASE} + %(start)s AND {TELEGRAM_BASE} + %(stop)s;
+"""
+
+
+def seed(users: int, chunk: int):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM users WHERE telegram_id = %s;", (TELEGRAM_BASE + 1,))
+            if cur.fetchone():
+                raise SystemExit("Seed data already present: run with --purge first")
+    started = time.perf_counter()
+    totals = {"users": 0, "orders": 0, "user_sessions": 0, "user_notifications": 0}
+    for start in range(1, users + 1, chunk):
+        stop = min(users, start + chunk - 1)
+        params = {"start": start, "stop": stop}
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                for table, sql in (("users", USERS_SQL), ("orders", ORDERS_SQL),
+                                   ("user_sessions", SESSIONS_SQL), ("user_notifications", NOTIFICATIONS_SQL)):
+                    cur.execute(sql, params)
+                    totals[table] += cur.rowcount
+        print(f"  users {start}..{stop}: {json.dumps(totals)}", flush=True)
+    with get_conn() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE users, orders, user_sessions, user_notifications;")
+    print(f"Seeded in {time.perf_counter() - started:.1f} s: {json.dumps(totals)}")
+
+
+def issue_tokens(users: int, count: int, path: str):
+    """Настоящие JWT для случайных синтетических пользователей (как create_jwt_token)."""
+    picked = random.sample(range(1, users + 1), min(count, users))
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(days=7)
+    tokens = []
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, telegram_id FROM users WHERE telegram_id = ANY(%s);",
+                ([TELEGRAM_BASE + n for n in picked],)
+            )
+            for user_id, telegram_id in cur.fetchall():
+                token = jwt.encode(
+                    {"user_id": user_id, "iat": now, "exp": expires_at, "type": "access_token"},
+                    JWT_SECRET, algorithm=JWT_ALGORITHM
+                )
+                cur.execute(
+                    "INSERT INTO user_sessions (user_id, token_hash, expires_at) VALUES (%s, %s, %s);",
+                    (user_id, token_digest(token), expires_at)
+                )
+                tokens.append({"user_id": user_id, "n": telegram_id - TELEGRAM_BASE, "token": token})
+    with open(path, "w") as f:
+        json.dump({"users": users, "domain": SEED_DOMAIN, "tokens": tokens}, f)
+    os.chmod(path, 0o600)
+    print(f"Issued {len(tokens)} live sessions -> {path}")
+
+
+def purge():
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            # сессии и уведомления удаляются каскадом вместе с пользователями
+            cur.execute("DELETE FROM orders WHERE email LIKE %s;", (f"%@{SEED_DOMAIN}",))
+            cur.execute("DELETE FROM users WHERE email LIKE %s;", (f"%@{SEED_DOMAIN}",))
+    print("Seed data removed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--chunk", type=int, default=20_000, help="пользователей на транзакцию")
+    parser.add_argument("--live-sessions", type=int, default=1000, help="сколько настоящих JWT выпустить")
+    parser.add_argument("--tokens-out", default=DEFAULT_TOKENS_PATH)
+    parser.add_argument("--purge", action="store_true", help="удалить синтетические данные")
+    args = parser.parse_args()
+
+    init_db_pool()
+    if args.purge:
+        purge()
+        return
+    seed(args.users, args.chunk)
+    issue_tokens(args.users, args.live_sessions, args.tokens_out)
+
+
+if __name__ == "__main__":
+    main()
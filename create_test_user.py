@@ -4,6 +4,7 @@
 """
 import os
 import sys
+import hashlib
 import psycopg2
 from datetime import datetime, timezone, timedelta
 import jwt
@@ -65,9 +66,9 @@ def create_test_user():
         
         # Сохраняем сессию
         cursor.execute("""
-            INSERT INTO user_sessions (user_id, session_token, expires_at)
+            INSERT INTO user_sessions (user_id, token_hash, expires_at)
             VALUES (%s, %s, %s)
-        """, (user_id, token, expires_at))
+        """, (user_id, hashlib.sha256(token.encode()).digest(), expires_at))
         
         conn.commit()
         conn.close()
@@ -21,7 +21,7 @@ CREATE TABLE IF NOT EXISTS users (
 CREATE TABLE IF NOT EXISTS user_sessions (
     id SERIAL PRIMARY KEY,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    session_token VARCHAR(255) UNIQUE NOT NULL,
+    token_hash BYTEA NOT NULL, -- SHA-256 JWT, см. migrations/004_hash_session_tokens.sql
     expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     last_activity TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -30,14 +30,16 @@ CREATE TABLE IF NOT EXISTS user_sessions (
 );
 
 -- Создание таблицы для хранения Telegram Web App данных
+-- (помесячные секции по created_at, см. migrations/003_partition_activity_logs.sql)
 CREATE TABLE IF NOT EXISTS telegram_auth_data (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     auth_date INTEGER NOT NULL,
     hash VARCHAR(255) NOT NULL,
     query_id VARCHAR(255),
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-);
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
 
 -- Создание таблицы orders (если не существует)
 CREATE TABLE IF NOT EXISTS orders (
@@ -71,6 +73,23 @@ CREATE TABLE IF NOT EXISTS user_traffic_logs (
     logged_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Сводки трафика (1 мин / 1 час / 1 день), сворачиваются из user_traffic_logs
+CREATE TABLE IF NOT EXISTS user_traffic_rollups (
+    resolution INTEGER NOT NULL, -- длина интервала в секундах: 60, 3600, 86400
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,
+    public_key VARCHAR(255) NOT NULL,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    rx_bytes BIGINT DEFAULT 0,
+    tx_bytes BIGINT DEFAULT 0,
+    PRIMARY KEY (resolution, public_key, bucket)
+);
+
+-- Докуда уже свёрнут каждый уровень сводок
+CREATE TABLE IF NOT EXISTS traffic_rollup_state (
+    resolution INTEGER PRIMARY KEY,
+    last_bucket TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
 -- Создание таблицы для уведомлений пользователей
 CREATE TABLE IF NOT EXISTS user_notifications (
     id SERIAL PRIMARY KEY,
@@ -78,36 +97,82 @@ CREATE TABLE IF NOT EXISTS user_notifications (
     type VARCHAR(50) NOT NULL, -- 'subscription_expiring', 'traffic_limit', 'payment_success', etc.
     title VARCHAR(255) NOT NULL,
     message TEXT NOT NULL,
-    is_read BOOLEAN DEFAULT FALSE,
+    is_read BOOLEAN NOT NULL DEFAULT FALSE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     read_at TIMESTAMP WITH TIME ZONE
 );
 
 -- Создание таблицы для истории действий пользователей
+-- (помесячные секции по created_at; пишется пачками из services/activity.py)
 CREATE TABLE IF NOT EXISTS user_activity_log (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     action VARCHAR(100) NOT NULL, -- 'login', 'download_config', 'view_traffic', etc.
     details JSONB DEFAULT '{}'::jsonb,
     ip_address INET,
     user_agent TEXT,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Аренда клиентских адресов WireGuard (согласование аллокатора между воркерами)
+CREATE TABLE IF NOT EXISTS ip_leases (
+    ip TEXT PRIMARY KEY,
+    leased_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Сообщения бота со ссылкой на оплату (удаляются после оплаты)
+CREATE TABLE IF NOT EXISTS payment_messages (
+    id SERIAL PRIMARY KEY,
+    telegram_id BIGINT,
+    message_ids JSONB,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Очередь исходящих сообщений (письма, Telegram); пишется в транзакции заказа
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGSERIAL PRIMARY KEY,
+    channel TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    sent_at TIMESTAMP WITH TIME ZONE
+);
+
+-- Уведомления ЮKassa: одна строка на платёж, обрабатываются ровно один раз
+CREATE TABLE IF NOT EXISTS payment_events (
+    payment_id TEXT PRIMARY KEY,
+    event_type TEXT,
+    payment_status TEXT NOT NULL,
+    payload JSONB NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending, done, failed, skipped
+    attempts INTEGER NOT NULL DEFAULT 0,
+    received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    processed_at TIMESTAMP WITH TIME ZONE,
+    last_error TEXT
 );
 
 -- Индексы для оптимизации запросов
 CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
-CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions(session_token);
+-- idx_sessions_token_hash — в migrations/004_hash_session_tokens.sql: на старой схеме столбца ещё нет
 CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON user_sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_sessions_expires ON user_sessions(expires_at);
-CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
-CREATE INDEX IF NOT EXISTS idx_orders_telegram_id ON orders(telegram_id);
+-- остальные индексы orders — в migrations/001_orders_hot_indexes.sql
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(channel, next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_payment_events_due ON payment_events(next_attempt_at) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS idx_payment_messages_telegram_id ON payment_messages(telegram_id);
 CREATE INDEX IF NOT EXISTS idx_traffic_logs_user_id ON user_traffic_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_traffic_logs_public_key ON user_traffic_logs(public_key);
-CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON user_notifications(user_id);
-CREATE INDEX IF NOT EXISTS idx_notifications_is_read ON user_notifications(is_read);
+CREATE INDEX IF NOT EXISTS idx_traffic_logs_logged_at ON user_traffic_logs(logged_at);
+CREATE INDEX IF NOT EXISTS idx_traffic_rollups_user ON user_traffic_rollups(user_id, resolution, bucket);
+CREATE INDEX IF NOT EXISTS idx_traffic_rollups_bucket ON user_traffic_rollups(resolution, bucket);
+-- индексы user_notifications и счётчик непрочитанных — в migrations/005_notification_counters.sql
 CREATE INDEX IF NOT EXISTS idx_activity_log_user_id ON user_activity_log(user_id);
-CREATE INDEX IF NOT EXISTS idx_activity_log_created_at ON user_activity_log(created_at);
 
 -- Функция для очистки истекших сессий
 CREATE OR REPLACE FUNCTION cleanup_expired_sessions()
@@ -121,6 +186,9 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Секции user_activity_log/telegram_auth_data создаёт ensure_monthly_partitions()
+-- из migrations/003_partition_activity_logs.sql (дальше — services/activity.py)
+
 -- Функция для логирования активности пользователя
 CREATE OR REPLACE FUNCTION log_user_activity(
     p_user_id INTEGER,
@@ -160,7 +228,7 @@ RETURNS TRIGGER AS $$
 BEGIN
     UPDATE user_sessions 
     SET last_activity = NOW() 
-    WHERE user_id = NEW.user_id AND session_token = NEW.session_token;
+    WHERE user_id = NEW.user_id AND token_hash = NEW.token_hash;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -171,17 +239,23 @@ $$ LANGUAGE plpgsql;
 --     FOR EACH ROW
 --     EXECUTE FUNCTION update_session_activity();
 
+-- NOTIFY orders_changed (лента админки, инвалидация кешей) — в migrations/002_orders_notify_telegram_id.sql
+-- NOTIFY users_changed (сброс кеша сессий) — в migrations/006_users_notify.sql
+
 -- Комментарии к таблицам
 COMMENT ON TABLE users IS 'Основная таблица пользователей с данными из Telegram';
 COMMENT ON TABLE user_sessions IS 'Сессии пользователей для JWT токенов';
-COMMENT ON TABLE telegram_auth_data IS 'Данные авторизации через Telegram Web App';
+COMMENT ON TABLE telegram_auth_data IS 'Данные авторизации через Telegram Web App (помесячные секции)';
 COMMENT ON TABLE user_traffic_logs IS 'Логи трафика пользователей';
 COMMENT ON TABLE user_notifications IS 'Уведомления для пользователей';
-COMMENT ON TABLE user_activity_log IS 'Лог активности пользователей';
+COMMENT ON TABLE user_activity_log IS 'Лог активности пользователей (помесячные секции)';
+COMMENT ON TABLE user_traffic_rollups IS 'Агрегаты трафика по интервалам';
+COMMENT ON TABLE ip_leases IS 'Выданные клиентские адреса WireGuard';
+COMMENT ON TABLE outbox IS 'Очередь исходящих писем и сообщений Telegram';
+COMMENT ON TABLE payment_events IS 'Уведомления ЮKassa, принятые webhook и ожидающие обработки';
 
 -- Комментарии к полям
 COMMENT ON COLUMN users.telegram_id IS 'ID пользователя в Telegram';
 COMMENT ON COLUMN users.settings IS 'JSON с настройками пользователя';
-COMMENT ON COLUMN user_sessions.session_token IS 'JWT токен сессии';
 COMMENT ON COLUMN user_traffic_logs.public_key IS 'Публичный ключ WireGuard';
 COMMENT ON COLUMN user_notifications.type IS 'Тип уведомления для группировки';
@@ -0,0 +1,31 @@
+-- Индексы под горячие запросы к orders (проверка: bench/explain_hot_queries.py).
+
+-- ExpiryEngine: UPDATE ... WHERE status='paid' AND expires_at <= NOW() и MIN(expires_at) по тем же строкам
+CREATE INDEX IF NOT EXISTS idx_orders_paid_expires ON orders(expires_at) WHERE status = 'paid' AND public_key IS NOT NULL;
+
+-- Последний заказ по email: create_order_internal, check_subscription, free_trial, бот
+CREATE INDEX IF NOT EXISTS idx_orders_email_id ON orders(email, id DESC);
+
+-- delete_client и владельцы пиров в TrafficHistory; у каждого заказа своя пара ключей
+DO $$
+DECLARE
+    duplicate TEXT;
+BEGIN
+    SELECT public_key INTO duplicate FROM orders
+    WHERE public_key IS NOT NULL GROUP BY public_key HAVING COUNT(*) > 1 LIMIT 1;
+    IF duplicate IS NOT NULL THEN
+        RAISE EXCEPTION 'orders.public_key is not unique (e.g. %), resolve duplicates before migrating', duplicate;
+    END IF;
+END $$;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_public_key ON orders(public_key);
+
+-- /config/<token>
+CREATE INDEX IF NOT EXISTS idx_orders_access_token ON orders(access_token) WHERE access_token IS NOT NULL;
+
+-- Бот: последний оплаченный конфиг по telegram_id
+CREATE INDEX IF NOT EXISTS idx_orders_telegram_status_created ON orders(telegram_id, status, created_at DESC);
+DROP INDEX IF EXISTS idx_orders_telegram_id;
+
+-- Кабинет: подписки и конфиги пользователя по дате
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at DESC);
+DROP INDEX IF EXISTS idx_orders_user_id;
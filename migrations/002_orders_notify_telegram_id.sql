@@ -0,0 +1,44 @@
+-- Уведомление об изменении заказа: лента админки, инвалидация кешей, прилипание
+-- чтений к primary (app/replica.py; бот — по telegram_id). Триггеры создаются
+-- здесь же: database_migration.sql на обновляемой базе мог оборваться до них.
+CREATE OR REPLACE FUNCTION notify_orders_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('orders_changed', json_build_object(
+        'id', NEW.id,
+        'op', TG_OP,
+        'status', NEW.status,
+        'public_key', COALESCE(NEW.public_key, OLD.public_key),
+        'email', NEW.email,
+        'user_id', NEW.user_id,
+        'telegram_id', NEW.telegram_id
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF to_regclass('orders') IS NULL THEN
+        -- базовая схема (database_migration.sql) ещё не накатывалась
+        RETURN;
+    END IF;
+
+    DROP TRIGGER IF EXISTS trigger_orders_notify_insert ON orders;
+    CREATE TRIGGER trigger_orders_notify_insert
+        AFTER INSERT ON orders
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_orders_changed();
+
+    DROP TRIGGER IF EXISTS trigger_orders_notify_update ON orders;
+    CREATE TRIGGER trigger_orders_notify_update
+        AFTER UPDATE ON orders
+        FOR EACH ROW
+        WHEN (OLD.status IS DISTINCT FROM NEW.status
+              OR OLD.expires_at IS DISTINCT FROM NEW.expires_at
+              OR OLD.public_key IS DISTINCT FROM NEW.public_key
+              OR OLD.client_ip IS DISTINCT FROM NEW.client_ip
+              OR OLD.email IS DISTINCT FROM NEW.email
+              OR OLD.user_id IS DISTINCT FROM NEW.user_id)
+        EXECUTE FUNCTION notify_orders_changed();
+END $$;
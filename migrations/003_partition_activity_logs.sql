@@ -0,0 +1,103 @@
+-- user_activity_log и telegram_auth_data: помесячные секции по created_at.
+-- Пишет их services.activity.ActivityLog пачками; старые месяцы удаляются
+-- DROP TABLE секции, а не построчным DELETE. Индекс по created_at не нужен:
+-- выборки за период отсекают лишние секции сами.
+
+-- Секции <parent>_YYYYMM на каждый месяц от p_from до p_until включительно (границы в UTC).
+-- Для несекционированной таблицы (базовая схема до этой миграции) ничего не делает.
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(p_parent TEXT, p_from TIMESTAMPTZ, p_until TIMESTAMPTZ)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start TIMESTAMP := date_trunc('month', p_from AT TIME ZONE 'UTC');
+    part TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_class WHERE oid = to_regclass(p_parent) AND relkind = 'p') THEN
+        RETURN 0;
+    END IF;
+    -- воркеры стартуют одновременно: CREATE TABLE одной секции из двух транзакций конфликтует
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_monthly_partitions:' || p_parent));
+    WHILE month_start <= p_until AT TIME ZONE 'UTC' LOOP
+        part := p_parent || '_' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                part, p_parent,
+                month_start AT TIME ZONE 'UTC',
+                (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC'
+            );
+            created := created + 1;
+        END IF;
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    first_at TIMESTAMPTZ;
+BEGIN
+    IF to_regclass('users') IS NULL THEN
+        -- базовая схема (database_migration.sql) ещё не накатывалась
+        RETURN;
+    END IF;
+
+    -- ---------- user_activity_log ----------
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'user_activity_log' AND relkind = 'r') THEN
+        ALTER TABLE user_activity_log RENAME TO user_activity_log_unpartitioned;
+        ALTER INDEX user_activity_log_pkey RENAME TO user_activity_log_unpartitioned_pkey;
+        DROP INDEX IF EXISTS idx_activity_log_user_id, idx_activity_log_created_at;
+    END IF;
+    CREATE TABLE IF NOT EXISTS user_activity_log (
+        id BIGSERIAL,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        action VARCHAR(100) NOT NULL,
+        details JSONB DEFAULT '{}'::jsonb,
+        ip_address INET,
+        user_agent TEXT,
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+    CREATE INDEX IF NOT EXISTS idx_activity_log_user_id ON user_activity_log(user_id);
+
+    IF to_regclass('user_activity_log_unpartitioned') IS NOT NULL THEN
+        SELECT MIN(created_at) INTO first_at FROM user_activity_log_unpartitioned;
+        first_at := LEAST(COALESCE(first_at, NOW()), NOW());
+        PERFORM ensure_monthly_partitions('user_activity_log', first_at, NOW());
+        INSERT INTO user_activity_log (user_id, action, details, ip_address, user_agent, created_at)
+        SELECT user_id, action, details, ip_address, user_agent, LEAST(COALESCE(created_at, NOW()), NOW())
+        FROM user_activity_log_unpartitioned;
+        DROP TABLE user_activity_log_unpartitioned;
+    END IF;
+    PERFORM ensure_monthly_partitions('user_activity_log', NOW(), NOW() + INTERVAL '1 month');
+
+    -- ---------- telegram_auth_data ----------
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'telegram_auth_data' AND relkind = 'r') THEN
+        ALTER TABLE telegram_auth_data RENAME TO telegram_auth_data_unpartitioned;
+        ALTER INDEX telegram_auth_data_pkey RENAME TO telegram_auth_data_unpartitioned_pkey;
+    END IF;
+    CREATE TABLE IF NOT EXISTS telegram_auth_data (
+        id BIGSERIAL,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        auth_date INTEGER NOT NULL,
+        hash VARCHAR(255) NOT NULL,
+        query_id VARCHAR(255),
+        created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at);
+
+    IF to_regclass('telegram_auth_data_unpartitioned') IS NOT NULL THEN
+        SELECT MIN(created_at) INTO first_at FROM telegram_auth_data_unpartitioned;
+        first_at := LEAST(COALESCE(first_at, NOW()), NOW());
+        PERFORM ensure_monthly_partitions('telegram_auth_data', first_at, NOW());
+        INSERT INTO telegram_auth_data (user_id, auth_date, hash, query_id, created_at)
+        SELECT user_id, auth_date, hash, query_id, LEAST(COALESCE(created_at, NOW()), NOW())
+        FROM telegram_auth_data_unpartitioned;
+        DROP TABLE telegram_auth_data_unpartitioned;
+    END IF;
+    PERFORM ensure_monthly_partitions('telegram_auth_data', NOW(), NOW() + INTERVAL '1 month');
+
+    COMMENT ON TABLE user_activity_log IS 'Лог активности пользователей (помесячные секции)';
+    COMMENT ON TABLE telegram_auth_data IS 'Данные авторизации через Telegram Web App (помесячные секции)';
+END $$;
@@ -0,0 +1,25 @@
+-- user_sessions: вместо самого JWT (VARCHAR(255), длинные токены не влезали) —
+-- его SHA-256, 32 байта. Уникальный индекс по дайджесту в разы меньше, а
+-- утечка таблицы не даёт готовых токенов. Истёкшие сессии удаляет
+-- UserManager.cleanup_expired_sessions пачками по индексу expires_at.
+DO $$
+BEGIN
+    IF to_regclass('user_sessions') IS NULL THEN
+        -- базовая схема (database_migration.sql) ещё не накатывалась
+        RETURN;
+    END IF;
+
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'user_sessions' AND column_name = 'session_token') THEN
+        -- переносить мёртвые строки незачем
+        DELETE FROM user_sessions WHERE expires_at < NOW();
+        ALTER TABLE user_sessions ADD COLUMN token_hash BYTEA;
+        UPDATE user_sessions SET token_hash = sha256(convert_to(session_token, 'UTF8'));
+        ALTER TABLE user_sessions ALTER COLUMN token_hash SET NOT NULL;
+        -- вместе со столбцом уходят UNIQUE и дублирующий его idx_sessions_token
+        ALTER TABLE user_sessions DROP COLUMN session_token;
+    END IF;
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_token_hash ON user_sessions(token_hash);
+    COMMENT ON COLUMN user_sessions.token_hash IS 'SHA-256 JWT токена сессии';
+END $$;
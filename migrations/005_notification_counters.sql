@@ -0,0 +1,146 @@
+-- Счётчик непрочитанных уведомлений и последний id на пользователя.
+-- Ведётся триггерами в той же транзакции, что и изменение user_notifications,
+-- поэтому кабинету не нужно считать непрочитанные по всей ленте. Триггеры
+-- уровня оператора с таблицами переходов: «прочитать все» обновляет строку
+-- счётчика один раз, а не на каждое уведомление. После изменения летят
+-- NOTIFY read_sticky (чтение с primary) и notifications_changed (будит
+-- long-poll /api/user/notifications/wait, services/notifications.py).
+DO $$
+BEGIN
+    IF to_regclass('user_notifications') IS NULL THEN
+        -- базовая схема (database_migration.sql) ещё не накатывалась
+        RETURN;
+    END IF;
+
+    CREATE TABLE IF NOT EXISTS user_notification_state (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        unread INTEGER NOT NULL DEFAULT 0,
+        last_id INTEGER NOT NULL DEFAULT 0
+    );
+    COMMENT ON TABLE user_notification_state IS 'Непрочитанные и последний id уведомлений пользователя';
+
+    -- лента по ?before=: WHERE user_id = ? AND id < ? ORDER BY id DESC; «прочитать все» — по частичному
+    CREATE INDEX IF NOT EXISTS idx_notifications_user_id_id ON user_notifications(user_id, id DESC);
+    CREATE INDEX IF NOT EXISTS idx_notifications_unread ON user_notifications(user_id) WHERE NOT is_read;
+    DROP INDEX IF EXISTS idx_notifications_user_id;
+    DROP INDEX IF EXISTS idx_notifications_is_read;
+
+    UPDATE user_notifications SET is_read = FALSE WHERE is_read IS NULL;
+    ALTER TABLE user_notifications ALTER COLUMN is_read SET NOT NULL;
+
+    INSERT INTO user_notification_state (user_id, unread, last_id)
+    SELECT user_id, COUNT(*) FILTER (WHERE NOT is_read), MAX(id)
+    FROM user_notifications
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET unread = EXCLUDED.unread, last_id = EXCLUDED.last_id;
+END $$;
+
+CREATE OR REPLACE FUNCTION notifications_state_changed(p_user_id INTEGER, p_unread INTEGER, p_last_id INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    PERFORM pg_notify('read_sticky', json_build_array('user:' || p_user_id)::text);
+    PERFORM pg_notify('notifications_changed', json_build_object(
+        'user_id', p_user_id,
+        'unread', p_unread,
+        'last_id', p_last_id
+    )::text);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notifications_count_insert()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN
+        INSERT INTO user_notification_state AS s (user_id, unread, last_id)
+        SELECT user_id, COUNT(*) FILTER (WHERE NOT is_read), MAX(id)
+        FROM new_rows
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE
+        SET unread = s.unread + EXCLUDED.unread,
+            last_id = GREATEST(s.last_id, EXCLUDED.last_id)
+        RETURNING s.user_id, s.unread, s.last_id
+    LOOP
+        PERFORM notifications_state_changed(r.user_id, r.unread, r.last_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notifications_count_update()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN
+        UPDATE user_notification_state AS s
+        SET unread = GREATEST(s.unread + d.delta, 0)
+        FROM (
+            SELECT n.user_id, SUM(CASE WHEN n.is_read = o.is_read THEN 0 WHEN n.is_read THEN -1 ELSE 1 END) AS delta
+            FROM new_rows n
+            JOIN old_rows o ON o.id = n.id
+            WHERE n.user_id IS NOT NULL
+            GROUP BY n.user_id
+        ) d
+        WHERE s.user_id = d.user_id AND d.delta <> 0
+        RETURNING s.user_id, s.unread, s.last_id
+    LOOP
+        PERFORM notifications_state_changed(r.user_id, r.unread, r.last_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notifications_count_delete()
+RETURNS TRIGGER AS $$
+DECLARE
+    r RECORD;
+BEGIN
+    FOR r IN
+        UPDATE user_notification_state AS s
+        SET unread = GREATEST(s.unread - d.unread, 0)
+        FROM (
+            SELECT user_id, COUNT(*) AS unread
+            FROM old_rows
+            WHERE user_id IS NOT NULL AND NOT is_read
+            GROUP BY user_id
+        ) d
+        WHERE s.user_id = d.user_id
+        RETURNING s.user_id, s.unread, s.last_id
+    LOOP
+        PERFORM notifications_state_changed(r.user_id, r.unread, r.last_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF to_regclass('user_notifications') IS NULL THEN
+        RETURN;
+    END IF;
+    -- таблицы переходов допускают только одно событие на триггер
+    DROP TRIGGER IF EXISTS trigger_notifications_count_insert ON user_notifications;
+    CREATE TRIGGER trigger_notifications_count_insert
+        AFTER INSERT ON user_notifications
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notifications_count_insert();
+
+    DROP TRIGGER IF EXISTS trigger_notifications_count_update ON user_notifications;
+    CREATE TRIGGER trigger_notifications_count_update
+        AFTER UPDATE ON user_notifications
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notifications_count_update();
+
+    DROP TRIGGER IF EXISTS trigger_notifications_count_delete ON user_notifications;
+    CREATE TRIGGER trigger_notifications_count_delete
+        AFTER DELETE ON user_notifications
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION notifications_count_delete();
+END $$;
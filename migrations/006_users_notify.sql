@@ -0,0 +1,34 @@
+-- Уведомление о смене is_active/удалении пользователя (сброс кеша сессий,
+-- UserManager.attach_listener). Раньше жило только в database_migration.sql,
+-- а тот на обновляемой базе мог оборваться раньше и триггеров не создать.
+CREATE OR REPLACE FUNCTION notify_users_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('users_changed', json_build_object(
+        'id', COALESCE(NEW.id, OLD.id),
+        'op', TG_OP
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF to_regclass('users') IS NULL THEN
+        -- базовая схема (database_migration.sql) ещё не накатывалась
+        RETURN;
+    END IF;
+
+    DROP TRIGGER IF EXISTS trigger_users_notify_update ON users;
+    CREATE TRIGGER trigger_users_notify_update
+        AFTER UPDATE ON users
+        FOR EACH ROW
+        WHEN (OLD.is_active IS DISTINCT FROM NEW.is_active)
+        EXECUTE FUNCTION notify_users_changed();
+
+    DROP TRIGGER IF EXISTS trigger_users_notify_delete ON users;
+    CREATE TRIGGER trigger_users_notify_delete
+        AFTER DELETE ON users
+        FOR EACH ROW
+        EXECUTE FUNCTION notify_users_changed();
+END $$;
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Повторная обработка застрявших уведомлений ЮKassa (таблица payment_events).
+
+    python replay_payment_events.py --list
+    python replay_payment_events.py --failed
+    python replay_payment_events.py --stuck 600
+    python replay_payment_events.py 2f1c9a3e-000f-5000-8000-1a2b3c4d5e6f
+
+События возвращаются в pending со сброшенным счётчиком попыток и тут же
+подхватываются воркерами приложения (NOTIFY payment_events). Уже
+обработанные платежи (done) не трогаются.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.db import init_db_pool, get_conn  # noqa: E402
+from services.payments import replay  # noqa: E402
+
+
+def list_events():
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT payment_id, state, attempts, received_at, next_attempt_at, last_error
+                FROM payment_events
+                WHERE state = 'failed' OR (state = 'pending' AND attempts > 0)
+                ORDER BY received_at;
+                """
+            )
+            rows = cur.fetchall()
+    for payment_id, state, attempts, received_at, next_attempt_at, last_error in rows:
+        print(f"{payment_id}\t{state}\tпопыток: {attempts}\tпринято: {received_at:%Y-%m-%d %H:%M:%S}\t"
+              f"следующая: {next_attempt_at:%Y-%m-%d %H:%M:%S}\t{last_error or ''}")
+    print(f"Всего: {len(rows)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("payment_ids", nargs="*", help="id платежей ЮKassa")
+    parser.add_argument("--list", action="store_true", help="показать failed и повторяющиеся события")
+    parser.add_argument("--failed", action="store_true", help="вернуть в очередь все failed")
+    parser.add_argument("--stuck", type=float, metavar="SECONDS",
+                        help="вернуть в очередь pending, ждущие дольше SECONDS")
+    args = parser.parse_args()
+
+    init_db_pool()
+    if args.list:
+        list_events()
+        return
+    if not (args.payment_ids or args.failed or args.stuck is not None):
+        parser.error("укажите id платежей, --failed или --stuck")
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            replayed = replay(cur, args.payment_ids, failed=args.failed, stuck_seconds=args.stuck)
+    for payment_id in replayed:
+        print(payment_id)
+    print(f"Возвращено в очередь: {len(replayed)}")
+
+
+if __name__ == "__main__":
+    main()
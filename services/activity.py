@@ -0,0 +1,272 @@
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger("securelink")
+
+# pg_try_advisory_xact_lock: секции обслуживает один процесс за раз
+ACTIVITY_MAINTENANCE_LOCK_KEY = 0x5EC0_0004
+
+# check_violation: «no partition of relation ... found for row»
+NO_PARTITION = "23514"
+
+ACTIVITY_TABLE = "user_activity_log"
+TELEGRAM_AUTH_TABLE = "telegram_auth_data"
+
+# Пользователь мог быть удалён, пока строка ждала в буфере: такие строки
+# отбрасываются фильтром, а не роняют всю пачку нарушением FK.
+_INSERTS = {
+    ACTIVITY_TABLE: (
+        "INSERT INTO user_activity_log (user_id, action, details, ip_address, user_agent, created_at) "
+        "SELECT v.* FROM (VALUES %s) AS v(user_id, action, details, ip_address, user_agent, created_at) "
+        "WHERE v.user_id IS NULL OR EXISTS (SELECT 1 FROM users WHERE users.id = v.user_id)",
+        "(%s::integer, %s, %s::jsonb, %s::inet, %s, %s::timestamptz)",
+    ),
+    TELEGRAM_AUTH_TABLE: (
+        "INSERT INTO telegram_auth_data (user_id, auth_date, hash, query_id, created_at) "
+        "SELECT v.* FROM (VALUES %s) AS v(user_id, auth_date, hash, query_id, created_at) "
+        "WHERE v.user_id IS NULL OR EXISTS (SELECT 1 FROM users WHERE users.id = v.user_id)",
+        "(%s::integer, %s::integer, %s, %s, %s::timestamptz)",
+    ),
+}
+
+
+class ActivityLog:
+    """
+    Буферизованная запись user_activity_log и telegram_auth_data.
+
+    log() и telegram_auth() только кладут строку в очередь процесса. Фоновый
+    поток раз в flush_interval (или сразу, как набралось batch_size строк)
+    пишет накопленное одним execute_values на таблицу в одной транзакции.
+    Очередь ограничена max_buffer: пока БД недоступна, вытесняются самые
+    старые строки, а память не растёт. Обратно в очередь идут только пачки,
+    упавшие на соединении (OperationalError/InterfaceError, пул); пачка,
+    которую отверг сам INSERT (DataError и т.п.), делится пополам, пока не
+    останутся отдельные плохие строки — они отбрасываются (rejected), а не
+    блокируют запись всего лога. Без запущенного потока (скрипты) каждая
+    строка пишется сразу.
+
+    Обе таблицы секционированы по месяцам (migrations/003). Раз в
+    maintenance_interval создаются секции на текущий и следующий месяц, а
+    секции старше срока хранения удаляются целиком, DROP TABLE вместо
+    построчного DELETE. Хранится текущий месяц и retention предыдущих;
+    0 — хранить всё.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        *,
+        flush_interval: float = 2.0,
+        batch_size: int = 500,
+        max_buffer: int = 50000,
+        activity_retention_months: int = 12,
+        auth_retention_months: int = 1,
+        maintenance_interval: float = 3600.0,
+        lock_key: int = ACTIVITY_MAINTENANCE_LOCK_KEY,
+    ) -> None:
+        self.get_conn = get_conn
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.retention = {ACTIVITY_TABLE: activity_retention_months, TELEGRAM_AUTH_TABLE: auth_retention_months}
+        self.maintenance_interval = maintenance_interval
+        self.lock_key = lock_key
+        self._buffers: Dict[str, deque] = {table: deque() for table in _INSERTS}
+        self._lock = threading.Lock()
+        self.written = {table: 0 for table in _INSERTS}
+        self.dropped = {table: 0 for table in _INSERTS}
+        self.rejected = {table: 0 for table in _INSERTS}
+        self._last_maintenance = 0.0
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- Приём событий ----------
+    def log(self, user_id: Optional[int], action: str, details: Dict[str, Any] = None,
+            ip_address: str = None, user_agent: str = None):
+        self._append(ACTIVITY_TABLE, (
+            user_id, action, json.dumps(details or {}, ensure_ascii=False, default=str),
+            ip_address, user_agent, datetime.now(timezone.utc),
+        ))
+
+    def telegram_auth(self, user_id: int, fields: Dict[str, Any]):
+        """Проверенные initData (UserManager.verify_telegram_init_data)."""
+        self._append(TELEGRAM_AUTH_TABLE, (
+            user_id, int(fields["auth_date"]), fields["hash"], fields.get("query_id"), datetime.now(timezone.utc),
+        ))
+
+    def _append(self, table: str, row: tuple):
+        with self._lock:
+            buffer = self._buffers[table]
+            if len(buffer) >= self.max_buffer:
+                buffer.popleft()
+                self.dropped[table] += 1
+            buffer.append(row)
+            full = len(buffer) >= self.batch_size
+        if self._thread is None:
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    # ---------- Запись ----------
+    def flush(self) -> int:
+        """Пишет всё накопленное; возвращает число записанных строк."""
+        with self._lock:
+            batches = {table: list(rows) for table, rows in self._buffers.items() if rows}
+            for table in batches:
+                self._buffers[table].clear()
+        if not batches:
+            return 0
+        written = 0
+        for table, rows in batches.items():
+            retry: List[tuple] = []
+            written += self._write(table, rows, retry)
+            if retry:
+                with self._lock:
+                    # обратно в начало очереди, сколько поместится
+                    buffer = self._buffers[table]
+                    room = max(self.max_buffer - len(buffer), 0)
+                    keep = retry[len(retry) - room:] if room < len(retry) else retry
+                    self.dropped[table] += len(retry) - len(keep)
+                    buffer.extendleft(reversed(keep))
+        return written
+
+    def _write(self, table: str, rows: List[tuple], retry: List[tuple]) -> int:
+        """Пачка одной транзакцией; при ошибке данных — половинами. Недописанное из-за соединения — в retry."""
+        query, template = _INSERTS[table]
+        try:
+            with self.get_conn() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, query, rows, template=template, page_size=self.batch_size)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logger.error("Activity log flush to %s failed (%s rows): %s", table, len(rows), e)
+            retry.extend(rows)
+            return 0
+        except psycopg2.Error as e:
+            if e.pgcode == NO_PARTITION:
+                # сменился месяц, а секции ещё нет — обслуживание на следующем шаге, строки ждут
+                logger.error("Activity log flush to %s failed (%s rows): %s", table, len(rows), e)
+                self._last_maintenance = 0.0
+                retry.extend(rows)
+                return 0
+            if len(rows) > 1:
+                middle = len(rows) // 2
+                return self._write(table, rows[:middle], retry) + self._write(table, rows[middle:], retry)
+            logger.warning("Activity log row rejected by %s: %s (%r)", table, e, rows[0])
+            with self._lock:
+                self.rejected[table] += 1
+            return 0
+        except Exception as e:
+            # PoolTimeout и прочее вне Postgres — та же временная недоступность
+            logger.error("Activity log flush to %s failed (%s rows): %s", table, len(rows), e)
+            retry.extend(rows)
+            return 0
+        with self._lock:
+            self.written[table] += len(rows)
+        return len(rows)
+
+    # ---------- Секции ----------
+    def maintain(self) -> List[str]:
+        """Создаёт секции на текущий и следующий месяц и удаляет устаревшие; возвращает удалённые."""
+        dropped = []
+        cutoffs = {table: _month_start(datetime.now(timezone.utc), -months)
+                   for table, months in self.retention.items() if months > 0}
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (self.lock_key,))
+                if not cur.fetchone()[0]:
+                    return dropped
+                for table in self.retention:
+                    cur.execute(
+                        "SELECT ensure_monthly_partitions(%s, NOW(), NOW() + INTERVAL '1 month');", (table,)
+                    )
+                    if table not in cutoffs:
+                        continue
+                    cur.execute(
+                        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                        "WHERE i.inhparent = to_regclass(%s);",
+                        (table,)
+                    )
+                    for (name,) in cur.fetchall():
+                        month = _partition_month(table, name)
+                        if month is not None and month < cutoffs[table]:
+                            cur.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(name)))
+                            dropped.append(name)
+        if dropped:
+            logger.info("Activity log: dropped expired partitions %s", ", ".join(dropped))
+        return dropped
+
+    # ---------- Фоновый поток ----------
+    def _loop(self):
+        while not self._stop.is_set():
+            if time.monotonic() - self._last_maintenance >= self.maintenance_interval:
+                self._last_maintenance = time.monotonic()
+                try:
+                    self.maintain()
+                except Exception:
+                    logger.exception("Activity log partition maintenance failed")
+            self.flush()
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+        self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="activity-log", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """Останавливает поток, дописав буфер."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                table: {
+                    "buffered": len(self._buffers[table]),
+                    "written": self.written[table],
+                    "dropped": self.dropped[table],
+                    "rejected": self.rejected[table],
+                    "retention_months": self.retention[table],
+                }
+                for table in _INSERTS
+            }
+
+    def metrics(self):
+        """Коллектор для METRICS: очередь, записанные и потерянные строки по таблицам."""
+        items = []
+        for table, values in self.stats().items():
+            labels = {"table": table}
+            items.append(("gauge", "activity_log_buffered", values["buffered"], labels))
+            items.append(("counter", "activity_log_written_total", values["written"], labels))
+            items.append(("counter", "activity_log_dropped_total", values["dropped"], labels))
+            items.append(("counter", "activity_log_rejected_total", values["rejected"], labels))
+        return items
+
+
+def _month_start(moment: datetime, shift: int = 0) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + shift
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _partition_month(table: str, name: str) -> Optional[datetime]:
+    """<table>_YYYYMM -> начало месяца; чужие секции (не по шаблону) не трогаем."""
+    suffix = name[len(table) + 1:] if name.startswith(table + "_") else ""
+    try:
+        return datetime.strptime(suffix, "%Y%m").replace(tzinfo=timezone.utc) if len(suffix) == 6 else None
+    except ValueError:
+        return None
@@ -0,0 +1,118 @@
+import base64
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+
+# Онлайн — если от пира были данные/рукопожатие за последние N секунд
+ONLINE_WINDOW = 60
+
+# sort -> SQL-выражение ключа сортировки (без NULL, чтобы keyset был однозначным)
+SORT_COLUMNS = {
+    "id": "id",
+    "email": "COALESCE(email, '')",
+    "created_at": "COALESCE(created_at, 'epoch'::timestamptz)",
+    "expires_at": "COALESCE(expires_at, 'epoch'::timestamptz)",
+}
+
+MAX_LIMIT = 200
+
+
+def encode_cursor(sort_value, order_id: int) -> str:
+    raw = json.dumps([sort_value, order_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        sort_value, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_value, int(order_id)
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+
+def is_online(stats: Dict[str, Any], now_ts: float = None) -> bool:
+    last_seen = stats.get("last_seen") or 0
+    return ((now_ts or time.time()) - last_seen) < ONLINE_WINDOW
+
+
+def client_row(row, wg_stats: Dict[str, Dict[str, Any]], now_ts: float) -> Dict[str, Any]:
+    order_id, email, pubkey, ip, plan, created, expires = row
+    stats = wg_stats.get(pubkey, {})
+    return {
+        "id": order_id,
+        "email": email,
+        "public_key": pubkey,
+        "client_ip": ip,
+        "plan": plan,
+        "rx_bytes": stats.get("rx_bytes", 0),
+        "tx_bytes": stats.get("tx_bytes", 0),
+        "speed_rx": stats.get("speed_rx", 0),
+        "speed_tx": stats.get("speed_tx", 0),
+        "online": is_online(stats, now_ts),
+        "last_seen": stats.get("last_seen", 0),
+        "start_date": created.isoformat() if created else None,
+        "end_date": expires.isoformat() if expires else None,
+    }
+
+
+def list_clients(
+    get_conn,
+    wg_stats: Dict[str, Dict[str, Any]],
+    *,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    sort: str = "id",
+    order: str = "desc",
+    q: str = "",
+    online_only: bool = False,
+) -> Dict[str, Any]:
+    """
+    Страница оплаченных клиентов для админки с keyset-пагинацией.
+
+    Курсор — (значение ключа сортировки, id) последней строки страницы,
+    поэтому глубина страницы не влияет на стоимость запроса. Фильтр
+    online_only берёт ключи онлайн-пиров из снимка статистики WG.
+    """
+    sort_expr = SORT_COLUMNS.get(sort, "id")
+    desc = order.lower() != "asc"
+    limit = max(1, min(int(limit or 50), MAX_LIMIT))
+    now_ts = time.time()
+
+    where: List[str] = ["status = 'paid'"]
+    params: List[Any] = []
+    q = (q or "").strip()
+    if q:
+        # % и _ из запроса — обычные символы, а не шаблоны LIKE
+        pattern = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        where.append("(email ILIKE %s ESCAPE '\\' OR client_ip LIKE %s ESCAPE '\\')")
+        params.extend([f"%{pattern}%", f"{pattern}%"])
+    if online_only:
+        online_keys = [k for k, st in wg_stats.items() if is_online(st, now_ts)]
+        if not online_keys:
+            return {"clients": [], "next_cursor": None}
+        where.append("public_key = ANY(%s)")
+        params.append(online_keys)
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor)
+        where.append(f"({sort_expr}, id) {'<' if desc else '>'} (%s, %s)")
+        params.extend([sort_value, last_id])
+
+    direction = "DESC" if desc else "ASC"
+    sql = (
+        f"SELECT id, email, public_key, client_ip, plan, created_at, expires_at, {sort_expr} "
+        f"FROM orders WHERE {' AND '.join(where)} "
+        f"ORDER BY {sort_expr} {direction}, id {direction} LIMIT %s;"
+    )
+    params.append(limit + 1)
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    clients = [client_row(r[:7], wg_stats, now_ts) for r in rows]
+    next_cursor = encode_cursor(rows[-1][7], rows[-1][0]) if has_more and rows else None
+    return {"clients": clients, "next_cursor": next_cursor}
@@ -0,0 +1,217 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from services.admin_clients import client_row, is_online
+
+
+logger = logging.getLogger("securelink")
+
+# Канал NOTIFY, в который пишет триггер notify_orders_changed (см. migrations/002_orders_notify_telegram_id.sql)
+ORDERS_CHANNEL = "orders_changed"
+
+
+class AdminEventFeed:
+    """
+    Лента изменений для админки (Server-Sent Events), своя в каждом воркере.
+
+    Поток ленты раз в poll_interval читает снимок статистики WG (кеш по
+    mtime, без БД) и публикует только пиров, у которых изменились счётчики,
+    скорость или онлайн-статус. Заказы приходят через LISTEN/NOTIFY: БД
+    читается только для новых/продлённых оплаченных заказов. Пока никто не
+    подписан, лента ничего не делает.
+
+    Каждое событие получает номер "<epoch>-<seq>"; epoch уникален для
+    процесса. Браузер переподключается с Last-Event-ID: если номер из этой
+    же эпохи и ещё лежит в буфере — события досылаются, иначе приходит
+    resync и клиент перечитывает страницу целиком.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        *,
+        wg_snapshot: Callable[[], Dict[str, Any]],
+        host_metrics: Callable[[], Dict[str, Any]],
+        buffer_size: int = 1000,
+        poll_interval: float = 1.0,
+        heartbeat: float = 15.0,
+        max_stream: float = 300.0,
+    ) -> None:
+        self.get_conn = get_conn
+        self.wg_snapshot = wg_snapshot
+        self.host_metrics = host_metrics
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        # после max_stream секунд поток закрывается, EventSource переподключится сам
+        self.max_stream = max_stream
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._events: deque = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self._subscribers = 0
+        self._peers: Dict[str, tuple] = {}
+        self._wg_ts = None
+        self._host_ts = None
+        self._last_online_check = 0.0
+        self._pending_orders: List[Dict[str, Any]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- Источники ----------
+    def on_order_notify(self, payload: str):
+        if not self._subscribers:
+            return
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            return
+        with self._cond:
+            self._pending_orders.append(change)
+
+    def _emit(self, event: str, data: Any):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event, data))
+            self._cond.notify_all()
+
+    def _diff_peers(self, force: bool = False):
+        snapshot = self.wg_snapshot()
+        now = time.time()
+        online_due = now - self._last_online_check >= 5
+        if snapshot.get("ts") == self._wg_ts and not online_due and not force:
+            return
+        self._wg_ts = snapshot.get("ts")
+        self._last_online_check = now
+        changed = []
+        peers = snapshot.get("peers", {})
+        for public_key, stats in peers.items():
+            online = is_online(stats, now)
+            state = (stats.get("rx_bytes", 0), stats.get("tx_bytes", 0),
+                     stats.get("speed_rx", 0), stats.get("speed_tx", 0), online)
+            if self._peers.get(public_key) != state:
+                self._peers[public_key] = state
+                changed.append({
+                    "public_key": public_key,
+                    "rx_bytes": state[0],
+                    "tx_bytes": state[1],
+                    "speed_rx": state[2],
+                    "speed_tx": state[3],
+                    "online": online,
+                    "last_seen": stats.get("last_seen", 0),
+                })
+        for public_key in [k for k in self._peers if k not in peers]:
+            del self._peers[public_key]
+        if changed:
+            self._emit("peers", changed)
+
+    def _host(self):
+        metrics = self.host_metrics()
+        if metrics.get("ts") != self._host_ts:
+            self._host_ts = metrics.get("ts")
+            self._emit("host", metrics)
+
+    def _orders(self):
+        with self._cond:
+            pending, self._pending_orders = self._pending_orders, []
+        if not pending:
+            return
+        latest = {change["id"]: change for change in pending if "id" in change}
+        paid_ids = [oid for oid, change in latest.items() if change.get("status") == "paid"]
+        for oid, change in latest.items():
+            if change.get("status") != "paid":
+                self._emit("order", {"action": "removed", "id": oid, "public_key": change.get("public_key")})
+        if not paid_ids:
+            return
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT id, email, public_key, client_ip, plan, created_at, expires_at "
+                    "FROM orders WHERE id = ANY(%s) AND status = 'paid';",
+                    (paid_ids,)
+                )
+                rows = cur.fetchall()
+        peers = self.wg_snapshot().get("peers", {})
+        now_ts = time.time()
+        for row in rows:
+            self._emit("order", {"action": "upsert", "client": client_row(row, peers, now_ts)})
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._subscribers:
+                    self._cond.wait()
+            try:
+                self._orders()
+                self._diff_peers()
+                self._host()
+            except Exception:
+                logger.exception("Admin event feed error")
+            time.sleep(self.poll_interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="admin-events", daemon=True)
+            self._thread.start()
+        return self
+
+    def resync(self):
+        """Уведомления могли потеряться (разрыв LISTEN) — просим клиентов перечитать список."""
+        self._emit("resync", {})
+
+    # ---------- Поток для клиента ----------
+    def _event_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def _format(self, seq: int, event: str, data: Any) -> str:
+        return f"id: {self._event_id(seq)}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+    def _start_cursor(self, last_event_id: Optional[str]):
+        """(cursor, нужен ли resync) для переподключения с Last-Event-ID."""
+        if not last_event_id:
+            return self._seq, False
+        epoch, _, seq = last_event_id.partition("-")
+        try:
+            seq = int(seq)
+        except ValueError:
+            return self._seq, True
+        oldest = self._events[0][0] if self._events else self._seq + 1
+        if epoch != self.epoch or seq > self._seq or seq < oldest - 1:
+            return self._seq, True
+        return seq, False
+
+    def stream(self, last_event_id: Optional[str] = None) -> Iterator[str]:
+        with self._cond:
+            cursor, need_resync = self._start_cursor(last_event_id)
+            self._subscribers += 1
+            self._cond.notify_all()
+        try:
+            yield "retry: 3000\n\n"
+            if need_resync:
+                yield self._format(cursor, "resync", {})
+            else:
+                yield self._format(cursor, "hello", {"epoch": self.epoch})
+            yield self._format(cursor, "host", self.host_metrics())
+            deadline = time.monotonic() + self.max_stream
+            while time.monotonic() < deadline:
+                with self._cond:
+                    if self._seq <= cursor:
+                        self._cond.wait(self.heartbeat)
+                    oldest = self._events[0][0] if self._events else self._seq + 1
+                    if cursor < oldest - 1:
+                        # клиент отстал дальше буфера
+                        events, cursor = [(self._seq, "resync", {})], self._seq
+                    else:
+                        events = [e for e in self._events if e[0] > cursor]
+                if not events:
+                    yield ": ping\n\n"
+                    continue
+                for seq, event, data in events:
+                    cursor = seq
+                    yield self._format(seq, event, data)
+        finally:
+            with self._cond:
+                self._subscribers -= 1
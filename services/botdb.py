@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, List, Optional, Tuple
+
+import psycopg2.errors
+
+
+logger = logging.getLogger("securelink")
+
+# Запросы бота; готовятся (PREPARE) один раз на каждое соединение пула
+STATEMENTS = {
+    "bot_upsert_user": (
+        "(bigint, text, text, text, text)",
+        """
+        INSERT INTO users (telegram_id, username, first_name, last_name, language_code, created_at, last_login)
+        VALUES ($1, $2, $3, $4, $5, NOW(), NOW())
+        ON CONFLICT (telegram_id) DO UPDATE SET last_login = NOW()
+        RETURNING id, (xmax = 0)
+        """,
+    ),
+    "bot_latest_config": (
+        "(bigint)",
+        """
+        SELECT id, conf_file, plan FROM orders
+        WHERE telegram_id = $1 AND status = 'paid' AND conf_file IS NOT NULL
+        ORDER BY created_at DESC LIMIT 1
+        """,
+    ),
+    "bot_paid_config_by_email": (
+        "(text)",
+        """
+        SELECT id, conf_file, plan FROM orders
+        WHERE email = $1 AND status = 'paid' AND conf_file IS NOT NULL
+        ORDER BY id DESC LIMIT 1
+        """,
+    ),
+    "bot_take_payment_messages": (
+        "(bigint)",
+        """
+        WITH latest AS (
+            SELECT message_ids FROM payment_messages WHERE telegram_id = $1 ORDER BY id DESC LIMIT 1
+        ), removed AS (
+            DELETE FROM payment_messages WHERE telegram_id = $1
+        )
+        SELECT message_ids FROM latest
+        """,
+    ),
+    "bot_store_payment_messages": (
+        "(bigint, jsonb)",
+        "INSERT INTO payment_messages (telegram_id, message_ids) VALUES ($1, $2)",
+    ),
+}
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS payment_messages (
+    id SERIAL PRIMARY KEY,
+    telegram_id BIGINT,
+    message_ids JSONB,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+"""
+
+
+class BotDB:
+    """
+    Асинхронный слой БД для Telegram-бота.
+
+    Запросы выполняются в ограниченном пуле потоков поверх пула соединений
+    app.db, поэтому медленный запрос занимает один поток, а не event loop
+    aiogram. max_workers не больше размера пула соединений — потоки не
+    ждут соединение внутри POOL.acquire(). Поиск конфигов идёт через
+    get_read_conn (реплика, app.db.get_read_conn), если он передан.
+    """
+
+    def __init__(self, get_conn, *, get_read_conn=None, max_workers: int = 8) -> None:
+        self.get_conn = get_conn
+        self.get_read_conn = get_read_conn or (lambda *keys: get_conn())
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._prepared = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._executor is None:
+            with self.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SCHEMA_SQL)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bot-db")
+        return self
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    # ---------- Выполнение ----------
+    @staticmethod
+    def _session(conn):
+        # PREPARE живёт в сессии; backend_pid отличает соединения, пересозданные пулом,
+        # а dsn — primary от реплики, где pid могут совпасть
+        return conn.dsn, conn.get_backend_pid()
+
+    def _prepare(self, conn):
+        session = self._session(conn)
+        if session in self._prepared:
+            return
+        with conn.cursor() as cur:
+            for name, (types, sql) in STATEMENTS.items():
+                cur.execute(f"PREPARE {name} {types} AS {sql}")
+        conn.commit()
+        with self._lock:
+            self._prepared.add(session)
+
+    def _call(self, get_conn: Callable, func: Callable, args: tuple):
+        session = None
+        try:
+            with get_conn() as conn:
+                self._prepare(conn)
+                session = self._session(conn)
+                with conn.cursor() as cur:
+                    return func(cur, *args)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # pid достался новому бэкенду без PREPARE — готовим заново и повторяем
+            with self._lock:
+                self._prepared.discard(session)
+            with get_conn() as conn:
+                self._prepare(conn)
+                with conn.cursor() as cur:
+                    return func(cur, *args)
+
+    async def run(self, func: Callable, *args) -> Any:
+        """func(cur, *args) в потоке пула, в транзакции."""
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self._call, self.get_conn, func, args))
+
+    async def run_read(self, keys: tuple, func: Callable, *args) -> Any:
+        """Как run, но в read-only транзакции на реплике; keys — см. app.db.get_read_conn."""
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        get_conn = partial(self.get_read_conn, *keys)
+        return await loop.run_in_executor(self._executor, partial(self._call, get_conn, func, args))
+
+    async def call(self, func: Callable, *args) -> Any:
+        """func(*args) в потоке пула — для кода, который сам берёт соединение (кеши поверх app.db)."""
+        if self._executor is None:
+            self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    # ---------- Запросы ----------
+    @staticmethod
+    def _upsert_user(cur, telegram_id, username, first_name, last_name, language_code) -> int:
+        cur.execute(
+            "EXECUTE bot_upsert_user (%s, %s, %s, %s, %s)",
+            (telegram_id, username, first_name, last_name, language_code),
+        )
+        user_id, created = cur.fetchone()
+        if created:
+            logger.info(f"Created new user {user_id}")
+        return user_id
+
+    async def upsert_user(self, telegram_id, username, first_name, last_name, language_code) -> int:
+        return await self.run(self._upsert_user, telegram_id, username, first_name, last_name, language_code)
+
+    @staticmethod
+    def _fetchone(cur, statement: str, *params):
+        placeholders = ", ".join(["%s"] * len(params))
+        cur.execute(f"EXECUTE {statement} ({placeholders})", params)
+        return cur.fetchone()
+
+    async def latest_config(self, telegram_id: int) -> Optional[Tuple[int, str, str]]:
+        return await self.run_read((f"tg:{telegram_id}",), self._fetchone, "bot_latest_config", telegram_id)
+
+    async def paid_config_by_email(self, email: str) -> Optional[Tuple[int, str, str]]:
+        return await self.run_read((f"email:{email}",), self._fetchone, "bot_paid_config_by_email", email)
+
+    async def take_payment_messages(self, telegram_id: int) -> List[int]:
+        row = await self.run(self._fetchone, "bot_take_payment_messages", telegram_id)
+        if not row or row[0] is None:
+            return []
+        return row[0] if isinstance(row[0], list) else json.loads(row[0])
+
+    @staticmethod
+    def _store_payment_messages(cur, telegram_id, message_ids):
+        cur.execute("EXECUTE bot_store_payment_messages (%s, %s)", (telegram_id, json.dumps(message_ids)))
+
+    async def store_payment_messages(self, telegram_id: int, message_ids: List[int]):
+        await self.run(self._store_payment_messages, telegram_id, message_ids)
@@ -0,0 +1,157 @@
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+
+logger = logging.getLogger("securelink")
+
+# Ключ pg_advisory_lock, общий для всех воркеров
+EXPIRY_LOCK_KEY = 0x5EC0_0001
+
+
+class ExpiryEngine:
+    """
+    Истечение подписок: один лидер на все воркеры gunicorn.
+
+    Лидер выбирается через pg_try_advisory_lock на выделенном соединении
+    (блокировка живёт, пока живо соединение). Лидер одним UPDATE ... RETURNING
+    переводит в 'expired' все оплаченные заказы с expires_at <= now() (по
+    частичному индексу idx_orders_paid_expires), снимает их пиров одним
+    пакетом и спит до ближайшего известного expires_at.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        *,
+        connect_dedicated: Callable,
+        remove_peers: Callable[[List[str]], None],
+        max_sleep: float = 300.0,
+        standby_sleep: float = 30.0,
+        lock_key: int = EXPIRY_LOCK_KEY,
+    ) -> None:
+        self.get_conn = get_conn
+        self.connect_dedicated = connect_dedicated
+        self.remove_peers = remove_peers
+        self.max_sleep = max_sleep
+        self.standby_sleep = standby_sleep
+        self.lock_key = lock_key
+        self._leader_conn = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------- Лидерство ----------
+    def _try_become_leader(self) -> bool:
+        if self._leader_conn is not None and not self._leader_conn.closed:
+            # соединение с блокировкой должно быть живым, иначе лидерство уже потеряно
+            with self._leader_conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        conn = self.connect_dedicated()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s);", (self.lock_key,))
+                if cur.fetchone()[0]:
+                    self._leader_conn = conn
+                    logger.info("Expiry engine: this process is the leader (advisory lock %s)", self.lock_key)
+                    return True
+        except Exception:
+            conn.close()
+            raise
+        conn.close()
+        return False
+
+    def _drop_leadership(self):
+        if self._leader_conn is not None:
+            try:
+                self._leader_conn.close()
+            except Exception:
+                pass
+        self._leader_conn = None
+
+    # ---------- Основная логика ----------
+    def expire_due(self) -> List[Tuple[int, str]]:
+        """Истекает все просроченные заказы одним запросом и снимает их пиров."""
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE orders SET status='expired' "
+                    "WHERE status='paid' AND expires_at <= NOW() AND public_key IS NOT NULL "
+                    "RETURNING id, public_key;"
+                )
+                expired = cur.fetchall()
+        # пиров снимаем только после COMMIT: иначе при сбое COMMIT заказ остался бы
+        # 'paid', а клиент — без пира до следующего продления
+        if expired:
+            self.remove_peers([public_key for _, public_key in expired])
+            logger.info("Expired %s orders", len(expired))
+        return expired
+
+    def next_expiry(self) -> Optional[datetime]:
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT MIN(expires_at) FROM orders "
+                    "WHERE status='paid' AND public_key IS NOT NULL;"
+                )
+                row = cur.fetchone()
+                return row[0] if row else None
+
+    def _seconds_until(self, moment: Optional[datetime]) -> float:
+        if moment is None:
+            return self.max_sleep
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        delta = (moment - datetime.now(timezone.utc)).total_seconds()
+        return min(max(delta, 0.0), self.max_sleep)
+
+    def run_once(self) -> float:
+        """Один шаг цикла; возвращает, сколько спать до следующего."""
+        if not self._try_become_leader():
+            return self.standby_sleep
+        self.expire_due()
+        # +1 с, чтобы проснуться уже после момента истечения
+        return self._seconds_until(self.next_expiry()) + 1.0
+
+    def wake(self, payload: str = ""):
+        """
+        Колбэк NOTIFY orders_changed: пересчитать ближайшее истечение досрочно.
+
+        Будит только лидера и только на оплаченные заказы — собственный UPDATE
+        в 'expired' тоже шлёт уведомление, но пересчитывать после него нечего.
+        Пустой payload (переподключение слушателя) будит без фильтра.
+        """
+        if self._leader_conn is None:
+            return
+        if payload:
+            try:
+                if json.loads(payload).get("status") != "paid":
+                    return
+            except (ValueError, AttributeError):
+                pass
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                delay = self.run_once()
+            except Exception as e:
+                logger.exception("Subscription checker error: %s", e)
+                self._drop_leadership()
+                delay = self.standby_sleep
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+        self._drop_leadership()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="expiry-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
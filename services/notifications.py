@@ -0,0 +1,201 @@
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from app.replica import stick_local
+
+
+logger = logging.getLogger("securelink")
+
+# NOTIFY из триггеров user_notifications (migrations/005_notification_counters.sql)
+NOTIFICATIONS_CHANNEL = "notifications_changed"
+
+_COLUMNS = "id, type, title, message, is_read, created_at, read_at"
+
+
+def _as_dict(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "type": row[1],
+        "title": row[2],
+        "message": row[3],
+        "is_read": row[4],
+        "created_at": row[5].isoformat() if row[5] else None,
+        "read_at": row[6].isoformat() if row[6] else None,
+    }
+
+
+class NotificationService:
+    """
+    Уведомления кабинета: лента, счётчик непрочитанных и long-poll.
+
+    Лента листается по id (?before=, keyset): страница — один проход по
+    idx_notifications_user_id_id, сколько бы уведомлений ни накопилось.
+    Непрочитанные и последний id лежат в user_notification_state, их ведут
+    триггеры в той же транзакции, что и вставку/прочтение. Те же триггеры
+    шлют notifications_changed, по которому wait() будит ждущие запросы
+    этого пользователя в каждом процессе (attach_listener).
+
+    Ждущий запрос занимает поток gunicorn, поэтому их не больше
+    max_waiters на процесс; сверх этого wait() отвечает сразу, и клиент
+    повторяет запрос через poll_after секунд. Соединение с БД во время
+    ожидания не держится.
+    """
+
+    def __init__(self, get_conn, get_read_conn: Callable, *, max_waiters: int = 4, poll_after: float = 15.0) -> None:
+        self.get_conn = get_conn
+        self.get_read_conn = get_read_conn
+        self.max_waiters = max_waiters
+        self.poll_after = poll_after
+        self._waiters: Dict[int, List[threading.Event]] = {}
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self.wakeups = 0
+        self.rejected = 0
+
+    # ---------- Чтение ----------
+    def _state(self, cur, user_id: int) -> Dict[str, int]:
+        cur.execute("SELECT unread, last_id FROM user_notification_state WHERE user_id = %s;", (user_id,))
+        row = cur.fetchone()
+        return {"unread_count": row[0], "last_id": row[1]} if row else {"unread_count": 0, "last_id": 0}
+
+    def page(self, user_id: int, *, before: int = None, limit: int = 20) -> Dict[str, Any]:
+        """Страница ленты, новые первыми; next_before — курсор следующей страницы или None."""
+        with self.get_read_conn(f"user:{user_id}") as conn:
+            with conn.cursor() as cur:
+                return self.read_page(cur, user_id, before=before, limit=limit)
+
+    def read_page(self, cur, user_id: int, *, before: int = None, limit: int = 20) -> Dict[str, Any]:
+        """page() на курсоре вызывающего (/api/user/bootstrap читает всё в одном соединении)."""
+        cur.execute(
+            f"SELECT {_COLUMNS} FROM user_notifications "
+            "WHERE user_id = %s AND (%s::integer IS NULL OR id < %s) "
+            "ORDER BY id DESC LIMIT %s;",
+            (user_id, before, before, limit + 1)
+        )
+        # лишняя строка — признак, что следующая страница не пуста
+        rows = cur.fetchall()
+        notifications = [_as_dict(row) for row in rows[:limit]]
+        return {
+            **self._state(cur, user_id),
+            "notifications": notifications,
+            "next_before": notifications[-1]["id"] if len(rows) > limit else None,
+        }
+
+    def newer(self, user_id: int, after: int, limit: int) -> Dict[str, Any]:
+        """Уведомления с id > after (старые первыми) и текущий счётчик."""
+        with self.get_read_conn(f"user:{user_id}") as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT {_COLUMNS} FROM user_notifications "
+                    "WHERE user_id = %s AND id > %s ORDER BY id LIMIT %s;",
+                    (user_id, after, limit)
+                )
+                notifications = [_as_dict(row) for row in cur.fetchall()]
+                state = self._state(cur, user_id)
+        return {**state, "notifications": notifications}
+
+    # ---------- Прочтение ----------
+    def mark_read(self, user_id: int, notification_id: int) -> Optional[int]:
+        """Отмечает одно уведомление; возвращает новый счётчик или None, если уведомления нет."""
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE user_notifications SET is_read = TRUE, read_at = COALESCE(read_at, %s) "
+                    "WHERE id = %s AND user_id = %s;",
+                    (datetime.now(timezone.utc), notification_id, user_id)
+                )
+                if cur.rowcount == 0:
+                    return None
+                unread = self._state(cur, user_id)["unread_count"]
+        # read_sticky шлёт триггер; следующий запрос клиента может опередить его LISTEN
+        stick_local(f"user:{user_id}")
+        return unread
+
+    def mark_all_read(self, user_id: int, up_to: int = None) -> Dict[str, int]:
+        """
+        Отмечает все непрочитанные (по частичному idx_notifications_unread) одним
+        оператором; up_to — не трогать пришедшие после того, что видел клиент.
+        """
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE user_notifications SET is_read = TRUE, read_at = %s "
+                    "WHERE user_id = %s AND NOT is_read AND (%s::integer IS NULL OR id <= %s);",
+                    (datetime.now(timezone.utc), user_id, up_to, up_to)
+                )
+                result = {"updated": cur.rowcount, **self._state(cur, user_id)}
+        stick_local(f"user:{user_id}")
+        return result
+
+    # ---------- Long-poll ----------
+    def wait(self, user_id: int, *, after: int, unread: int = None, timeout: float = 25.0,
+             limit: int = 50) -> Dict[str, Any]:
+        """
+        Ждёт до timeout, пока у пользователя не появятся уведомления с id > after
+        или не изменится счётчик непрочитанных (если клиент передал свой unread).
+        Возвращает newer() и changed; при исчерпании мест — сразу, с poll_after.
+        """
+        event = threading.Event()
+        with self._lock:
+            admitted = self._waiting < self.max_waiters
+            if admitted:
+                self._waiting += 1
+                # регистрация до чтения состояния: NOTIFY между ними не потеряется
+                self._waiters.setdefault(user_id, []).append(event)
+            else:
+                self.rejected += 1
+        try:
+            result = self.newer(user_id, after, limit)
+            if not admitted:
+                return {**result, "changed": self._changed(result, after, unread), "poll_after": self.poll_after}
+            if self._changed(result, after, unread) or not event.wait(timeout):
+                return {**result, "changed": self._changed(result, after, unread)}
+            result = self.newer(user_id, after, limit)
+            return {**result, "changed": self._changed(result, after, unread)}
+        finally:
+            if admitted:
+                with self._lock:
+                    self._waiting -= 1
+                    events = self._waiters.get(user_id, [])
+                    events.remove(event)
+                    if not events:
+                        self._waiters.pop(user_id, None)
+
+    @staticmethod
+    def _changed(result: Dict[str, Any], after: int, unread: Optional[int]) -> bool:
+        return result["last_id"] > after or (unread is not None and result["unread_count"] != unread)
+
+    def on_notify(self, payload: str):
+        try:
+            user_id = int(json.loads(payload)["user_id"])
+        except (ValueError, KeyError, TypeError):
+            return self.wake_all()
+        with self._lock:
+            events = list(self._waiters.get(user_id, ()))
+            self.wakeups += len(events)
+        for event in events:
+            event.set()
+
+    def wake_all(self):
+        """После переподключения LISTEN уведомления могли потеряться: пусть клиенты перечитают."""
+        with self._lock:
+            events = [event for events in self._waiters.values() for event in events]
+        for event in events:
+            event.set()
+
+    def attach_listener(self, listener, channel: str = NOTIFICATIONS_CHANNEL):
+        """Подписывать после app.db.attach_read_listener: сначала прилипание к primary, потом пробуждение."""
+        listener.subscribe(channel, self.on_notify)
+        listener.on_reconnect(self.wake_all)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "waiting": self._waiting,
+                "max_waiters": self.max_waiters,
+                "wakeups": self.wakeups,
+                "rejected": self.rejected,
+            }
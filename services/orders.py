@@ -1,11 +1,15 @@
 import os
 import json
 import base64
-import subprocess
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from dateutil.relativedelta import relativedelta
 import logging
 from app import config
+from app.replica import stick_local
+from app.wgkeys import derive_public_key
+from services.subscriptions import as_utc
 
 
 logger = logging.getLogger("securelink")
@@ -37,6 +41,9 @@ class OrderService:
         server_public_key: str,
         server_endpoint: str,
         dns_addr: str,
+        qr_cache=None,
+        remove_peers_from_conf=None,
+        release_ip=None,
     ) -> None:
         self.get_conn = get_conn
         self.wg_set_peer = wg_set_peer
@@ -50,23 +57,17 @@ class OrderService:
         self.server_public_key = server_public_key
         self.server_endpoint = server_endpoint
         self.dns_addr = dns_addr
+        self.qr_cache = qr_cache
+        self.remove_peers_from_conf = remove_peers_from_conf
+        self.release_ip = release_ip
+        self._local = threading.local()
 
     # ---------- Вспомогательные ----------
     @staticmethod
     def calculate_expiry_extended(plan_type: str, current_expiry):
         now = datetime.now(timezone.utc)
-        base = now
-        if current_expiry:
-            try:
-                exp_dt = current_expiry
-                if isinstance(exp_dt, str):
-                    exp_dt = datetime.fromisoformat(exp_dt)
-                    if exp_dt.tzinfo is None:
-                        exp_dt = exp_dt.replace(tzinfo=timezone.utc)
-                if exp_dt > now:
-                    base = exp_dt
-            except Exception:
-                pass
+        exp_dt = as_utc(current_expiry)
+        base = exp_dt if exp_dt and exp_dt > now else now
         if plan_type == "month1":
             return (base + relativedelta(months=1)).isoformat()
         elif plan_type == "month6":
@@ -75,11 +76,18 @@ class OrderService:
             return (base + relativedelta(years=1)).isoformat()
         return base.isoformat()
 
-    def create_client_conf(self, order_id: int, email: str, plan_name: str):
+    def create_client_conf(self, cur, order_id: int, email: str, plan_name: str):
+        """Ключи, адрес (аренда — в транзакции cur), пир и .conf для заказа"""
         private_key, public_key = self.wg_gen_keypair()
-        client_ip = self.get_next_free_ip()
+        client_ip = self.get_next_free_ip(cur)
+        # всё созданное вне транзакции — в журнал provisioning(), чтобы снять при откате
+        created = {"order_id": order_id, "client_ip": client_ip}
+        journal = getattr(self._local, "created", None)
+        if journal is not None:
+            journal.append(created)
 
         if self.wg_set_peer(public_key, client_ip):
+            created["public_key"] = public_key
             self.append_peer_to_conf(public_key, client_ip)
             logger.info("Peer %s -> %s added for %s", public_key, client_ip, email)
         else:
@@ -93,112 +101,169 @@ class OrderService:
 
         os.makedirs(self.conf_dir, exist_ok=True)
         conf_path = os.path.join(self.conf_dir, f"wg_{order_id}.conf")
+        created["conf_path"] = conf_path
         with open(conf_path, "w") as f:
             f.write(conf_text)
         os.chmod(conf_path, 0o600)
         logger.info("Saved client config: %s", conf_path)
+        if self.qr_cache is not None:
+            # QR рендерится один раз здесь, а не на каждый запрос /qr и отправку в Telegram
+            self.qr_cache.precompute(order_id, conf_text)
         return conf_path, public_key, client_ip
 
-    # ---------- Основная логика ----------
-    def create_order_internal(self, email: str, plan_id: int, user_id: int = None, telegram_id: int = None):
+    @contextmanager
+    def provisioning(self):
         """
-        Создание/продление заказа после успешной оплаты.
-        Возвращает (token, None) или (None, error_message)
+        Пиры, .conf и адреса, созданные create_client_conf внутри блока,
+        снимаются, если блок завершился исключением: откат транзакции заказа
+        их не касается, а повтор создал бы новые. COMMIT должен быть внутри
+        блока. Вложенный блок при ошибке снимает только своё, при успехе
+        передаёт созданное внешнему.
         """
+        outer = getattr(self._local, "created", None)
+        created = self._local.created = []
         try:
-            plan_name, price, plan_type = PLANS.get(plan_id, ("неизвестно", 0, None))
-            if not email or price <= 0:
-                return None, "Неверные данные"
+            yield
+        except BaseException:
+            self._undo(created)
+            created = []
+            raise
+        finally:
+            self._local.created = outer
+            if outer is not None:
+                outer.extend(created)
+
+    def _undo(self, created):
+        for entry in reversed(created):
+            try:
+                public_key = entry.get("public_key")
+                if public_key:
+                    self.wg_remove_peer(public_key)
+                    if self.remove_peers_from_conf is not None:
+                        self.remove_peers_from_conf([public_key])
+                conf_path = entry.get("conf_path")
+                if conf_path and os.path.exists(conf_path):
+                    os.remove(conf_path)
+                    if self.qr_cache is not None:
+                        self.qr_cache.discard(entry["order_id"])
+                if self.release_ip is not None:
+                    self.release_ip(entry["client_ip"])
+                logger.info("Rolled back provisioning of order %s (%s)", entry["order_id"], entry["client_ip"])
+            except Exception:
+                logger.exception("Failed to roll back provisioning of order %s", entry["order_id"])
+
+    # ---------- Основная логика ----------
+    def apply_payment(self, cur, email: str, plan_id: int, user_id: int = None, telegram_id: int = None):
+        """
+        Создание/продление заказа в транзакции вызывающего (cur).
+        Возвращает (order_id, plan_name, price); при ошибке бросает исключение —
+        откат транзакции откатывает и продление.
+        """
+        plan_name, price, plan_type = PLANS.get(plan_id, ("неизвестно", 0, None))
+        if not email or price <= 0:
+            raise ValueError("Неверные данные")
+
+        now = datetime.now(timezone.utc)
+
+        # Последний заказ по email; блокировка строки сериализует параллельные оплаты
+        cur.execute(
+            "SELECT id, conf_file, public_key, client_ip, status, expires_at "
+            "FROM orders WHERE email=%s ORDER BY id DESC LIMIT 1 FOR UPDATE;",
+            (email,)
+        )
+        row = cur.fetchone()
+        current_expiry = None
+
+        if row:
+            order_id, conf_file, public_key, client_ip, status, current_expiry = row
 
-            now = datetime.now(timezone.utc)
+            # Если конфиг отсутствует — создаём новый
+            if not conf_file or not os.path.exists(conf_file):
+                old_public_key, old_client_ip = public_key, client_ip
+                conf_path, public_key, client_ip = self.create_client_conf(cur, order_id, email, plan_name)
+                cur.execute(
+                    "UPDATE orders SET conf_file=%s, public_key=%s, client_ip=%s WHERE id=%s;",
+                    (conf_path, public_key, client_ip, order_id)
+                )
+                # прежний пир больше не привязан к заказу: его не снимет даже истечение
+                if old_public_key and old_public_key != public_key:
+                    self.wg_remove_peer(old_public_key)
+                    if self.remove_peers_from_conf is not None:
+                        self.remove_peers_from_conf([old_public_key])
+                # аренда прежнего адреса снимается в этой же транзакции
+                if old_client_ip and old_client_ip != client_ip and self.release_ip is not None:
+                    self.release_ip(old_client_ip, cur)
+                logger.info("Updated order %s with new conf", order_id)
+                # письмо уйдёт из outbox после COMMIT этой же транзакции
+                self.send_conf_email(cur, email, conf_path)
 
-            with self.get_conn() as conn:
-                with conn.cursor() as cur:
-                    # Последний заказ по email
+            # Реактивируем истекший заказ
+            if status == "expired":
+                if conf_file and os.path.exists(conf_file):
+                    conf_path = conf_file
+                    fields = self.parse_conf(conf_path)
+                    private_key = fields.get("PrivateKey")
+                    address = fields.get("Address")
+                    if not public_key and private_key:
+                        try:
+                            public_key = derive_public_key(private_key)
+                        except Exception as e:
+                            logger.exception("Failed to derive public key: %s", e)
+                    if address and public_key:
+                        self.wg_set_peer(public_key, address)
+                        self.append_peer_to_conf(public_key, address)
                     cur.execute(
-                        "SELECT id, conf_file, public_key, client_ip, status, expires_at "
-                        "FROM orders WHERE email=%s ORDER BY id DESC LIMIT 1;",
-                        (email,)
+                        "UPDATE orders SET status='paid', public_key=COALESCE(public_key,%s), "
+                        "client_ip=COALESCE(client_ip,%s) WHERE id=%s;",
+                        (public_key, address, order_id)
                     )
-                    row = cur.fetchone()
-                    current_expiry = None
-
-                    if row:
-                        order_id, conf_file, public_key, client_ip, status, current_expiry = row
-
-                        # Если конфиг отсутствует — создаём новый
-                        if not conf_file or not os.path.exists(conf_file):
-                            conf_path, public_key, client_ip = self.create_client_conf(order_id, email, plan_name)
-                            cur.execute(
-                                "UPDATE orders SET conf_file=%s, public_key=%s, client_ip=%s WHERE id=%s;",
-                                (conf_path, public_key, client_ip, order_id)
-                            )
-                            logger.info("Updated order %s with new conf", order_id)
-                            try:
-                                self.send_conf_email(email, conf_path)
-                            except Exception:
-                                logger.exception("Failed to send conf email")
-
-                        # Реактивируем истекший заказ
-                        if status == "expired":
-                            if conf_file and os.path.exists(conf_file):
-                                conf_path = conf_file
-                                fields = self.parse_conf(conf_path)
-                                private_key = fields.get("PrivateKey")
-                                address = fields.get("Address")
-                                if not public_key and private_key:
-                                    try:
-                                        public_key = subprocess.check_output(
-                                            ["wg", "pubkey"], input=private_key.encode()
-                                        ).decode().strip()
-                                    except Exception as e:
-                                        logger.exception("Failed to derive public key: %s", e)
-                                if address and public_key:
-                                    self.wg_set_peer(public_key, address)
-                                    self.append_peer_to_conf(public_key, address)
-                                cur.execute(
-                                    "UPDATE orders SET status='paid', public_key=COALESCE(public_key,%s), "
-                                    "client_ip=COALESCE(client_ip,%s) WHERE id=%s;",
-                                    (public_key, address, order_id)
-                                )
-                                logger.info("Reactivated expired order %s", order_id)
-                                try:
-                                    self.send_conf_email(email, conf_path)
-                                except Exception:
-                                    logger.exception("Failed to send conf email on reactivation")
-
-                    expires_at = self.calculate_expiry_extended(plan_type, current_expiry)
-
-                    # Обновляем существующий заказ или создаём новый
-                    if row:
-                        cur.execute(
-                            "UPDATE orders SET expires_at=%s, plan=%s, price=%s, status='paid' WHERE id=%s;",
-                            (expires_at, plan_name, price, order_id)
-                        )
-                        logger.info("Extended order %s until %s", order_id, expires_at)
-                    else:
-                        cur.execute(
-                            "INSERT INTO orders(email, plan, price, status, created_at, expires_at, user_id, telegram_id) "
-                            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;",
-                            (email, plan_name, price, "paid", now.isoformat(), expires_at, user_id, telegram_id)
-                        )
-                        order_id = cur.fetchone()[0]
-                        conf_path, public_key, client_ip = self.create_client_conf(order_id, email, plan_name)
-                        cur.execute(
-                            "UPDATE orders SET conf_file=%s, public_key=%s, client_ip=%s WHERE id=%s;",
-                            (conf_path, public_key, client_ip, order_id)
-                        )
-                        logger.info("Created new order %s", order_id)
-                        try:
-                            self.send_conf_email(email, conf_path)
-                        except Exception:
-                            logger.exception("Failed to send conf email on new order")
-                        # Сохраняем telegram_id, если передан (для выдачи в боте)
-                        if telegram_id:
-                            try:
-                                cur.execute("UPDATE orders SET telegram_id=%s WHERE id=%s;", (telegram_id, order_id))
-                            except Exception:
-                                logger.exception("Failed to store telegram_id on order")
+                    logger.info("Reactivated expired order %s", order_id)
+                    self.send_conf_email(cur, email, conf_path)
+
+        expires_at = self.calculate_expiry_extended(plan_type, current_expiry)
+
+        # Обновляем существующий заказ или создаём новый
+        if row:
+            cur.execute(
+                "UPDATE orders SET expires_at=%s, plan=%s, price=%s, status='paid' WHERE id=%s;",
+                (expires_at, plan_name, price, order_id)
+            )
+            logger.info("Extended order %s until %s", order_id, expires_at)
+        else:
+            cur.execute(
+                "INSERT INTO orders(email, plan, price, status, created_at, expires_at, user_id, telegram_id) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id;",
+                (email, plan_name, price, "paid", now.isoformat(), expires_at, user_id, telegram_id)
+            )
+            order_id = cur.fetchone()[0]
+            conf_path, public_key, client_ip = self.create_client_conf(cur, order_id, email, plan_name)
+            cur.execute(
+                "UPDATE orders SET conf_file=%s, public_key=%s, client_ip=%s WHERE id=%s;",
+                (conf_path, public_key, client_ip, order_id)
+            )
+            logger.info("Created new order %s", order_id)
+            self.send_conf_email(cur, email, conf_path)
+            # Сохраняем telegram_id, если передан (для выдачи в боте)
+            if telegram_id:
+                try:
+                    cur.execute("UPDATE orders SET telegram_id=%s WHERE id=%s;", (telegram_id, order_id))
+                except Exception:
+                    logger.exception("Failed to store telegram_id on order")
+
+        return order_id, plan_name, price
+
+    def create_order_internal(self, email: str, plan_id: int, user_id: int = None, telegram_id: int = None):
+        """
+        Создание/продление заказа после успешной оплаты.
+        Возвращает (token, None) или (None, error_message)
+        """
+        try:
+            with self.provisioning():
+                with self.get_conn() as conn:
+                    with conn.cursor() as cur:
+                        order_id, plan_name, price = self.apply_payment(cur, email, plan_id, user_id, telegram_id)
+            # orders_changed шлёт триггер; редирект клиента может опередить его LISTEN
+            stick_local(f"email:{email}", user_id and f"user:{user_id}", telegram_id and f"tg:{telegram_id}")
 
             token_data = {
                 "id": order_id,
@@ -209,6 +274,8 @@ class OrderService:
             token = base64.b64encode(json.dumps(token_data).encode()).decode()
             return token, None
 
+        except ValueError as e:
+            return None, str(e)
         except Exception as e:
             logger.exception("Ошибка создания заказа")
             return None, str(e)
@@ -0,0 +1,297 @@
+import json
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from app.delivery import PermanentError, RetryLater
+
+
+logger = logging.getLogger("securelink")
+
+# Канал NOTIFY: будит диспетчер сразу после COMMIT транзакции с новым сообщением
+OUTBOX_CHANNEL = "outbox"
+# Ключ pg_advisory_lock: outbox разбирает один процесс — лимиты скорости общие
+OUTBOX_LOCK_KEY = 0x5EC0_0002
+
+SENT_RETENTION_DAYS = 7
+
+
+def enqueue(cur, channel: str, payload: Dict[str, Any]) -> int:
+    """Кладёт сообщение в outbox в текущей транзакции (уйдёт только после COMMIT)."""
+    cur.execute(
+        "INSERT INTO outbox (channel, payload) VALUES (%s, %s) RETURNING id;",
+        (channel, json.dumps(payload, default=str))
+    )
+    outbox_id = cur.fetchone()[0]
+    cur.execute("SELECT pg_notify(%s, %s);", (OUTBOX_CHANNEL, channel))
+    return outbox_id
+
+
+class TokenBucket:
+    """Ограничение скорости канала: rate сообщений в секунду, всплеск до burst."""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class OutboxDispatcher:
+    """
+    Разбор outbox пулом потоков.
+
+    Лидер (pg_try_advisory_lock на выделенном соединении, как у
+    ExpiryEngine) запускает по несколько потоков на канал; у каждого потока
+    свой отправитель с постоянным соединением. Поток забирает пачку
+    сообщений через UPDATE ... FOR UPDATE SKIP LOCKED, сдвигая
+    next_attempt_at на lease секунд: если процесс упадёт посреди отправки,
+    сообщение снова станет доступным. Ошибки — повтор с экспоненциальной
+    задержкой, после max_attempts сообщение помечается failed.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        *,
+        connect_dedicated: Callable,
+        senders: Dict[str, Callable[[], Any]],
+        workers: Dict[str, int] = None,
+        rates: Dict[str, float] = None,
+        batch_size: int = 10,
+        lease: float = 300.0,
+        max_attempts: int = 8,
+        base_delay: float = 30.0,
+        max_delay: float = 3600.0,
+        poll_interval: float = 30.0,
+        standby_sleep: float = 30.0,
+        lock_key: int = OUTBOX_LOCK_KEY,
+    ) -> None:
+        self.get_conn = get_conn
+        self.connect_dedicated = connect_dedicated
+        # channel -> фабрика отправителя (у каждого потока свой экземпляр)
+        self.senders = senders
+        self.workers = workers or {}
+        self.buckets = {ch: TokenBucket(rate) for ch, rate in (rates or {}).items() if rate}
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.standby_sleep = standby_sleep
+        self.lock_key = lock_key
+        self._leader_conn = None
+        self._leading = threading.Event()
+        self._stop = threading.Event()
+        self._wakeups = {channel: threading.Event() for channel in senders}
+        self._threads: List[threading.Thread] = []
+
+    # ---------- Лидерство ----------
+    def _try_become_leader(self) -> bool:
+        if self._leader_conn is not None and not self._leader_conn.closed:
+            with self._leader_conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        conn = self.connect_dedicated()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s);", (self.lock_key,))
+                if cur.fetchone()[0]:
+                    self._leader_conn = conn
+                    logger.info("Outbox dispatcher: this process is the leader (advisory lock %s)", self.lock_key)
+                    return True
+        except Exception:
+            conn.close()
+            raise
+        conn.close()
+        return False
+
+    def _drop_leadership(self):
+        self._leading.clear()
+        if self._leader_conn is not None:
+            try:
+                self._leader_conn.close()
+            except Exception:
+                pass
+        self._leader_conn = None
+
+    def _leader_loop(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                if self._try_become_leader():
+                    self._leading.set()
+                    if time.monotonic() - last_prune > 3600:
+                        self.prune()
+                        last_prune = time.monotonic()
+                else:
+                    self._leading.clear()
+            except Exception as e:
+                logger.exception("Outbox leader check failed: %s", e)
+                self._drop_leadership()
+            self._stop.wait(self.standby_sleep)
+        self._drop_leadership()
+
+    # ---------- Очередь ----------
+    def _claim(self, channel: str) -> List[tuple]:
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE outbox o
+                    SET attempts = o.attempts + 1, next_attempt_at = NOW() + make_interval(secs => %s)
+                    FROM (
+                        SELECT id FROM outbox
+                        WHERE status = 'pending' AND channel = %s AND next_attempt_at <= NOW()
+                        ORDER BY next_attempt_at, id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    ) due
+                    WHERE o.id = due.id
+                    RETURNING o.id, o.payload, o.attempts;
+                    """,
+                    (self.lease, channel, self.batch_size)
+                )
+                return cur.fetchall()
+
+    def _finish(self, outbox_id: int, status: str, error: str = None, delay: float = None):
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                if status == "sent":
+                    cur.execute(
+                        "UPDATE outbox SET status='sent', sent_at=NOW(), last_error=NULL WHERE id=%s;",
+                        (outbox_id,)
+                    )
+                elif status == "retry":
+                    cur.execute(
+                        "UPDATE outbox SET next_attempt_at = NOW() + make_interval(secs => %s), last_error=%s "
+                        "WHERE id=%s;",
+                        (delay, error, outbox_id)
+                    )
+                else:
+                    cur.execute(
+                        "UPDATE outbox SET status='failed', last_error=%s WHERE id=%s;",
+                        (error, outbox_id)
+                    )
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def _deliver(self, channel: str, sender, outbox_id: int, payload, attempts: int):
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        bucket = self.buckets.get(channel)
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            sender.send(payload)
+        except PermanentError as e:
+            logger.error("Outbox %s #%s dropped: %s", channel, outbox_id, e)
+            self._finish(outbox_id, "failed", str(e))
+            return
+        except RetryLater as e:
+            # attempts растёт при каждом захвате, так что 429 без конца тоже упирается в потолок
+            if attempts >= self.max_attempts:
+                logger.error("Outbox %s #%s still throttled after %s attempts: %s", channel, outbox_id, attempts, e)
+                self._finish(outbox_id, "failed", str(e))
+            else:
+                self._finish(outbox_id, "retry", str(e), e.delay or self._backoff(attempts))
+            return
+        except Exception as e:
+            if attempts >= self.max_attempts:
+                logger.error("Outbox %s #%s failed after %s attempts: %s", channel, outbox_id, attempts, e)
+                self._finish(outbox_id, "failed", str(e))
+            else:
+                logger.warning("Outbox %s #%s attempt %s failed: %s", channel, outbox_id, attempts, e)
+                self._finish(outbox_id, "retry", str(e), self._backoff(attempts))
+            return
+        self._finish(outbox_id, "sent")
+
+    def _worker_loop(self, channel: str):
+        sender = None
+        wakeup = self._wakeups[channel]
+        while not self._stop.is_set():
+            if not self._leading.is_set():
+                if sender is not None:
+                    sender.close()
+                    sender = None
+                self._leading.wait(self.standby_sleep)
+                continue
+            try:
+                rows = self._claim(channel)
+                if not rows:
+                    wakeup.wait(self.poll_interval)
+                    wakeup.clear()
+                    continue
+                if sender is None:
+                    sender = self.senders[channel]()
+                for outbox_id, payload, attempts in rows:
+                    self._deliver(channel, sender, outbox_id, payload, attempts)
+            except Exception as e:
+                logger.exception("Outbox %s worker error: %s", channel, e)
+                self._stop.wait(5)
+        if sender is not None:
+            sender.close()
+
+    def wake(self, channel: str = ""):
+        """Колбэк NOTIFY: payload — имя канала."""
+        for name, event in self._wakeups.items():
+            if not channel or name == channel:
+                event.set()
+
+    # ---------- Обслуживание ----------
+    def prune(self):
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM outbox WHERE status = 'sent' AND sent_at < NOW() - make_interval(days => %s);",
+                    (SENT_RETENTION_DAYS,)
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и возраст самого старого сообщения по каналам."""
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT channel, status, COUNT(*), EXTRACT(EPOCH FROM NOW() - MIN(created_at)) "
+                    "FROM outbox WHERE status <> 'sent' GROUP BY channel, status;"
+                )
+                result: Dict[str, Any] = {}
+                for channel, status, count, oldest in cur.fetchall():
+                    result.setdefault(channel, {})[status] = {"count": count, "oldest_seconds": float(oldest or 0)}
+        return {"leader": self._leading.is_set(), "channels": result}
+
+    def start(self):
+        if self._threads:
+            return self
+        self._threads.append(threading.Thread(target=self._leader_loop, name="outbox-leader", daemon=True))
+        for channel in self.senders:
+            for i in range(max(1, self.workers.get(channel, 1))):
+                self._threads.append(
+                    threading.Thread(target=self._worker_loop, args=(channel,), name=f"outbox-{channel}-{i}", daemon=True)
+                )
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._leading.set()
+        self.wake()
@@ -0,0 +1,237 @@
+import json
+import logging
+import random
+import threading
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+logger = logging.getLogger("securelink")
+
+# Канал NOTIFY: будит обработчики сразу после записи нового события
+PAYMENT_EVENTS_CHANNEL = "payment_events"
+
+SUCCEEDED = "succeeded"
+
+
+def record_event(cur, event: Dict[str, Any]) -> bool:
+    """
+    Записывает уведомление ЮKassa по id платежа и возвращает True, если оно новое.
+
+    На платёж — одна строка. Повторная доставка того же уведомления ничего не
+    меняет; строка с промежуточным статусом (waiting_for_capture, canceled)
+    один раз переводится в succeeded, если пришло уведомление об оплате.
+    Обрабатываются только succeeded, остальные сразу получают state='skipped'.
+    """
+    payment = event["object"]
+    payment_id = str(payment["id"])
+    status = payment.get("status") or ""
+    state = "pending" if status == SUCCEEDED else "skipped"
+    cur.execute(
+        """
+        INSERT INTO payment_events (payment_id, event_type, payment_status, payload, state)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (payment_id) DO UPDATE
+        SET event_type = EXCLUDED.event_type, payment_status = EXCLUDED.payment_status,
+            payload = EXCLUDED.payload, state = EXCLUDED.state,
+            received_at = NOW(), next_attempt_at = NOW(), attempts = 0, last_error = NULL
+        WHERE payment_events.payment_status <> %s AND EXCLUDED.payment_status = %s
+        RETURNING payment_id;
+        """,
+        (payment_id, event.get("event"), status, json.dumps(event), state, SUCCEEDED, SUCCEEDED)
+    )
+    created = cur.fetchone() is not None
+    if created and state == "pending":
+        cur.execute("SELECT pg_notify(%s, %s);", (PAYMENT_EVENTS_CHANNEL, payment_id))
+    return created
+
+
+def replay(cur, payment_ids: Iterable[str] = None, *, failed: bool = False, stuck_seconds: float = None) -> List[str]:
+    """
+    Возвращает события в очередь: по списку id, все failed и/или pending,
+    которые ждут дольше stuck_seconds. Счётчик попыток сбрасывается.
+    Уже обработанные (done) не трогаются — повтор не продлит подписку дважды.
+    """
+    conditions, params = [], []
+    if payment_ids:
+        conditions.append("payment_id = ANY(%s)")
+        params.append(list(payment_ids))
+    if failed:
+        conditions.append("state = 'failed'")
+    if stuck_seconds is not None:
+        conditions.append("(state = 'pending' AND received_at < NOW() - make_interval(secs => %s))")
+        params.append(stuck_seconds)
+    if not conditions:
+        return []
+    cur.execute(
+        f"""
+        UPDATE payment_events
+        SET state = 'pending', attempts = 0, next_attempt_at = NOW(), last_error = NULL
+        WHERE state <> 'done' AND payment_status = %s AND ({' OR '.join(conditions)})
+        RETURNING payment_id;
+        """,
+        [SUCCEEDED] + params
+    )
+    replayed = [row[0] for row in cur.fetchall()]
+    if replayed:
+        cur.execute("SELECT pg_notify(%s, '');", (PAYMENT_EVENTS_CHANNEL,))
+    return replayed
+
+
+class PaymentEventProcessor:
+    """
+    Обработка событий оплаты пулом потоков.
+
+    Поток берёт одно due-событие через SELECT ... FOR UPDATE SKIP LOCKED и в
+    той же транзакции вызывает handle(cur, payment) и помечает событие done:
+    продление заказа, письма/сообщения в outbox и отметка об обработке
+    коммитятся вместе, поэтому платёж применяется ровно один раз, сколько бы
+    процессов ни разбирало очередь. Ошибка обработчика откатывается до
+    savepoint, событие остаётся pending с экспоненциальной задержкой, после
+    max_attempts — failed (вернуть в очередь: replay_payment_events.py).
+    Откат savepoint не снимает пиров, .conf и адреса, созданные обработчиком:
+    это делает provisioning (OrderService.provisioning) — при ошибке
+    обработчика и при сбое COMMIT, до того как попытка будет повторена.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        *,
+        handle: Callable[[Any, Dict[str, Any]], None],
+        provisioning: Callable[[], Any] = nullcontext,
+        workers: int = 2,
+        max_attempts: int = 10,
+        base_delay: float = 10.0,
+        max_delay: float = 900.0,
+        poll_interval: float = 30.0,
+    ) -> None:
+        self.get_conn = get_conn
+        self.handle = handle
+        self.provisioning = provisioning
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def process_one(self) -> Optional[str]:
+        """Обрабатывает одно событие; None — очередь пуста."""
+        with self.provisioning(), self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT payment_id, payload, attempts FROM payment_events
+                    WHERE state = 'pending' AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at, received_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED;
+                    """
+                )
+                row = cur.fetchone()
+                if row is None:
+                    return None
+                payment_id, payload, attempts = row
+                if isinstance(payload, str):
+                    payload = json.loads(payload)
+                attempts += 1
+                cur.execute("SAVEPOINT payment_event;")
+                try:
+                    with self.provisioning():
+                        self.handle(cur, payload["object"])
+                except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT payment_event;")
+                    if attempts >= self.max_attempts:
+                        logger.error("Payment %s failed after %s attempts: %s", payment_id, attempts, e)
+                        cur.execute(
+                            "UPDATE payment_events SET state='failed', attempts=%s, last_error=%s WHERE payment_id=%s;",
+                            (attempts, str(e), payment_id)
+                        )
+                    else:
+                        logger.warning("Payment %s attempt %s failed: %s", payment_id, attempts, e)
+                        cur.execute(
+                            "UPDATE payment_events SET attempts=%s, last_error=%s, "
+                            "next_attempt_at = NOW() + make_interval(secs => %s) WHERE payment_id=%s;",
+                            (attempts, str(e), self._backoff(attempts), payment_id)
+                        )
+                    return payment_id
+                cur.execute(
+                    "UPDATE payment_events SET state='done', attempts=%s, processed_at=NOW(), last_error=NULL "
+                    "WHERE payment_id=%s;",
+                    (attempts, payment_id)
+                )
+                logger.info("Payment %s processed", payment_id)
+                return payment_id
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.process_one() is None:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+            except Exception as e:
+                logger.exception("Payment worker error: %s", e)
+                self._stop.wait(5)
+
+    def wake(self, payload: str = ""):
+        """Колбэк NOTIFY."""
+        self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, возраст самого старого события и задержка обработки за час."""
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT state, COUNT(*) FROM payment_events GROUP BY state;")
+                counts = dict(cur.fetchall())
+                cur.execute(
+                    "SELECT EXTRACT(EPOCH FROM NOW() - MIN(received_at)), "
+                    "COUNT(*) FILTER (WHERE next_attempt_at <= NOW()) "
+                    "FROM payment_events WHERE state = 'pending';"
+                )
+                oldest, due = cur.fetchone()
+                cur.execute(
+                    """
+                    SELECT COUNT(*),
+                           percentile_cont(0.5) WITHIN GROUP (ORDER BY lag),
+                           percentile_cont(0.95) WITHIN GROUP (ORDER BY lag),
+                           MAX(lag)
+                    FROM (
+                        SELECT EXTRACT(EPOCH FROM processed_at - received_at) AS lag
+                        FROM payment_events
+                        WHERE state = 'done' AND processed_at > NOW() - INTERVAL '1 hour'
+                    ) recent;
+                    """
+                )
+                processed, p50, p95, lag_max = cur.fetchone()
+        return {
+            "states": counts,
+            "queue_depth": counts.get("pending", 0),
+            "due": due,
+            "oldest_pending_seconds": float(oldest or 0),
+            "last_hour": {
+                "processed": processed,
+                "lag_p50_seconds": float(p50 or 0),
+                "lag_p95_seconds": float(p95 or 0),
+                "lag_max_seconds": float(lag_max or 0),
+            },
+        }
+
+    def start(self):
+        if self._threads:
+            return self
+        for i in range(max(1, self.workers)):
+            thread = threading.Thread(target=self._worker_loop, name=f"payments-{i}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
@@ -0,0 +1,173 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+
+logger = logging.getLogger("securelink")
+
+EXPIRED_STATUS = "истекла"
+
+ORDER_COLUMNS = "id, email, user_id, telegram_id, plan, price, status, created_at, expires_at, conf_file, public_key, client_ip"
+_FIELDS = [c.strip() for c in ORDER_COLUMNS.split(",")]
+
+
+# ---------- Статус подписки: единственное место, где разбирается expires_at ----------
+def as_utc(value) -> Optional[datetime]:
+    """expires_at из БД (timestamptz) или ISO-строки -> aware datetime в UTC; мусор -> None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def is_expired(expires_at, now: datetime = None) -> bool:
+    exp = as_utc(expires_at)
+    return exp is not None and (now or datetime.now(timezone.utc)) > exp
+
+
+def effective_status(status: Optional[str], expires_at, now: datetime = None) -> Optional[str]:
+    """Статус заказа с учётом срока: просроченный до прохода ExpiryEngine — уже «истекла»."""
+    return EXPIRED_STATUS if is_expired(expires_at, now) else status
+
+
+def describe(order: Dict[str, Any], now: datetime = None) -> Dict[str, Any]:
+    """Строка orders + вычисленные is_expired/is_active/effective_status."""
+    now = now or datetime.now(timezone.utc)
+    expired = is_expired(order["expires_at"], now)
+    return {
+        **order,
+        "expires_at": as_utc(order["expires_at"]),
+        "is_expired": expired,
+        "is_active": order["status"] == "paid" and not expired,
+        "effective_status": EXPIRED_STATUS if expired else order["status"],
+    }
+
+
+class SubscriptionState:
+    """
+    Кеш заказов по email, user_id и telegram_id для проверок статуса.
+
+    В кеше лежат строки orders как есть, а активность считается при каждом
+    обращении (describe): подписка истекает со временем без записи в БД.
+    Любое изменение заказа (OrderService, ExpiryEngine, вебхук) вызывает
+    триггер orders_changed, и записи по его email/user_id/telegram_id
+    сбрасываются во всех процессах (attach_listener); ttl ограничивает
+    устаревание, если уведомление потерялось. Загрузка, начавшаяся до
+    сброса, в кеш не попадает (счётчик поколений).
+    """
+
+    def __init__(self, get_read_conn: Callable, *, ttl: float = 30.0, max_size: int = 20000) -> None:
+        self.get_read_conn = get_read_conn
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # ---------- Кеш ----------
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None, self._generation
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], None
+
+    def _put(self, key: str, rows: tuple, generation: int):
+        with self._lock:
+            if generation != self._generation or self.max_size <= 0:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _load(self, key: str, where: str, value, order: str = "id DESC", limit: int = None) -> tuple:
+        rows, generation = self._get(key)
+        if rows is not None:
+            return rows
+        # key совпадает с ключом прилипания app.replica: только что изменённый заказ читается с primary
+        with self.get_read_conn(key) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT {ORDER_COLUMNS} FROM orders WHERE {where} ORDER BY {order}"
+                    + (f" LIMIT {int(limit)};" if limit else ";"),
+                    (value,),
+                )
+                rows = tuple(dict(zip(_FIELDS, row)) for row in cur.fetchall())
+        self._put(key, rows, generation)
+        return rows
+
+    def invalidate(self, *keys: str):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if key and self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def on_orders_notify(self, payload: str):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return self.clear()
+        self.invalidate(
+            data.get("email") and f"email:{data['email']}",
+            data.get("user_id") and f"user:{data['user_id']}",
+            data.get("telegram_id") and f"tg:{data['telegram_id']}",
+        )
+
+    def attach_listener(self, listener, channel: str = "orders_changed"):
+        """Подписывать после app.db.attach_read_listener: сначала прилипание к primary, потом сброс."""
+        listener.subscribe(channel, self.on_orders_notify)
+        listener.on_reconnect(self.clear)
+
+    # ---------- Запросы ----------
+    def latest_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Последний заказ по email (как /check-subscription) или None."""
+        rows = self._load(f"email:{email}", "email = %s", email, limit=1)
+        return describe(rows[0]) if rows else None
+
+    def latest_by_telegram(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        rows = self._load(f"tg:{telegram_id}", "telegram_id = %s", telegram_id, limit=1)
+        return describe(rows[0]) if rows else None
+
+    def for_user(self, user_id: int) -> List[Dict[str, Any]]:
+        """Все заказы пользователя, новые первыми."""
+        now = datetime.now(timezone.utc)
+        return [describe(row, now) for row in self._load(f"user:{user_id}", "user_id = %s", user_id, "created_at DESC")]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
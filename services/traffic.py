@@ -0,0 +1,230 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger("securelink")
+
+# Разрешения сводок (секунды) и сколько их хранить
+RESOLUTIONS = {
+    60: timedelta(days=7),
+    3600: timedelta(days=90),
+    86400: timedelta(days=730),
+}
+RAW_RETENTION = timedelta(days=2)
+# Не трогаем самый свежий интервал: туда ещё могут дописываться сырые строки
+ROLLUP_GRACE = timedelta(minutes=2)
+
+
+class TrafficHistory:
+    """
+    История трафика пиров.
+
+    Работает в процессе сэмплера статистики (см. app.wgstats): на каждом
+    снимке копит в памяти дельты счётчиков (с учётом обнуления при рестарте
+    интерфейса), раз в flush_interval пишет ненулевые дельты одним
+    execute_values в user_traffic_logs, затем сворачивает сырые строки в
+    минутные, часовые и суточные сводки user_traffic_rollups и чистит всё,
+    что старше срока хранения. Простаивающие пиры строк не порождают.
+    """
+
+    def __init__(self, get_conn, *, flush_interval: float = 30.0, prune_interval: float = 3600.0) -> None:
+        self.get_conn = get_conn
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        self._last_counters: Dict[str, tuple] = {}
+        self._pending: Dict[str, List[float]] = {}
+        self._owners: Dict[str, Optional[int]] = {}
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+
+    # ---------- Приём снимков ----------
+    def record(self, snapshot: Dict[str, Any]):
+        counters = {}
+        for public_key, stats in snapshot.get("peers", {}).items():
+            rx, tx = stats.get("rx_bytes", 0), stats.get("tx_bytes", 0)
+            prev = self._last_counters.get(public_key)
+            counters[public_key] = (rx, tx)
+            if prev is None:
+                continue
+            d_rx = rx - prev[0] if rx >= prev[0] else rx
+            d_tx = tx - prev[1] if tx >= prev[1] else tx
+            if not d_rx and not d_tx:
+                continue
+            pending = self._pending.setdefault(public_key, [0, 0, 0.0, 0.0])
+            pending[0] += d_rx
+            pending[1] += d_tx
+            pending[2] = stats.get("speed_rx", 0)
+            pending[3] = stats.get("speed_tx", 0)
+        # удалённые с интерфейса пиры выпадают из словаря сами
+        self._last_counters = counters
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _resolve_owners(self, cur, public_keys: Iterable[str]):
+        missing = [k for k in public_keys if k not in self._owners]
+        if not missing:
+            return
+        cur.execute(
+            "SELECT DISTINCT ON (public_key) public_key, user_id FROM orders "
+            "WHERE public_key = ANY(%s) ORDER BY public_key, id DESC;",
+            (missing,)
+        )
+        found = dict(cur.fetchall())
+        for key in missing:
+            self._owners[key] = found.get(key)
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        pending, self._pending = self._pending, {}
+        if len(self._owners) > 2 * max(len(self._last_counters), 1024):
+            self._owners = {}
+        try:
+            with self.get_conn() as conn:
+                with conn.cursor() as cur:
+                    if pending:
+                        self._resolve_owners(cur, pending.keys())
+                        now = datetime.now(timezone.utc)
+                        rows = [
+                            (self._owners.get(key), key, int(v[0]), int(v[1]), v[2], v[3], now, now)
+                            for key, v in pending.items()
+                        ]
+                        execute_values(
+                            cur,
+                            "INSERT INTO user_traffic_logs "
+                            "(user_id, public_key, rx_bytes, tx_bytes, speed_rx, speed_tx, last_seen, logged_at) VALUES %s",
+                            rows,
+                            page_size=1000,
+                        )
+                    self._rollup(cur)
+                    if time.monotonic() - self._last_prune >= self.prune_interval:
+                        self._prune(cur)
+                        self._last_prune = time.monotonic()
+        except Exception:
+            logger.exception("Traffic history flush failed (%s peers)", len(pending))
+
+    # ---------- Сводки ----------
+    def _rollup(self, cur):
+        """Сворачивает завершённые интервалы каждого уровня из предыдущего уровня."""
+        source = ("user_traffic_logs", "logged_at", None)
+        for resolution in sorted(RESOLUTIONS):
+            cur.execute(
+                "SELECT last_bucket FROM traffic_rollup_state WHERE resolution=%s FOR UPDATE;",
+                (resolution,)
+            )
+            row = cur.fetchone()
+            start = row[0] if row else datetime.fromtimestamp(0, timezone.utc)
+            end = _bucket(datetime.now(timezone.utc) - ROLLUP_GRACE, resolution)
+            if end > start:
+                table, ts_col, src_resolution = source
+                where_res = "AND resolution = %s" if src_resolution else ""
+                params = [resolution, resolution, resolution, start, end] + ([src_resolution] if src_resolution else [])
+                cur.execute(
+                    f"""
+                    INSERT INTO user_traffic_rollups (resolution, bucket, public_key, user_id, rx_bytes, tx_bytes)
+                    SELECT %s, to_timestamp(floor(extract(epoch FROM {ts_col}) / %s) * %s),
+                           public_key, MAX(user_id), SUM(rx_bytes), SUM(tx_bytes)
+                    FROM {table}
+                    WHERE {ts_col} >= %s AND {ts_col} < %s {where_res}
+                    GROUP BY 2, 3
+                    ON CONFLICT (resolution, public_key, bucket) DO UPDATE
+                    SET rx_bytes = user_traffic_rollups.rx_bytes + EXCLUDED.rx_bytes,
+                        tx_bytes = user_traffic_rollups.tx_bytes + EXCLUDED.tx_bytes
+                    """,
+                    params,
+                )
+                cur.execute(
+                    "INSERT INTO traffic_rollup_state (resolution, last_bucket) VALUES (%s, %s) "
+                    "ON CONFLICT (resolution) DO UPDATE SET last_bucket = EXCLUDED.last_bucket;",
+                    (resolution, end)
+                )
+            # следующий уровень сворачивается из только что посчитанного
+            source = ("user_traffic_rollups", "bucket", resolution)
+
+    def _prune(self, cur):
+        now = datetime.now(timezone.utc)
+        cur.execute("DELETE FROM user_traffic_logs WHERE logged_at < %s;", (now - RAW_RETENTION,))
+        for resolution, keep in RESOLUTIONS.items():
+            cur.execute(
+                "DELETE FROM user_traffic_rollups WHERE resolution=%s AND bucket < %s;",
+                (resolution, now - keep)
+            )
+
+    # ---------- Чтение ----------
+    def query(self, *, start: datetime, end: datetime, user_id: int = None,
+              public_key: str = None, resolution: int = None) -> Dict[str, Any]:
+        """Ряд (bucket, rx, tx) за период; разрешение подбирается по длине периода."""
+        if resolution not in RESOLUTIONS:
+            resolution = pick_resolution(end - start)
+        filters, params = [], [resolution, start, end]
+        if user_id is not None:
+            filters.append("user_id = %s")
+            params.append(user_id)
+        if public_key is not None:
+            filters.append("public_key = %s")
+            params.append(public_key)
+        extra = "".join(f" AND {f}" for f in filters)
+        with self.get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT bucket, SUM(rx_bytes), SUM(tx_bytes) FROM user_traffic_rollups "
+                    f"WHERE resolution = %s AND bucket >= %s AND bucket < %s{extra} "
+                    "GROUP BY bucket ORDER BY bucket;",
+                    params,
+                )
+                points = [
+                    {"t": bucket.isoformat(), "rx_bytes": int(rx), "tx_bytes": int(tx)}
+                    for bucket, rx, tx in cur.fetchall()
+                ]
+        return {
+            "resolution": resolution,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "points": points,
+            "total_rx": sum(p["rx_bytes"] for p in points),
+            "total_tx": sum(p["tx_bytes"] for p in points),
+        }
+
+
+def _bucket(moment: datetime, resolution: int) -> datetime:
+    return datetime.fromtimestamp(int(moment.timestamp()) // resolution * resolution, timezone.utc)
+
+
+def pick_resolution(span: timedelta) -> int:
+    if span <= timedelta(hours=6):
+        return 60
+    if span <= timedelta(days=14):
+        return 3600
+    return 86400
+
+
+PERIODS = {
+    "today": timedelta(days=1),
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+}
+
+
+def parse_range(args) -> tuple:
+    """Диапазон из query-параметров: ?period=today|week|month или ?from=&to= (ISO 8601)."""
+    now = datetime.now(timezone.utc)
+    end = _parse_dt(args.get("to")) or now
+    start = _parse_dt(args.get("from"))
+    if start is None:
+        start = end - PERIODS.get(args.get("period"), PERIODS["today"])
+    return start, end
+
+
+def _parse_dt(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
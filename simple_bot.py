@@ -5,19 +5,20 @@
 import os
 import logging
 import asyncio
-import psycopg2
 import secrets
 from datetime import datetime
-from io import BytesIO
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, FSInputFile, BufferedInputFile, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
 from aiogram.filters import Command
 from dotenv import load_dotenv
 from services.orders import PLANS
-import json
+from services.botdb import BotDB
+from services.subscriptions import SubscriptionState
+from app.db import init_db_pool, get_conn, get_read_conn, attach_read_listener
+from app.pgnotify import get_listener
+from app.qrcache import QRCache, default_cache_dir
 import requests
-import qrcode
 
 load_dotenv()  # загружает переменные из .env
 
@@ -45,46 +46,18 @@ PLANS_UI = {
 }
 
 # -------------------- Работа с базой --------------------
-def get_db_connection():
+# Запросы идут через пул соединений app.db в отдельных потоках — event loop не блокируется
+db = BotDB(get_conn, get_read_conn=get_read_conn, max_workers=int(os.environ.get("BOT_DB_WORKERS", 8)))
+# Статус подписки для «Мой аккаунт»: кеш по telegram_id, сброс по orders_changed
+subscriptions = SubscriptionState(get_read_conn, ttl=float(os.environ.get("SUBSCRIPTION_CACHE_TTL", 30)))
+
+async def create_user(telegram_id, username, first_name, last_name, language_code):
     try:
-        return psycopg2.connect(
-            dbname=os.environ.get("PG_DB", "securelink"),
-            user=os.environ.get("PG_USER", "securelink"),
-            password=os.environ.get("PG_PASSWORD"),
-            host=os.environ.get("PG_HOST", "localhost"),
-            port=os.environ.get("PG_PORT", 5432)
-        )
+        return await db.upsert_user(telegram_id, username, first_name, last_name, language_code)
     except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        return None
-
-def create_user(telegram_id, username, first_name, last_name, language_code):
-    conn = get_db_connection()
-    if not conn:
+        logger.error(f"Database error: {e}")
         return None
 
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE telegram_id = %s", (telegram_id,))
-    user = cursor.fetchone()
-
-    if user:
-        user_id = user[0]
-        cursor.execute("UPDATE users SET last_login = NOW() WHERE id = %s", (user_id,))
-        conn.commit()
-        conn.close()
-        return user_id
-
-    cursor.execute("""
-        INSERT INTO users (telegram_id, username, first_name, last_name, language_code, created_at, last_login)
-        VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-        RETURNING id
-    """, (telegram_id, username, first_name, last_name, language_code))
-    user_id = cursor.fetchone()[0]
-    conn.commit()
-    conn.close()
-    logger.info(f"Created new user {user_id}")
-    return user_id
-
 def get_user_token(user_id):
     return None
 
@@ -137,52 +110,30 @@ async def start_command(message: types.Message):
             await message.answer("Спасибо за оплату! Откройте личный кабинет для скачивания конфига.")
         else:
             try:
-                conn = get_db_connection()
-                cur = conn.cursor()
                 # Удаляем сохранённые сообщения с оплатой
                 try:
-                    cur.execute("SELECT message_ids FROM payment_messages WHERE telegram_id=%s ORDER BY id DESC LIMIT 1", (message.from_user.id,))
-                    r2 = cur.fetchone()
-                    if r2:
-                        stored_ids = r2[0]
-                        ids = stored_ids if isinstance(stored_ids, list) else json.loads(stored_ids)
-                        for mid in ids:
-                            try:
-                                await bot.delete_message(chat_id=message.chat.id, message_id=mid)
-                            except Exception:
-                                pass
-                        cur.execute("DELETE FROM payment_messages WHERE telegram_id=%s", (message.from_user.id,))
-                        conn.commit()
+                    for mid in await db.take_payment_messages(message.from_user.id):
+                        try:
+                            await bot.delete_message(chat_id=message.chat.id, message_id=mid)
+                        except Exception:
+                            pass
                 except Exception as e:
                     logger.warning(f"delete payment message failed: {e}")
                 # Находим оплаченный конфиг по телефону
-                cur.execute(
-                    """
-                    SELECT id, conf_file, plan FROM orders
-                    WHERE email=%s AND status='paid' AND conf_file IS NOT NULL
-                    ORDER BY id DESC LIMIT 1
-                    """,
-                    (phone,)
-                )
-                row = cur.fetchone()
-                conn.close()
+                row = await db.paid_config_by_email(phone)
                 if row and os.path.exists(row[1]):
                     order_id, conf_file, plan_name = row
                     try:
                         # Отправляем .conf
                         doc = FSInputFile(conf_file, filename=f"wg_{order_id}.conf")
                         await bot.send_document(chat_id=message.chat.id, document=doc, caption=f"Тариф: {plan_name}\n{INSTRUCTION_TEXT}")
-                        # QR
-                        with open(conf_file, 'r') as f:
-                            conf_text = f.read()
-                        buf = BytesIO()
-                        qrcode.make(conf_text).save(buf, format='PNG')
-                        buf.seek(0)
-                        photo = BufferedInputFile(buf.read(), filename=f"wg_{order_id}.png")
+                        # QR (из кеша; рендер — в потоке, чтобы не держать event loop)
+                        png, _ = await asyncio.to_thread(qr_cache.get_for_file, order_id, conf_file)
+                        photo = BufferedInputFile(png, filename=f"wg_{order_id}.png")
                         await bot.send_photo(chat_id=message.chat.id, photo=photo, caption="QR для импорта")
                         # Сообщение об успехе и меню
                         user = message.from_user
-                        user_id = create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+                        user_id = await create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
                         await message.answer("✅ Оплата успешно завершена. Выберите действие ниже:", reply_markup=main_keyboard(user_id))
                     except Exception as e:
                         logger.error(f"send conf failed: {e}")
@@ -195,7 +146,7 @@ async def start_command(message: types.Message):
 
     # стандартный старт
     user = message.from_user
-    user_id = create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    user_id = await create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
     welcome_text = f"""
 🔒 <b>Добро пожаловать в SecureLink VPN!</b>
 
@@ -295,13 +246,7 @@ async def handle_contact_and_create_payment(message: types.Message):
         msg = await message.answer("Перейдите по ссылке для оплаты:", reply_markup=kb)
         # Сохраняем id сообщения для удаления после оплаты
         try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("CREATE TABLE IF NOT EXISTS payment_messages (id SERIAL PRIMARY KEY, telegram_id BIGINT, message_ids JSONB, created_at TIMESTAMPTZ DEFAULT NOW())")
-            conn.commit()
-            cur.execute("INSERT INTO payment_messages (telegram_id, message_ids) VALUES (%s, %s)", (message.from_user.id, json.dumps([msg.message_id])))
-            conn.commit()
-            conn.close()
+            await db.store_payment_messages(message.from_user.id, [msg.message_id])
         except Exception as e:
             logger.warning(f"store payment message failed: {e}")
         state["awaiting_contact"] = False
@@ -345,8 +290,19 @@ async def catch_email_for_payment(message: types.Message):
 @dp.callback_query(lambda c: c.data == "my_account")
 async def my_account(callback: types.CallbackQuery):
     user = callback.from_user
-    user_id = create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    user_id = await create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
     token = get_user_token(user_id)
+    try:
+        sub = await db.call(subscriptions.latest_by_telegram, user.id)
+    except Exception as e:
+        logger.error(f"Database error: {e}")
+        sub = None
+    if sub and sub["is_active"]:
+        status_text = f"✅ {sub['plan']} до {sub['expires_at'].strftime('%d.%m.%Y')}" if sub["expires_at"] else f"✅ {sub['plan']}"
+    elif sub and sub["status"] in ("paid", "expired"):
+        status_text = "⌛ Подписка истекла"
+    else:
+        status_text = "Нет активной подписки"
     # Всегда ведёт на /dashboard
     url = f"{WEB_APP_URL}/dashboard"
     if token:
@@ -358,7 +314,7 @@ async def my_account(callback: types.CallbackQuery):
 <b>Username:</b> @{user.username or 'не указан'}
 <b>ID:</b> {user.id}
 
-<b>Статус:</b> ✅ Активен
+<b>Подписка:</b> {status_text}
 <b>Дата регистрации:</b> {datetime.now().strftime('%d.%m.%Y')}
 """
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -372,43 +328,35 @@ async def my_account(callback: types.CallbackQuery):
 @dp.callback_query(lambda c: c.data == "back_to_main")
 async def back_to_main(callback: types.CallbackQuery):
     user = callback.from_user
-    user_id = create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    user_id = await create_user(user.id, user.username, user.first_name, user.last_name, user.language_code)
     await callback.message.edit_text("Главное меню:", reply_markup=main_keyboard(user_id))
     await callback.answer()
 
 # -------------------- Отправка конфига --------------------
 CONFIG_DIR = "/securelink/SecureLink/configs"  # твоя папка с конфигами
+# Создаётся в main(): конструктор делает makedirs, импорт модуля не должен трогать диск
+qr_cache = None
 
-def get_latest_config_for_user(telegram_id):
+async def get_latest_config_for_user(telegram_id):
     """
     Находим последний оплаченный конфиг в папке CONFIG_DIR по telegram_id
     """
-    conn = get_db_connection()
-    if not conn:
-        return None
     try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT conf_file, plan
-            FROM orders
-            WHERE telegram_id=%s AND status='paid' AND conf_file IS NOT NULL
-            ORDER BY created_at DESC
-            LIMIT 1
-        """, (telegram_id,))
-        row = cur.fetchone()
-        if row:
-            conf_file, plan_name = row
-            # Проверяем, что файл существует в папке configs
-            if os.path.exists(conf_file) and conf_file.startswith(CONFIG_DIR):
-                return conf_file, plan_name
-    finally:
-        conn.close()
-    return None, None
+        row = await db.latest_config(telegram_id)
+    except Exception as e:
+        logger.error(f"Database error: {e}")
+        return None, None, None
+    if row:
+        order_id, conf_file, plan_name = row
+        # Проверяем, что файл существует в папке configs
+        if os.path.exists(conf_file) and conf_file.startswith(CONFIG_DIR):
+            return order_id, conf_file, plan_name
+    return None, None, None
 
 @dp.callback_query(lambda c: c.data == "get_config")
 async def send_config_file(callback: types.CallbackQuery):
     user = callback.from_user
-    conf_file, plan_name = get_latest_config_for_user(user.id)
+    _, conf_file, plan_name = await get_latest_config_for_user(user.id)
     if not conf_file:
         await callback.answer("Конфиг не найден", show_alert=True)
         return
@@ -425,22 +373,13 @@ async def send_config_file(callback: types.CallbackQuery):
 @dp.callback_query(lambda c: c.data == "get_qr")
 async def send_config_qr(callback: types.CallbackQuery):
     user = callback.from_user
-    conf_file, plan_name = get_latest_config_for_user(user.id)
+    order_id, conf_file, plan_name = await get_latest_config_for_user(user.id)
     if not conf_file:
         await callback.answer("Конфиг не найден", show_alert=True)
         return
     try:
-        with open(conf_file, "r") as f:
-            conf_text = f.read()
-        import qrcode
-        buf = BytesIO()
-        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L)
-        qr.add_data(conf_text)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
-        img.save(buf, "PNG")
-        buf.seek(0)
-        qr_file = FSInputFile(buf, filename=f"{os.path.basename(conf_file)}.png")
+        png, _ = await asyncio.to_thread(qr_cache.get_for_file, order_id, conf_file)
+        qr_file = BufferedInputFile(png, filename=f"{os.path.basename(conf_file)}.png")
         caption = f"QR для импорта конфига (тариф: {plan_name}).\n{INSTRUCTION_TEXT}"
         await bot.send_photo(chat_id=user.id, photo=qr_file, caption=caption)
         await callback.answer("QR отправлен")
@@ -478,11 +417,21 @@ CONFIG_PLAN = os.environ.get("CONFIG_PLAN", "Тариф по умолчанию"
 
 # -------------------- Запуск бота --------------------
 async def main():
+    global qr_cache
     logger.info("Starting SecureLink Telegram Bot...")
+    # тот же каталог, что у App.py, — иначе его discard() не сбросит QR бота
+    qr_cache = QRCache(default_cache_dir(os.getenv("CONF_DIR", "/configs")))
+    init_db_pool()
+    # оплата проводится в App.py; её заказ бот должен увидеть сразу, даже если реплика отстаёт
+    listener = get_listener()
+    attach_read_listener(listener)
+    subscriptions.attach_listener(listener)
+    db.start()
     try:
         await dp.start_polling(bot)
     finally:
         await bot.session.close()
+        db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())#
\ No newline at end of file
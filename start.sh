@@ -19,8 +19,12 @@ if [ -f "/app/database_migration.sql" ]; then
     -f /app/database_migration.sql || true
 fi
 
+echo "[start] Applying versioned migrations..."
+python3 -m app.migrate
+
 echo "[start] Launching Gunicorn (Flask app)"
-gunicorn -w 4 -b 0.0.0.0:9000 App:app &
+# gthread: долгие SSE-потоки админки не занимают воркер целиком
+gunicorn -w 4 --threads 8 -b 0.0.0.0:9000 App:app &
 
 echo "[start] Launching Telegram bot"
 python3 simple_bot.py
\ No newline at end of file
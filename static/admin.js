@@ -30,71 +30,210 @@ function formatLastSeen(timestamp, online) {
 }
 
 // ==============================
-// 🔄 Обновление статистики
+// 🖥️ Метрики сервера
 // ==============================
-function updateStats() {
-    fetch("/admin/stats")
+function renderHostMetrics(data) {
+    document.getElementById("cpu").innerText = data.cpu_percent;
+    document.getElementById("ram").innerText = data.ram_percent;
+    document.getElementById("disk").innerText = data.disk_percent;
+}
+
+function updateHostMetrics() {
+    fetch("/admin/host-metrics")
         .then(resp => resp.json())
-        .then(data => {
-            // системные метрики
-            document.getElementById("cpu").innerText = data.cpu_percent;
-            document.getElementById("ram").innerText = data.ram_percent;
-            document.getElementById("disk").innerText = data.disk_percent;
+        .then(renderHostMetrics)
+        .catch(err => console.error(err));
+}
+
+// ==============================
+// 📋 Список клиентов: keyset-пагинация, поиск, фильтр
+// ==============================
+const PAGE_SIZE = 50;
+const listState = {
+    cursors: [null],   // курсор начала каждой открытой страницы
+    page: 0,
+    nextCursor: null,
+};
+
+function listQuery() {
+    const [sort, order] = document.getElementById("client-sort").value.split(":");
+    const params = new URLSearchParams({ limit: PAGE_SIZE, sort, order });
+    const q = document.getElementById("client-search").value.trim();
+    if (q) params.set("q", q);
+    if (document.getElementById("client-online").checked) params.set("online", "1");
+    const cursor = listState.cursors[listState.page];
+    if (cursor) params.set("cursor", cursor);
+    return params.toString();
+}
+
+function renderClientRow(c) {
+    const tr = document.createElement("tr");
+    tr.id = `client-${c.public_key}`;
 
+    // генерируем строки, добавляем моргание только на email
+    tr.innerHTML = `
+        <td data-label="Email" class="c-email">${c.email}</td>
+        <td data-label="Plan">${c.plan}</td>
+        <td data-label="Client IP">${c.client_ip}</td>
+        <td data-label="Public Key">${c.public_key}</td>
+        <td data-label="RX" class="c-rx"></td>
+        <td data-label="TX" class="c-tx"></td>
+        <td data-label="Online" class="c-online"></td>
+        <td data-label="Last seen" class="c-last-seen"></td>
+        <td data-label="Start">${c.start_date || '-'}</td>
+        <td data-label="End">${c.end_date || '-'}</td>
+        <td data-label="Action"><button class="delete-btn" data-key="${c.public_key}">Удалить</button></td>
+    `;
+    tr.querySelector(".delete-btn").onclick = () => deleteClient(c.public_key);
+    applyPeerStats(tr, c);
+    return tr;
+}
+
+// Обновляет только ячейки трафика/статуса — так строка патчится на месте
+function applyPeerStats(tr, p) {
+    tr.querySelector(".c-email").className = `c-email ${p.online ? 'email-online' : ''}`;
+    tr.querySelector(".c-rx").innerText = formatBytes(p.rx_bytes);
+    tr.querySelector(".c-tx").innerText = formatBytes(p.tx_bytes);
+    const online = tr.querySelector(".c-online");
+    online.className = `c-online ${p.online ? 'online' : 'offline'}`;
+    online.innerText = p.online ? 'Да' : 'Нет';
+    tr.querySelector(".c-last-seen").innerText = formatLastSeen(p.last_seen, p.online);
+}
+
+function deleteClient(publicKey) {
+    if (!confirm("Удалить этого клиента?")) return;
+    fetch(`/admin/delete/${encodeURIComponent(publicKey)}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        credentials: 'include'
+    })
+    .then(response => {
+        if (response.ok) {
+            const row = document.getElementById(`client-${publicKey}`);
+            if (row) row.remove();
+        } else {
+            alert("Ошибка при удалении клиента");
+        }
+    })
+    .catch(err => {
+        console.error(err);
+        alert("Ошибка при удалении клиента");
+    });
+}
+
+function updateClients() {
+    fetch(`/admin/clients?${listQuery()}`)
+        .then(resp => resp.json())
+        .then(data => {
             const tbody = document.querySelector("#traffic-table tbody");
             tbody.innerHTML = "";
+            data.clients.forEach(c => tbody.appendChild(renderClientRow(c)));
 
-            data.clients.forEach(c => {
-                const tr = document.createElement("tr");
-                tr.id = `client-${c.public_key}`;
-
-                // генерируем строки, добавляем моргание только на email
-                tr.innerHTML = `
-                    <td data-label="Email" class="${c.online ? 'email-online' : ''}">${c.email}</td>
-                    <td data-label="Plan">${c.plan}</td>
-                    <td data-label="Client IP">${c.client_ip}</td>
-                    <td data-label="Public Key">${c.public_key}</td>
-                    <td data-label="RX">${formatBytes(c.rx_bytes)}</td>
-                    <td data-label="TX">${formatBytes(c.tx_bytes)}</td>
-                    <td class="${c.online ? 'online' : 'offline'}" data-label="Online">${c.online ? 'Да' : 'Нет'}</td>
-                    <td data-label="Last seen">${formatLastSeen(c.last_seen || c.start_date, c.online)}</td>
-                    <td data-label="Start">${c.start_date || '-'}</td>
-                    <td data-label="End">${c.end_date || '-'}</td>
-                    <td data-label="Action"><button class="delete-btn" data-key="${c.public_key}">Удалить</button></td>
-                `;
-                tbody.appendChild(tr);
-            });
-
-            // обработчики кнопок удаления
-            document.querySelectorAll(".delete-btn").forEach(button => {
-                button.onclick = () => {
-                    const publicKey = button.dataset.key;
-                    if (!confirm("Удалить этого клиента?")) return;
-                    fetch(`/admin/delete/${encodeURIComponent(publicKey)}`, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        credentials: 'include'
-                    })
-                    .then(response => {
-                        if (response.ok) {
-                            const row = document.getElementById(`client-${publicKey}`);
-                            if (row) row.remove();
-                        } else {
-                            alert("Ошибка при удалении клиента");
-                        }
-                    })
-                    .catch(err => {
-                        console.error(err);
-                        alert("Ошибка при удалении клиента");
-                    });
-                };
-            });
+            listState.nextCursor = data.next_cursor;
+            document.getElementById("page-info").innerText = `Стр. ${listState.page + 1}`;
+            document.getElementById("prev-page").disabled = listState.page === 0;
+            document.getElementById("next-page").disabled = !listState.nextCursor;
         })
         .catch(err => console.error(err));
 }
 
+function resetPaging() {
+    listState.cursors = [null];
+    listState.page = 0;
+    updateClients();
+}
+
+let searchTimer = null;
+document.getElementById("client-search").addEventListener("input", () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(resetPaging, 300);
+});
+document.getElementById("client-sort").addEventListener("change", resetPaging);
+document.getElementById("client-online").addEventListener("change", resetPaging);
+document.getElementById("next-page").addEventListener("click", () => {
+    if (!listState.nextCursor) return;
+    listState.cursors[listState.page + 1] = listState.nextCursor;
+    listState.page += 1;
+    updateClients();
+});
+document.getElementById("prev-page").addEventListener("click", () => {
+    if (listState.page === 0) return;
+    listState.page -= 1;
+    updateClients();
+});
+
 // ==============================
-// 🔁 Автообновление каждые 5 секунд
+// 🔁 Поток изменений (SSE): приходят только изменившиеся пиры и заказы
 // ==============================
-setInterval(updateStats, 5000);
-updateStats(); // первый вызов сразу
\ No newline at end of file
+let refreshTimer = null;
+function scheduleRefresh() {
+    // несколько событий подряд — одна перезагрузка страницы
+    clearTimeout(refreshTimer);
+    refreshTimer = setTimeout(updateClients, 500);
+}
+
+function isDefaultView() {
+    return listState.page === 0
+        && !document.getElementById("client-search").value.trim()
+        && !document.getElementById("client-online").checked;
+}
+
+function onPeers(peers) {
+    const filterOnline = document.getElementById("client-online").checked;
+    peers.forEach(p => {
+        const tr = document.getElementById(`client-${p.public_key}`);
+        if (tr) applyPeerStats(tr, p);
+        // при фильтре «онлайн» состав страницы меняется вместе со статусом
+        if (filterOnline && (tr ? !p.online : p.online)) scheduleRefresh();
+    });
+}
+
+function onOrder(change) {
+    if (change.action === "removed") {
+        const tr = document.getElementById(`client-${change.public_key}`);
+        if (tr) tr.remove();
+        return;
+    }
+    const c = change.client;
+    const tr = document.getElementById(`client-${c.public_key}`);
+    if (tr) {
+        tr.replaceWith(renderClientRow(c));
+    } else if (isDefaultView()) {
+        scheduleRefresh();
+    }
+}
+
+let pollTimers = [];
+function startPolling() {
+    if (pollTimers.length) return;
+    pollTimers = [setInterval(updateHostMetrics, 5000), setInterval(updateClients, 5000)];
+}
+
+function stopPolling() {
+    pollTimers.forEach(clearInterval);
+    pollTimers = [];
+}
+
+function connectStream() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    const source = new EventSource("/admin/stream");
+    const parse = handler => event => handler(JSON.parse(event.data));
+    source.addEventListener("open", stopPolling);
+    source.addEventListener("host", parse(renderHostMetrics));
+    source.addEventListener("peers", parse(onPeers));
+    source.addEventListener("order", parse(onOrder));
+    // пропуск событий (другой воркер, переполнение буфера) — перечитываем страницу
+    source.addEventListener("resync", () => updateClients());
+    source.addEventListener("error", () => {
+        // EventSource переподключается сам (с Last-Event-ID); на время разрыва — опрос
+        startPolling();
+        if (source.readyState === EventSource.CLOSED) setTimeout(connectStream, 5000);
+    });
+}
+
+updateHostMetrics(); // первый вызов сразу
+updateClients();
+connectStream();
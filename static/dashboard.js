@@ -11,6 +11,12 @@ class DashboardApp {
         this.authToken = null;
         this.telegramWebApp = null;
         this.currentSection = 'dashboard';
+        this.notifications = [];
+        this.notificationsNextBefore = null;
+        this.notificationsLastId = 0;
+        this.notificationsUnread = 0;
+        this.notificationsWatching = false;
+        this.bootstrap = {};
         this.init();
     }
 
@@ -48,21 +54,48 @@ class DashboardApp {
         this.authToken = localStorage.getItem('authToken');
         if (this.authToken) {
             try {
-                const data = await this.apiCall('/auth/me');
-                this.currentUser = data.user;
+                // живой трафик не входит в bootstrap (у того ETag) — запрашивается параллельно
+                const traffic = this.apiCall('/api/user/traffic').catch(() => null);
+                await this.loadBootstrap();
+                this.bootstrap.traffic = await traffic;
                 return;
             } catch {
                 localStorage.removeItem('authToken');
+                this.authToken = null;
             }
         }
 
         if (this.telegramWebApp?.initData) {
             await this.authenticateWithTelegram();
+            if (this.authToken) await this.loadBootstrap();
         } else {
             window.location.href = '/';
         }
     }
 
+    async loadBootstrap() {
+        // профиль, подписки, конфиги и первая страница уведомлений одним запросом;
+        // повторный заход браузер перепроверяет по ETag и получает 304
+        const data = await this.apiCall('/api/user/bootstrap');
+        this.currentUser = data.user;
+        this.bootstrap = {
+            subscriptions: data.subscriptions,
+            configs: data.configs,
+            notifications: data.notifications
+        };
+        this.notifications = data.notifications.notifications;
+        this.notificationsNextBefore = data.notifications.next_before;
+        this.updateNotificationBadge(data.notifications.unread_count);
+        this.watchNotifications(data.notifications.last_id, data.notifications.unread_count);
+    }
+
+    fromBootstrap(key) {
+        // данные bootstrap — только для первой отрисовки раздела, дальше — свежий запрос
+        const value = this.bootstrap[key];
+        delete this.bootstrap[key];
+        return value ?? null;
+    }
+
     async authenticateWithTelegram() {
         try {
             const response = await fetch('/auth/telegram', {
@@ -106,6 +139,7 @@ class DashboardApp {
         document.getElementById('buyNewSubscriptionBtn')?.addEventListener('click', () => window.location.href = '/');
         document.getElementById('saveSettingsBtn')?.addEventListener('click', () => this.saveSettings());
         document.getElementById('markAllReadBtn')?.addEventListener('click', () => this.markAllNotificationsRead());
+        document.getElementById('trafficPeriod')?.addEventListener('change', () => this.loadTrafficStats());
     }
 
     initModals() {
@@ -146,9 +180,11 @@ class DashboardApp {
 
     async loadDashboardData() {
         try {
-            const subs = await this.apiCall('/api/user/subscriptions');
-            this.updateDashboardSubscriptions(subs.subscriptions);
-            const traffic = await this.apiCall('/api/user/traffic');
+            const [subs, traffic] = await Promise.all([
+                this.fromBootstrap('subscriptions') ?? this.apiCall('/api/user/subscriptions').then(r => r.subscriptions),
+                this.fromBootstrap('traffic') ?? this.apiCall('/api/user/traffic')
+            ]);
+            this.updateDashboardSubscriptions(subs);
             this.updateDashboardTraffic(traffic);
         } catch (err) { console.error(err); }
     }
@@ -236,10 +272,9 @@ class DashboardApp {
         container.innerHTML = '<div class="loading">Загрузка подписок...</div>';
 
         try {
-            const response = await this.apiCall('/api/user/subscriptions');
-            if (response.ok) {
-                this.renderSubscriptions(response.subscriptions);
-            }
+            const subscriptions = this.fromBootstrap('subscriptions') ??
+                (await this.apiCall('/api/user/subscriptions')).subscriptions;
+            this.renderSubscriptions(subscriptions);
         } catch (error) {
             console.error('Ошибка загрузки подписок:', error);
             container.innerHTML = '<div class="error">Ошибка загрузки подписок</div>';
@@ -303,10 +338,8 @@ class DashboardApp {
         container.innerHTML = '<div class="loading">Загрузка конфигураций...</div>';
 
         try {
-            const response = await this.apiCall('/api/user/configs');
-            if (response.ok) {
-                this.renderConfigs(response.configs);
-            }
+            const configs = this.fromBootstrap('configs') ?? (await this.apiCall('/api/user/configs')).configs;
+            this.renderConfigs(configs);
         } catch (error) {
             console.error('Ошибка загрузки конфигураций:', error);
             container.innerHTML = '<div class="error">Ошибка загрузки конфигураций</div>';
@@ -366,21 +399,39 @@ class DashboardApp {
 
         container.innerHTML = '<div class="loading">Загрузка статистики...</div>';
 
+        const period = document.getElementById('trafficPeriod')?.value || 'today';
+
         try {
-            const response = await this.apiCall('/api/user/traffic');
-            if (response.ok) {
-                this.renderTrafficStats(response);
-            }
+            const [response, history] = await Promise.all([
+                this.apiCall('/api/user/traffic'),
+                this.apiCall(`/api/user/traffic/history?period=${encodeURIComponent(period)}`)
+            ]);
+            this.renderTrafficStats(response, history);
         } catch (error) {
             console.error('Ошибка загрузки статистики трафика:', error);
             container.innerHTML = '<div class="error">Ошибка загрузки статистики</div>';
         }
     }
 
-    renderTrafficStats(trafficData) {
+    renderTrafficStats(trafficData, history = null) {
         const container = document.getElementById('trafficStats');
         if (!container) return;
 
+        const historyHtml = history && history.points.length ? `
+            <div class="traffic-history">
+                <div class="stat-label">За период: ↓ ${this.formatBytes(history.total_rx)} ↑ ${this.formatBytes(history.total_tx)}</div>
+                <div class="traffic-history-bars">
+                    ${(() => {
+                        const max = Math.max(...history.points.map(p => p.rx_bytes + p.tx_bytes), 1);
+                        return history.points.map(p => `
+                            <div class="traffic-history-bar" title="${this.formatDate(p.t)}: ${this.formatBytes(p.rx_bytes + p.tx_bytes)}"
+                                 style="height:${Math.max(2, Math.round((p.rx_bytes + p.tx_bytes) / max * 100))}%"></div>
+                        `).join('');
+                    })()}
+                </div>
+            </div>
+        ` : '';
+
         if (!trafficData.traffic || trafficData.traffic.length === 0) {
             container.innerHTML = '<div class="empty-state">Нет данных о трафике</div>';
             return;
@@ -402,6 +453,7 @@ class DashboardApp {
                     </div>
                 </div>
             </div>
+            ${historyHtml}
             <div class="traffic-details">
                 ${trafficData.traffic.map(t => `
                     <div class="traffic-item">
@@ -435,17 +487,25 @@ class DashboardApp {
         `;
     }
 
-    async loadNotifications() {
+    async loadNotifications(before = null) {
         const container = document.getElementById('notificationsList');
         if (!container) return;
 
-        container.innerHTML = '<div class="loading">Загрузка уведомлений...</div>';
+        if (!before) {
+            container.innerHTML = '<div class="loading">Загрузка уведомлений...</div>';
+        }
 
         try {
-            const response = await this.apiCall('/api/user/notifications');
-            if (response.ok) {
-                this.renderNotifications(response.notifications);
-                this.updateNotificationBadge(response.unread_count);
+            const params = new URLSearchParams({ limit: 20 });
+            if (before) params.set('before', before);
+            const response = (!before && this.fromBootstrap('notifications')) ||
+                await this.apiCall(`/api/user/notifications?${params}`);
+            this.notifications = before ? this.notifications.concat(response.notifications) : response.notifications;
+            this.notificationsNextBefore = response.next_before;
+            this.renderNotifications(this.notifications);
+            this.updateNotificationBadge(response.unread_count);
+            if (!before) {
+                this.watchNotifications(response.last_id, response.unread_count);
             }
         } catch (error) {
             console.error('Ошибка загрузки уведомлений:', error);
@@ -453,6 +513,38 @@ class DashboardApp {
         }
     }
 
+    async watchNotifications(lastId, unread) {
+        // один цикл long-poll на страницу; повторный вызов только сдвигает точку отсчёта
+        this.notificationsLastId = lastId;
+        this.notificationsUnread = unread;
+        if (this.notificationsWatching) return;
+        this.notificationsWatching = true;
+
+        while (this.authToken) {
+            try {
+                const params = new URLSearchParams({ after: this.notificationsLastId, unread: this.notificationsUnread });
+                const response = await this.apiCall(`/api/user/notifications/wait?${params}`);
+                if (response.notifications.length) {
+                    this.notificationsLastId = response.notifications[response.notifications.length - 1].id;
+                    this.notifications = response.notifications.slice().reverse().concat(this.notifications);
+                    if (this.currentSection === 'notifications') this.renderNotifications(this.notifications);
+                } else if (response.changed && this.currentSection === 'notifications') {
+                    // прочитаны в другой вкладке — перечитать первую страницу
+                    await this.loadNotifications();
+                }
+                this.notificationsUnread = response.unread_count;
+                this.updateNotificationBadge(response.unread_count);
+                if (response.poll_after) {
+                    await new Promise(resolve => setTimeout(resolve, response.poll_after * 1000));
+                }
+            } catch (error) {
+                console.error('Ошибка ожидания уведомлений:', error);
+                await new Promise(resolve => setTimeout(resolve, 15000));
+            }
+        }
+        this.notificationsWatching = false;
+    }
+
     renderNotifications(notifications) {
         const container = document.getElementById('notificationsList');
         if (!container) return;
@@ -462,6 +554,12 @@ class DashboardApp {
             return;
         }
 
+        const more = this.notificationsNextBefore ? `
+            <button class="btn btn-ghost" onclick="dashboardApp.loadNotifications(${this.notificationsNextBefore})">
+                Показать ещё
+            </button>
+        ` : '';
+
         container.innerHTML = notifications.map(notification => `
             <div class="notification-item ${notification.is_read ? '' : 'unread'}">
                 <div class="notification-header">
@@ -477,7 +575,7 @@ class DashboardApp {
                     </div>
                 ` : ''}
             </div>
-        `).join('');
+        `).join('') + more;
     }
 
     async loadSettings() {
@@ -562,10 +660,11 @@ class DashboardApp {
     async markNotificationRead(notificationId) {
         try {
             const response = await this.apiCall(`/api/user/notifications/${notificationId}/read`, 'POST');
-            if (response.ok) {
-                this.showToast('Уведомление отмечено как прочитанное', 'success');
-                await this.loadNotifications();
-            }
+            this.notifications.forEach(n => { if (n.id === notificationId) n.is_read = true; });
+            this.notificationsUnread = response.unread_count;
+            this.renderNotifications(this.notifications);
+            this.updateNotificationBadge(response.unread_count);
+            this.showToast('Уведомление отмечено как прочитанное', 'success');
         } catch (error) {
             console.error('Ошибка обновления уведомления:', error);
             this.showToast('Ошибка обновления уведомления', 'error');
@@ -573,8 +672,18 @@ class DashboardApp {
     }
 
     async markAllNotificationsRead() {
-        // Реализация для отметки всех уведомлений как прочитанных
-        this.showToast('Функция в разработке', 'info');
+        try {
+            // только виденные: пришедшее после загрузки ленты остаётся непрочитанным
+            const response = await this.apiCall('/api/user/notifications/read-all', 'POST', { up_to: this.notificationsLastId });
+            this.notifications.forEach(n => { if (n.id <= this.notificationsLastId) n.is_read = true; });
+            this.notificationsUnread = response.unread_count;
+            this.renderNotifications(this.notifications);
+            this.updateNotificationBadge(response.unread_count);
+            this.showToast('Все уведомления прочитаны', 'success');
+        } catch (error) {
+            console.error('Ошибка обновления уведомлений:', error);
+            this.showToast('Ошибка обновления уведомлений', 'error');
+        }
     }
 
     async saveSettings() {
@@ -675,6 +784,8 @@ class DashboardApp {
                 badge.style.display = 'none';
             }
         }
+        const markAll = document.getElementById('markAllReadBtn');
+        if (markAll) markAll.style.display = count > 0 ? '' : 'none';
     }
 
     formatBytes(bytes) {
@@ -720,67 +831,20 @@ class DashboardApp {
         if (status === 'pending') return 'Ожидает оплаты';
         return 'Неактивна';
     }
-}
-
 
-async downloadConfig(configId) {
-    try {
-        const response = await fetch(`/api/configs/${configId}/download`, {
-            headers: { 'Authorization': `Bearer ${this.authToken}` }
-        });
-        if (!response.ok) throw new Error('Ошибка скачивания');
-
-        const blob = await response.blob();
-        const url = URL.createObjectURL(blob);
-        const a = document.createElement('a');
-        a.href = url;
-        a.download = `securelink_${configId}.conf`;
-        a.click();
-        URL.revokeObjectURL(url);
-
-        this.showToast('Конфигурация скачана', 'success');
-    } catch (err) {
-        console.error('downloadConfig error', err);
-        this.showToast('Ошибка скачивания', 'error');
+    downloadConfig(configId) {
+        // .conf оплаченного заказа отдаёт /download/<id>
+        window.location.href = `/download/${configId}`;
     }
-}
-
-try {
-    const response = await this.apiCall('/api/user/configs');
-    console.log('Configs response:', response);
-} catch (err) {
-    console.error('Ошибка загрузки конфигураций:', err);
-}
 
-async showQRCode(configId) {
-    try {
-        const response = await this.apiCall(`/api/configs/${configId}/qr`);
-        if (response.ok && response.qr_url) {
-            // открыть модальное окно с QR
-            const img = document.getElementById('qrImage');
-            img.src = response.qr_url;
-            this.openModal('configModal');
-        } else {
-            this.showToast('QR-код недоступен', 'error');
+    showQRCode(configId) {
+        const container = document.getElementById('qrContainer');
+        if (container) {
+            container.innerHTML = `<img src="/qr/${configId}" alt="QR-код конфигурации">`;
+            container.style.display = 'block';
         }
-    } catch (err) {
-        console.error('showQRCode error', err);
-        this.showToast('Ошибка загрузки QR', 'error');
-    }
-}
-
-
-try {
-    const response = await this.apiCall('/api/user/configs');
-    console.log('Configs response:', response);
-    if (response.configs?.length) {
-        this.renderConfigs(response.configs);
-    } else {
-        container.innerHTML = '<div class="empty-state">У вас пока нет конфигураций</div>';
+        this.showModal('configModal');
     }
-} catch (err) {
-    console.error('Ошибка загрузки конфигураций:', err);
-    container.innerHTML = '<div class="error">Ошибка загрузки конфигураций</div>';
 }
 
 // Инициализация
@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app.delivery import PermanentError, RetryLater
+from services.outbox import OutboxDispatcher
+
+
+class FakeCursor:
+    def __init__(self, log):
+        self.log = log
+
+    def execute(self, sql, params=None):
+        self.log.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return [(1, {}, 1)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self, log):
+        self.log = log
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+
+class Sender:
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    def send(self, payload):
+        if self.error is not None:
+            raise self.error
+        self.sent.append(payload)
+
+
+@pytest.fixture
+def log():
+    return []
+
+
+@pytest.fixture
+def dispatcher(log):
+    @contextmanager
+    def get_conn():
+        yield FakeConn(log)
+
+    return OutboxDispatcher(
+        get_conn,
+        connect_dedicated=None,
+        senders={"email": Sender},
+        max_attempts=3,
+        base_delay=10.0,
+        max_delay=100.0,
+    )
+
+
+def transition(log):
+    """Единственный UPDATE из _finish: ('sent'|'retry'|'failed', задержка, last_error)."""
+    assert len(log) == 1
+    sql, params = log[0]
+    assert sql.startswith("UPDATE outbox SET")
+    if "status='sent'" in sql:
+        return "sent", None, None
+    if "status='failed'" in sql:
+        return "failed", None, params[0]
+    assert "next_attempt_at = NOW() + make_interval(secs => %s)" in sql
+    assert "status" not in sql
+    return "retry", params[0], params[1]
+
+
+def test_claim_bumps_attempts_and_leases(dispatcher, log):
+    assert dispatcher._claim("email") == [(1, {}, 1)]
+    sql, params = log[0]
+    assert "SET attempts = o.attempts + 1, next_attempt_at = NOW() + make_interval(secs => %s)" in sql
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert params == (dispatcher.lease, "email", dispatcher.batch_size)
+
+
+def test_sent(dispatcher, log):
+    sender = Sender()
+    dispatcher._deliver("email", sender, 1, '{"to": "a@b.c"}', 1)
+    assert sender.sent == [{"to": "a@b.c"}]
+    assert transition(log) == ("sent", None, None)
+    assert log[0][1] == (1,)
+
+
+def test_permanent_error_fails_at_once(dispatcher, log):
+    dispatcher._deliver("email", Sender(PermanentError("no file")), 1, {}, 1)
+    assert transition(log) == ("failed", None, "no file")
+
+
+def test_error_retries_with_backoff(dispatcher, log):
+    dispatcher._deliver("email", Sender(OSError("smtp down")), 1, {}, 2)
+    status, delay, error = transition(log)
+    assert (status, error) == ("retry", "smtp down")
+    # base_delay * 2 ** (attempts - 1) ± 20%
+    assert 16.0 <= delay <= 24.0
+
+
+def test_backoff_capped_by_max_delay(dispatcher, log):
+    dispatcher.max_attempts = 100
+    dispatcher._deliver("email", Sender(OSError("smtp down")), 1, {}, 20)
+    _, delay, _ = transition(log)
+    assert delay <= 120.0
+
+
+def test_error_fails_after_max_attempts(dispatcher, log):
+    dispatcher._deliver("email", Sender(OSError("smtp down")), 1, {}, 3)
+    assert transition(log) == ("failed", None, "smtp down")
+
+
+def test_retry_later_uses_server_delay(dispatcher, log):
+    dispatcher._deliver("email", Sender(RetryLater("429", delay=7.0)), 1, {}, 1)
+    assert transition(log) == ("retry", 7.0, "429")
+
+
+def test_retry_later_without_delay_backs_off(dispatcher, log):
+    dispatcher._deliver("email", Sender(RetryLater("429")), 1, {}, 1)
+    status, delay, _ = transition(log)
+    assert status == "retry"
+    assert 8.0 <= delay <= 12.0
+
+
+def test_retry_later_capped_by_max_attempts(dispatcher, log):
+    dispatcher._deliver("email", Sender(RetryLater("429", delay=7.0)), 1, {}, 3)
+    assert transition(log) == ("failed", None, "429")
@@ -0,0 +1,171 @@
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import pytest
+
+from app.pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError("connection lost")
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePool(ConnectionPool):
+    def _connect(self):
+        self.counters["created"] += 1
+        return FakeConn()
+
+
+def make_pool(**kwargs):
+    kwargs.setdefault("minconn", 0)
+    kwargs.setdefault("maxconn", 2)
+    kwargs.setdefault("timeout", 0.05)
+    kwargs.setdefault("leak_seconds", 0)
+    return FakePool("fake", **kwargs)
+
+
+def test_size_bound_and_timeout():
+    pool = make_pool()
+    first, second = pool.acquire(), pool.acquire()
+    assert first is not second
+    started = time.monotonic()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert time.monotonic() - started >= 0.05
+    stats = pool.stats()
+    assert (stats["size"], stats["in_use"], stats["timeouts"], stats["created"]) == (2, 2, 1, 2)
+
+
+def test_pool_timeout_is_pool_error():
+    # вызывающие, ловившие PoolError от ThreadedConnectionPool, ловят и таймаут
+    assert issubclass(PoolTimeout, psycopg2.pool.PoolError)
+
+
+def test_waiter_gets_released_connection():
+    pool = make_pool(maxconn=1, timeout=2.0)
+    conn = pool.acquire()
+    timer = threading.Timer(0.05, pool.release, (conn,))
+    timer.start()
+    try:
+        assert pool.acquire() is conn
+    finally:
+        timer.join()
+    assert pool.stats()["created"] == 1
+
+
+def test_idle_connections_are_reused():
+    pool = make_pool(minconn=1)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()["created"] == 1
+
+
+def test_broken_idle_connection_is_replaced():
+    pool = make_pool(maxconn=1, idle_check=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.broken = True
+    fresh = pool.acquire()
+    assert fresh is not conn
+    assert conn.closed
+    stats = pool.stats()
+    assert (stats["size"], stats["created"], stats["healthcheck_failures"]) == (1, 2, 1)
+
+
+def test_closed_connection_is_replaced_without_query():
+    pool = make_pool(maxconn=1)
+    conn = pool.acquire()
+    pool.release(conn)
+    conn.closed = 1
+    assert pool.acquire() is not conn
+    assert pool.stats()["healthcheck_failures"] == 1
+
+
+def test_release_rolls_back_open_transaction():
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    pool.release(conn)
+    assert conn.rollbacks == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_release_discards_connection_that_cannot_roll_back():
+    pool = make_pool()
+    conn = pool.acquire()
+    conn.status = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+    conn.broken = True
+    pool.release(conn)
+    assert conn.closed
+    stats = pool.stats()
+    assert (stats["size"], stats["idle"], stats["in_use"]) == (0, 0, 0)
+
+
+def test_discard_frees_slot():
+    pool = make_pool(maxconn=1)
+    conn = pool.acquire()
+    pool.release(conn, discard=True)
+    assert pool.acquire() is not conn
+
+
+def test_failed_connect_frees_slot():
+    pool = make_pool(maxconn=1)
+    calls = []
+
+    def connect():
+        calls.append(1)
+        if len(calls) == 1:
+            raise psycopg2.OperationalError("could not connect")
+        return FakeConn()
+
+    pool._connect = connect
+    with pytest.raises(psycopg2.OperationalError):
+        pool.acquire()
+    assert pool.acquire() is not None
+    assert pool.stats()["size"] == 1
+
+
+def test_closed_pool_refuses():
+    pool = make_pool(minconn=1)
+    pool.closeall()
+    assert pool.stats()["size"] == 0
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.acquire()
@@ -0,0 +1,170 @@
+import json
+
+import pytest
+
+from app import db, replica
+from app.replica import ReadRouter, note_write
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((sql, params))
+
+    def fetchone(self):
+        return (self.conn.pool.lag,)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = 0
+        self.autocommit = True
+        self.readonly = None
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, name, lag=0.0, down=False):
+        self.name = name
+        self.lag = lag
+        self.down = down
+        self.in_use = 0
+
+    def acquire(self):
+        if self.down:
+            raise OSError("replica is down")
+        self.in_use += 1
+        return FakeConn(self)
+
+    def release(self, conn, discard=False):
+        self.in_use -= 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(replica, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def router(monkeypatch, clock):
+    router = ReadRouter(FakePool("primary"), FakePool("replica"), sticky_seconds=5.0, max_lag=2.0)
+    monkeypatch.setattr(db, "READS", router)
+    monkeypatch.setattr(replica, "_local_router", router)
+    return router
+
+
+def served_by(*keys):
+    with db.get_read_conn(*keys) as conn:
+        assert conn.readonly is True
+        return conn.pool.name
+
+
+def test_reads_go_to_replica(router):
+    assert served_by("user:1") == "replica"
+    assert router.counters["replica"] == 1
+    assert router.primary.in_use == router.replica.in_use == 0
+
+
+def test_note_write_sticks_key_to_primary(router):
+    cur = FakeConn(router.primary).cursor()
+    note_write(cur, "user:1", None)
+    assert cur.conn.executed == [("SELECT pg_notify(%s, %s);", ("read_sticky", json.dumps(["user:1"])))]
+    # свой процесс прилипает сразу, не дожидаясь NOTIFY
+    assert served_by("user:1") == "primary"
+    assert served_by("user:2") == "replica"
+    assert router.counters["primary_sticky"] == 1
+
+
+def test_stickiness_expires(router, clock):
+    router.stick("user:1")
+    clock.now += 4.9
+    assert served_by("user:1") == "primary"
+    clock.now += 0.2
+    assert served_by("user:1") == "replica"
+
+
+def test_restick_extends_window(router, clock):
+    router.stick("user:1")
+    clock.now += 4.0
+    router.on_sticky_notify(json.dumps(["user:1"]))
+    clock.now += 4.0
+    assert served_by("user:1") == "primary"
+
+
+def test_orders_notify_sticks_all_keys_of_order(router):
+    router.on_orders_notify(json.dumps({"id": 7, "user_id": 3, "email": "a@b.c", "telegram_id": 42}))
+    for key in ("user:3", "email:a@b.c", "tg:42"):
+        assert served_by(key) == "primary"
+    assert served_by("user:4") == "replica"
+
+
+def test_users_notify_sticks_user(router):
+    router.on_users_notify(json.dumps({"id": 3, "op": "UPDATE"}))
+    assert served_by("user:3") == "primary"
+
+
+def test_reconnect_sticks_everything_until_expiry(router, clock):
+    router.stick_all()
+    assert served_by("user:1") == "primary"
+    assert served_by() == "primary"
+    clock.now += 5.1
+    assert served_by("user:1") == "replica"
+
+
+def test_bad_payload_sticks_everything(router):
+    router.on_sticky_notify("not json")
+    assert served_by("user:9") == "primary"
+
+
+def test_lagging_replica_falls_back_to_primary(router, clock):
+    router.replica.lag = 3.0
+    assert served_by("user:1") == "primary"
+    assert router.counters["primary_lag"] == 1
+    # до следующей проверки отставания реплику не трогаем
+    assert served_by("user:1") == "primary"
+    assert router.counters["primary_lag"] == 2
+    router.replica.lag = 0.0
+    clock.now += router.lag_check_interval
+    assert served_by("user:1") == "replica"
+    assert router.replica.in_use == 0
+
+
+def test_unavailable_replica_falls_back_to_primary(router):
+    router.replica.down = True
+    assert served_by("user:1") == "primary"
+    assert router.counters["primary_unavailable"] == 1
+
+
+def test_without_replica_reads_from_primary(monkeypatch, clock):
+    router = ReadRouter(FakePool("primary"))
+    monkeypatch.setattr(db, "READS", router)
+    assert served_by("user:1") == "primary"
+    assert router.counters["primary"] == 1
@@ -0,0 +1,103 @@
+import logging
+import subprocess
+
+import pytest
+
+from app import wgbackend
+from app.wgbackend import BATCH_CHUNK, FakeBackend, PeerBatch, SubprocessBackend, WGBackend
+
+
+class RecordingRun:
+    """Подмена run_cmd: запоминает команды, fail_calls — номера вызовов с ошибкой."""
+
+    def __init__(self, fail_calls=()):
+        self.cmds = []
+        self.fail_calls = set(fail_calls)
+
+    def __call__(self, cmd, input_text=None):
+        self.cmds.append(cmd)
+        code = 1 if len(self.cmds) - 1 in self.fail_calls else 0
+        return subprocess.CompletedProcess(cmd, code, stdout="", stderr="boom" if code else "")
+
+
+@pytest.fixture
+def run(monkeypatch):
+    recorder = RecordingRun()
+    monkeypatch.setattr(wgbackend, "run_cmd", recorder)
+    return recorder
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        WGBackend("wg0")
+
+
+def test_batch_applies_in_one_call():
+    backend = FakeBackend("wg0")
+    backend.apply([("old", "10.0.0.9/32")], [])
+    with backend.batch() as batch:
+        for i in range(10):
+            batch.set_peer(f"k{i}", f"10.0.0.{i + 2}/32")
+        batch.remove_peer("old")
+    assert backend.calls == 2
+    assert set(backend.peers) == {f"k{i}" for i in range(10)}
+    assert len(batch) == 0
+
+
+def test_batch_last_change_wins():
+    backend = FakeBackend("wg0")
+    batch = PeerBatch(backend)
+    batch.set_peer("a", "10.0.0.2/32")
+    batch.remove_peer("a")
+    batch.set_peer("b", "10.0.0.3/32")
+    batch.remove_peer("b")
+    batch.set_peer("b", "10.0.0.4/32")
+    assert batch.adds == {"b": "10.0.0.4/32"}
+    assert list(batch.removes) == ["a"]
+    assert batch.apply()
+    assert backend.peers == {"b": "10.0.0.4/32"}
+
+
+def test_empty_batch_skips_backend():
+    backend = FakeBackend("wg0")
+    assert PeerBatch(backend).apply()
+    assert backend.calls == 0
+
+
+def test_batch_not_applied_on_exception():
+    backend = FakeBackend("wg0")
+    with pytest.raises(RuntimeError):
+        with backend.batch() as batch:
+            batch.set_peer("a", "10.0.0.2/32")
+            raise RuntimeError
+    assert backend.calls == 0
+
+
+def test_subprocess_backend_chunks(run):
+    backend = SubprocessBackend("wg0")
+    adds = [(f"k{i}", "10.0.0.2/32, fd00::2/128") for i in range(BATCH_CHUNK + 1)]
+    removes = [f"r{i}" for i in range(BATCH_CHUNK)]
+    assert backend.apply(adds, removes)
+    assert len(run.cmds) == 3
+    assert all(cmd[:3] == ["wg", "set", "wg0"] for cmd in run.cmds)
+    assert [cmd.count("peer") for cmd in run.cmds] == [BATCH_CHUNK, BATCH_CHUNK, 1]
+    first = run.cmds[0]
+    assert first[3:7] == ["peer", "k0", "allowed-ips", "10.0.0.2/32,fd00::2/128"]
+    assert run.cmds[-1][-3:] == ["peer", f"r{BATCH_CHUNK - 1}", "remove"]
+
+
+def test_subprocess_backend_failed_chunk(run):
+    run.fail_calls = {0}
+    backend = SubprocessBackend("wg0")
+    adds = [(f"k{i}", "10.0.0.2/32") for i in range(BATCH_CHUNK * 2)]
+    assert not backend.apply(adds, [])
+    # остальные чанки всё равно отправлены
+    assert len(run.cmds) == 2
+
+
+def test_batch_logs_failed_apply(run, caplog):
+    run.fail_calls = {0}
+    with caplog.at_level(logging.ERROR, logger="securelink"):
+        with SubprocessBackend("wg0").batch() as batch:
+            batch.remove_peer("a")
+    assert any("wg peer batch on wg0 failed (1 changes)" in r.getMessage() for r in caplog.records)
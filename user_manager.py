@@ -5,13 +5,21 @@ import os
 import json
 import hashlib
 import hmac
+import secrets
 import time
+import threading
 import jwt
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
-from typing import Optional, Dict, Any, List
-from urllib.parse import parse_qs, unquote
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import parse_qsl
 import logging
 
+from app.replica import note_write, stick_local, STICKY_CHANNEL
+from services.activity import ActivityLog
+from services.subscriptions import ORDER_COLUMNS, describe
+
 logger = logging.getLogger("securelink")
 
 # JWT настройки
@@ -19,64 +27,312 @@ JWT_SECRET = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production"
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24 * 7  # 7 дней
 
+# Кеш проверенных сессий
+SESSION_CACHE_TTL = int(os.environ.get("SESSION_CACHE_TTL", 60))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 10000))
+# Сессий на пользователя (старые вытесняются при входе; 0 — без ограничения) и уборка истёкших
+MAX_SESSIONS_PER_USER = int(os.environ.get("MAX_SESSIONS_PER_USER", 10))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", 600))
+SESSION_SWEEP_BATCH = int(os.environ.get("SESSION_SWEEP_BATCH", 5000))
+# Каналы NOTIFY: отзыв сессии (sha256 токена) и изменение пользователя (триггер на users)
+SESSIONS_CHANNEL = "user_sessions_revoked"
+USERS_CHANNEL = "users_changed"
+
 # Telegram Bot настройки
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_WEBHOOK_URL = os.environ.get("TELEGRAM_WEBHOOK_URL")
+# initData старше этого не принимаются; столько же помнится hash для защиты от повтора
+TELEGRAM_AUTH_MAX_AGE = int(os.environ.get("TELEGRAM_AUTH_MAX_AGE", 86400))
+TELEGRAM_REPLAY_CACHE_SIZE = int(os.environ.get("TELEGRAM_REPLAY_CACHE_SIZE", 100000))
+
+# Сверх MAX_SESSIONS_PER_USER удаляются самые старые сессии пользователя. Новая
+# строка в том же операторе ещё не видна, поэтому пропускается max_sessions - 1;
+# отозванные хеши рассылаются в SESSIONS_CHANNEL для кешей всех воркеров.
+_EVICT_SESSIONS = """evicted AS (
+    DELETE FROM user_sessions WHERE %(max_sessions)s > 0 AND id IN (
+        SELECT s.id FROM user_sessions s JOIN session ON s.user_id = session.user_id
+        ORDER BY s.created_at DESC, s.id DESC
+        OFFSET GREATEST(%(max_sessions)s - 1, 0)
+    )
+    RETURNING token_hash
+)"""
+_NOTIFY_EVICTED = "(SELECT COUNT(pg_notify(%(revoked)s, encode(token_hash, 'hex'))) FROM evicted)"
+
+# Новая сессия (токен хранится только как sha256) с вытеснением лишних
+SESSION_SQL = f"""
+WITH session AS (
+    INSERT INTO user_sessions (user_id, token_hash, expires_at)
+    VALUES (%(user_id)s, %(token_hash)s, %(expires_at)s)
+    RETURNING user_id
+), {_EVICT_SESSIONS}
+SELECT {_NOTIFY_EVICTED}
+"""
+
+# Истёкшие сессии пачкой по idx_sessions_expires; параллельные уборщики делят строки
+SWEEP_SQL = """
+DELETE FROM user_sessions WHERE id IN (
+    SELECT id FROM user_sessions WHERE expires_at < NOW()
+    ORDER BY expires_at LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+"""
+
+# Вход через Telegram одним оператором: upsert пользователя и сессия (если id угадан заранее)
+LOGIN_SQL = f"""
+WITH u AS (
+    INSERT INTO users (telegram_id, username, first_name, last_name, language_code, last_login)
+    VALUES (%(telegram_id)s, %(username)s, %(first_name)s, %(last_name)s, %(language_code)s, NOW())
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        first_name = EXCLUDED.first_name,
+        last_name = EXCLUDED.last_name,
+        language_code = EXCLUDED.language_code,
+        last_login = EXCLUDED.last_login
+    RETURNING id, telegram_id, username, first_name, last_name, email,
+              language_code, created_at, last_login, is_active, settings
+), session AS (
+    INSERT INTO user_sessions (user_id, token_hash, expires_at)
+    SELECT id, %(token_hash)s, %(expires_at)s FROM u WHERE id = %(expected_id)s AND is_active
+    RETURNING user_id
+), {_EVICT_SESSIONS}
+SELECT u.*, EXISTS (SELECT 1 FROM session),
+       pg_notify(%(sticky)s, json_build_array('user:' || u.id)::text),
+       {_NOTIFY_EVICTED}
+FROM u
+"""
+
+def token_digest(token: str) -> bytes:
+    """sha256 токена — так сессия хранится в user_sessions.token_hash"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+def token_hash(token: str) -> str:
+    """Тот же sha256 в hex: ключ SessionCache и payload SESSIONS_CHANNEL"""
+    return token_digest(token).hex()
+
+
+@lru_cache(maxsize=8)
+def webapp_secret(bot_token: str) -> bytes:
+    """Ключ проверки initData: HMAC-SHA256("WebAppData", bot_token), один раз на токен бота"""
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+class ReplayGuard:
+    """
+    Ограниченный набор недавно предъявленных hash initData.
+    
+    Запись живёт до истечения auth_date + TELEGRAM_AUTH_MAX_AGE: позже
+    те же данные отклонит проверка возраста. Набор свой у каждого воркера,
+    поэтому повтор в другой воркер он не поймает — это защита от повторной
+    отправки перехваченного initData, а не замена срока годности.
+    """
+
+    def __init__(self, max_size: int = TELEGRAM_REPLAY_CACHE_SIZE):
+        self.max_size = max_size
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def first_seen(self, value: str, expires_at: float) -> bool:
+        now = time.time()
+        with self._lock:
+            while self._seen:
+                oldest = next(iter(self._seen.values()))
+                if oldest > now and len(self._seen) < self.max_size:
+                    break
+                self._seen.popitem(last=False)
+            if value in self._seen:
+                self.rejected += 1
+                return False
+            self._seen[value] = expires_at
+            return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+class TelegramIdCache:
+    """LRU telegram_id -> users.id: id известен до запроса, и JWT выписывается заранее"""
+
+    def __init__(self, max_size: int = SESSION_CACHE_SIZE):
+        self.max_size = max_size
+        self._ids: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int) -> Optional[int]:
+        with self._lock:
+            user_id = self._ids.get(telegram_id)
+            if user_id is not None:
+                self._ids.move_to_end(telegram_id)
+            return user_id
+
+    def put(self, telegram_id: int, user_id: int):
+        with self._lock:
+            self._ids[telegram_id] = user_id
+            self._ids.move_to_end(telegram_id)
+            while len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+
+
+class SessionCache:
+    """
+    Ограниченный LRU-кеш проверенных сессий с TTL, ключ — sha256 токена.
+
+    Запись живёт не дольше ttl и не дольше срока сессии. Отзыв сессии и
+    смена is_active сбрасывают записи во всех воркерах через LISTEN/NOTIFY
+    (см. UserManager.attach_listener); ttl ограничивает устаревание, если
+    уведомление всё же потерялось.
+    """
+
+    def __init__(self, ttl: float = SESSION_CACHE_TTL, max_size: int = SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, key: str, value: Dict[str, Any], expires_in: float):
+        if self.max_size <= 0:
+            return
+        deadline = time.monotonic() + max(0.0, min(self.ttl, expires_in))
+        with self._lock:
+            self._entries[key] = (deadline, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            keys = [k for k, (_, v) in self._entries.items() if v.get('user_id') == user_id]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
+
 
 class UserManager:
     """Класс для управления пользователями и авторизацией"""
     
-    def __init__(self, db_connection_func):
+    def __init__(self, db_connection_func, read_connection_func=None, subscriptions=None, activity_log=None):
         """
         Инициализация менеджера пользователей
         
         Args:
             db_connection_func: Функция для получения соединения с БД
+            read_connection_func: Read-only соединение (реплика), get_read_conn(*keys); по умолчанию — primary
+            subscriptions: Кеш заказов services.subscriptions.SubscriptionState (опционально)
+            activity_log: Буфер лога активности services.activity.ActivityLog; по умолчанию — запись сразу
         """
         self.get_conn = db_connection_func
+        self.get_read_conn = read_connection_func or (lambda *keys: db_connection_func())
+        self.subscriptions = subscriptions
+        self.activity_log = activity_log or ActivityLog(db_connection_func)
+        self.replay_guard = ReplayGuard()
+        self._telegram_ids = TelegramIdCache()
+        self.session_cache = SessionCache()
+        self._sweeper: Optional[threading.Thread] = None
+        self._sweeper_stop = threading.Event()
+
+    def attach_listener(self, listener):
+        """Подписка кеша сессий на уведомления Postgres (app.pgnotify.PGListener)"""
+        listener.subscribe(SESSIONS_CHANNEL, self.session_cache.invalidate)
+        listener.subscribe(USERS_CHANNEL, self._on_user_changed)
+        # пока LISTEN был отключён, уведомления могли пропасть
+        listener.on_reconnect(self.session_cache.clear)
+
+    def _on_user_changed(self, payload: str):
+        try:
+            self.session_cache.invalidate_user(int(json.loads(payload)['id']))
+        except (ValueError, KeyError, TypeError):
+            self.session_cache.clear()
     
-    def validate_telegram_data(self, init_data: str, bot_token: str) -> bool:
+    def verify_telegram_init_data(self, init_data: str, bot_token: str) -> Optional[Dict[str, Any]]:
         """
-        Валидация данных от Telegram Web App
+        Проверка initData Telegram Web App за один разбор строки
+        
+        data-check-string — все поля, кроме hash, по алфавиту через \\n;
+        секрет HMAC(WebAppData, bot_token) вычисляется один раз (webapp_secret).
+        Устаревшие (auth_date старше TELEGRAM_AUTH_MAX_AGE) и уже
+        предъявленные в этом процессе данные отклоняются.
         
         Args:
             init_data: Строка с данными от Telegram
             bot_token: Токен бота
             
         Returns:
-            bool: True если данные валидны
+            dict: Поля initData (user — уже dict) или None
         """
         try:
-            # Парсим данные
-            parsed_data = parse_qs(init_data)
-            
-            # Извлекаем hash
-            received_hash = parsed_data.get('hash', [None])[0]
+            fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+            received_hash = fields.pop('hash', None)
             if not received_hash:
-                return False
-            
-            # Удаляем hash из данных для проверки
-            data_check_string = init_data.replace(f'&hash={received_hash}', '').replace(f'hash={received_hash}&', '').replace(f'hash={received_hash}', '')
-            
-            # Создаем секретный ключ
-            secret_key = hmac.new(
-                "WebAppData".encode(),
-                bot_token.encode(),
-                hashlib.sha256
-            ).digest()
+                return None
             
-            # Вычисляем hash
+            data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
             calculated_hash = hmac.new(
-                secret_key,
+                webapp_secret(bot_token),
                 data_check_string.encode(),
                 hashlib.sha256
             ).hexdigest()
-            
-            return calculated_hash == received_hash
+            if not hmac.compare_digest(calculated_hash, received_hash):
+                return None
+            
+            auth_date = int(fields.get('auth_date', 0))
+            if time.time() - auth_date > TELEGRAM_AUTH_MAX_AGE:
+                logger.info("Устаревшие данные Telegram (auth_date=%s)", auth_date)
+                return None
+            # в набор попадают только подписанные hash — мусором его не вытеснить
+            if not self.replay_guard.first_seen(received_hash, auth_date + TELEGRAM_AUTH_MAX_AGE):
+                logger.warning("Повторное предъявление данных Telegram (auth_date=%s)", auth_date)
+                return None
+            
+            fields['hash'] = received_hash
+            fields['auth_date'] = auth_date
+            if 'user' in fields:
+                fields['user'] = json.loads(fields['user'])
+            return fields
             
         except Exception as e:
             logger.error(f"Ошибка валидации Telegram данных: {e}")
-            return False
+            return None
+
+    def validate_telegram_data(self, init_data: str, bot_token: str) -> bool:
+        """Совместимость: True, если initData подписаны ботом (см. verify_telegram_init_data)"""
+        return self.verify_telegram_init_data(init_data, bot_token) is not None
     
     def parse_telegram_user_data(self, init_data: str) -> Optional[Dict[str, Any]]:
         """
@@ -89,20 +345,112 @@ class UserManager:
             dict: Данные пользователя или None
         """
         try:
-            parsed_data = parse_qs(init_data)
-            user_data = parsed_data.get('user', [None])[0]
+            user_data = dict(parse_qsl(init_data)).get('user')
             
             if user_data:
-                return json.loads(unquote(user_data))
+                return json.loads(user_data)
             return None
             
         except Exception as e:
             logger.error(f"Ошибка парсинга данных пользователя: {e}")
             return None
-    
+
+    @staticmethod
+    def _user_from_row(row) -> Dict[str, Any]:
+        settings = row[10]
+        return {
+            'id': row[0],
+            'telegram_id': row[1],
+            'username': row[2],
+            'first_name': row[3],
+            'last_name': row[4],
+            'email': row[5],
+            'language_code': row[6],
+            'created_at': row[7].isoformat() if row[7] else None,
+            'last_login': row[8].isoformat() if row[8] else None,
+            'is_active': row[9],
+            # JSONB psycopg2 уже отдаёт dict
+            'settings': settings if isinstance(settings, dict) else json.loads(settings or '{}')
+        }
+
+    @staticmethod
+    def _login_params(telegram_user: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'telegram_id': telegram_user.get('id'),
+            'username': telegram_user.get('username'),
+            'first_name': telegram_user.get('first_name', ''),
+            'last_name': telegram_user.get('last_name', ''),
+            'language_code': telegram_user.get('language_code', 'ru'),
+            'sticky': STICKY_CHANNEL,
+            'revoked': SESSIONS_CHANNEL,
+            'max_sessions': MAX_SESSIONS_PER_USER,
+        }
+
+    @staticmethod
+    def _insert_session(cur, user_id: int, token: str, expires_at: datetime):
+        """Сессия по sha256 токена; самые старые сверх MAX_SESSIONS_PER_USER удаляются тем же оператором"""
+        cur.execute(SESSION_SQL, {
+            'user_id': user_id,
+            'token_hash': token_digest(token),
+            'expires_at': expires_at,
+            'max_sessions': MAX_SESSIONS_PER_USER,
+            'revoked': SESSIONS_CHANNEL,
+        })
+
+    def login_telegram(self, telegram_user: Dict[str, Any],
+                       additional_claims: Dict[str, Any] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Вход через Telegram: пользователь и сессия — одним оператором
+        
+        INSERT ... ON CONFLICT (telegram_id) DO UPDATE ... RETURNING создаёт или
+        обновляет пользователя, в том же WITH пишется сессия; запись о входе
+        уходит в буфер лога активности (activity_log).
+        JWT содержит user_id, поэтому токен выписывается заранее по id из
+        кеша telegram_id -> user_id; при промахе (новый пользователь или
+        первый вход в этом процессе) сессия добавляется вторым оператором в
+        той же транзакции.
+        
+        Args:
+            telegram_user: Данные пользователя из Telegram (initData.user)
+            additional_claims: Дополнительные claims для токена
+            
+        Returns:
+            tuple: (данные пользователя, JWT); (None, None) при ошибке,
+            (пользователь, None) — если пользователь заблокирован
+        """
+        params = self._login_params(telegram_user)
+        expected_id = self._telegram_ids.get(params['telegram_id'])
+        token = expires_at = None
+        if expected_id is not None:
+            token, expires_at = self._encode_token(expected_id, additional_claims)
+        try:
+            with self.get_conn() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(LOGIN_SQL, {
+                        **params, 'expected_id': expected_id, 'expires_at': expires_at,
+                        'token_hash': token and token_digest(token),
+                    })
+                    row = cur.fetchone()
+                    user_data = self._user_from_row(row)
+                    session_created = row[11]
+                    if not user_data['is_active']:
+                        return user_data, None
+                    if not session_created:
+                        token, expires_at = self._encode_token(user_data['id'], additional_claims)
+                        self._insert_session(cur, user_data['id'], token, expires_at)
+            self._telegram_ids.put(user_data['telegram_id'], user_data['id'])
+            # NOTIFY read_sticky шлёт LOGIN_SQL; свой процесс — сразу, дашборд придёт следом
+            stick_local(f"user:{user_data['id']}")
+            self.activity_log.log(user_data['id'], 'login', {'method': 'telegram'})
+            return user_data, token
+                    
+        except Exception as e:
+            logger.error(f"Ошибка входа через Telegram: {e}")
+            return None, None
+
     def get_or_create_telegram_user(self, telegram_user: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """
-        Получение или создание пользователя по данным Telegram
+        Получение или создание пользователя по данным Telegram (без сессии, см. login_telegram)
         
         Args:
             telegram_user: Данные пользователя из Telegram
@@ -111,82 +459,37 @@ class UserManager:
             dict: Данные пользователя из БД или None
         """
         try:
-            telegram_id = telegram_user.get('id')
-            username = telegram_user.get('username')
-            first_name = telegram_user.get('first_name', '')
-            last_name = telegram_user.get('last_name', '')
-            language_code = telegram_user.get('language_code', 'ru')
-            
             with self.get_conn() as conn:
                 with conn.cursor() as cur:
-                    # Ищем существующего пользователя
-                    cur.execute("""
-                        SELECT id, telegram_id, username, first_name, last_name, email, 
-                               language_code, created_at, last_login, is_active, settings
-                        FROM users 
-                        WHERE telegram_id = %s
-                    """, (telegram_id,))
-                    
-                    row = cur.fetchone()
-                    
-                    if row:
-                        # Обновляем данные существующего пользователя
-                        cur.execute("""
-                            UPDATE users 
-                            SET username = %s, first_name = %s, last_name = %s, 
-                                language_code = %s, last_login = %s
-                            WHERE telegram_id = %s
-                        """, (username, first_name, last_name, language_code, 
-                              datetime.now(timezone.utc), telegram_id))
-                        
-                        user_data = {
-                            'id': row[0],
-                            'telegram_id': row[1],
-                            'username': username,
-                            'first_name': first_name,
-                            'last_name': last_name,
-                            'email': row[5],
-                            'language_code': language_code,
-                            'created_at': row[7].isoformat() if row[7] else None,
-                            'last_login': datetime.now(timezone.utc).isoformat(),
-                            'is_active': row[9],
-                            'settings': json.loads(row[10]) if row[10] else {}
-                        }
-                    else:
-                        # Создаем нового пользователя
-                        cur.execute("""
-                            INSERT INTO users (telegram_id, username, first_name, last_name, language_code, last_login)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                            RETURNING id, created_at
-                        """, (telegram_id, username, first_name, last_name, language_code, 
-                              datetime.now(timezone.utc)))
-                        
-                        new_row = cur.fetchone()
-                        user_data = {
-                            'id': new_row[0],
-                            'telegram_id': telegram_id,
-                            'username': username,
-                            'first_name': first_name,
-                            'last_name': last_name,
-                            'email': None,
-                            'language_code': language_code,
-                            'created_at': new_row[1].isoformat(),
-                            'last_login': datetime.now(timezone.utc).isoformat(),
-                            'is_active': True,
-                            'settings': {}
-                        }
-                    
-                    # Логируем активность
-                    cur.execute("""
-                        SELECT log_user_activity(%s, %s, %s, %s, %s)
-                    """, (user_data['id'], 'login', json.dumps({'method': 'telegram'}), 
-                          None, None))  # IP и User-Agent можно добавить позже
-                    
-                    return user_data
+                    cur.execute(LOGIN_SQL, {
+                        **self._login_params(telegram_user), 'expected_id': None, 'token_hash': None, 'expires_at': None,
+                    })
+                    user_data = self._user_from_row(cur.fetchone())
+            self._telegram_ids.put(user_data['telegram_id'], user_data['id'])
+            return user_data
                     
         except Exception as e:
             logger.error(f"Ошибка создания/получения пользователя: {e}")
             return None
+
+    @staticmethod
+    def _encode_token(user_id: int, additional_claims: Dict[str, Any] = None) -> Tuple[str, datetime]:
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(hours=JWT_EXPIRATION_HOURS)
+        
+        payload = {
+            'user_id': user_id,
+            'iat': now,
+            'exp': expires_at,
+            'type': 'access_token',
+            # два входа за одну секунду иначе дали бы одинаковый токен (token_hash UNIQUE)
+            'jti': secrets.token_urlsafe(8),
+        }
+        
+        if additional_claims:
+            payload.update(additional_claims)
+        
+        return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM), expires_at
     
     def create_jwt_token(self, user_id: int, additional_claims: Dict[str, Any] = None) -> str:
         """
@@ -200,28 +503,14 @@ class UserManager:
             str: JWT токен
         """
         try:
-            now = datetime.now(timezone.utc)
-            expires_at = now + timedelta(hours=JWT_EXPIRATION_HOURS)
-            
-            payload = {
-                'user_id': user_id,
-                'iat': now,
-                'exp': expires_at,
-                'type': 'access_token'
-            }
-            
-            if additional_claims:
-                payload.update(additional_claims)
-            
-            token = jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+            token, expires_at = self._encode_token(user_id, additional_claims)
             
             # Сохраняем сессию в БД
             with self.get_conn() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        INSERT INTO user_sessions (user_id, session_token, expires_at)
-                        VALUES (%s, %s, %s)
-                    """, (user_id, token, expires_at))
+                    self._insert_session(cur, user_id, token, expires_at)
+                    # сразу после входа дашборд читает пользователя — с primary, а не с отстающей реплики
+                    note_write(cur, f"user:{user_id}")
             
             return token
             
@@ -233,12 +522,31 @@ class UserManager:
         """
         Валидация JWT токена
         
+        Подпись и срок проверяются до обращения к БД; проверенная сессия
+        кешируется (см. SessionCache), так что повторные запросы с тем же
+        токеном соединение из пула не занимают.
+        
         Args:
             token: JWT токен
             
         Returns:
             dict: Данные токена или None
         """
+        try:
+            # Декодируем JWT: поддельные и истёкшие токены отсекаются без БД
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            logger.info("JWT токен истек")
+            return None
+        except jwt.InvalidTokenError:
+            logger.info("Невалидный JWT токен")
+            return None
+
+        key = token_hash(token)
+        cached = self.session_cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
             # Проверяем токен в БД
             with self.get_conn() as conn:
@@ -247,8 +555,8 @@ class UserManager:
                         SELECT us.user_id, us.expires_at, u.is_active, u.username, u.first_name
                         FROM user_sessions us
                         JOIN users u ON us.user_id = u.id
-                        WHERE us.session_token = %s AND us.expires_at > %s
-                    """, (token, datetime.now(timezone.utc)))
+                        WHERE us.token_hash = %s AND us.expires_at > %s
+                    """, (bytes.fromhex(key), datetime.now(timezone.utc)))
                     
                     row = cur.fetchone()
                     if not row:
@@ -259,23 +567,16 @@ class UserManager:
                     if not is_active:
                         return None
                     
-                    # Декодируем JWT
-                    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-                    
-                    return {
-                        'user_id': user_id,
-                        'username': username,
-                        'first_name': first_name,
-                        'expires_at': expires_at.isoformat(),
-                        'payload': payload
-                    }
+            result = {
+                'user_id': user_id,
+                'username': username,
+                'first_name': first_name,
+                'expires_at': expires_at.isoformat(),
+                'payload': payload
+            }
+            self.session_cache.put(key, result, (expires_at - datetime.now(timezone.utc)).total_seconds())
+            return dict(result)
                     
-        except jwt.ExpiredSignatureError:
-            logger.info("JWT токен истек")
-            return None
-        except jwt.InvalidTokenError:
-            logger.info("Невалидный JWT токен")
-            return None
         except Exception as e:
             logger.error(f"Ошибка валидации JWT токена: {e}")
             return None
@@ -291,7 +592,7 @@ class UserManager:
             dict: Данные пользователя или None
         """
         try:
-            with self.get_conn() as conn:
+            with self.get_read_conn(f"user:{user_id}") as conn:
                 with conn.cursor() as cur:
                     cur.execute("""
                         SELECT id, telegram_id, username, first_name, last_name, email,
@@ -301,22 +602,7 @@ class UserManager:
                     """, (user_id,))
                     
                     row = cur.fetchone()
-                    if not row:
-                        return None
-                    
-                    return {
-                        'id': row[0],
-                        'telegram_id': row[1],
-                        'username': row[2],
-                        'first_name': row[3],
-                        'last_name': row[4],
-                        'email': row[5],
-                        'language_code': row[6],
-                        'created_at': row[7].isoformat() if row[7] else None,
-                        'last_login': row[8].isoformat() if row[8] else None,
-                        'is_active': row[9],
-                        'settings': json.loads(row[10]) if row[10] else {}
-                    }
+                    return self._user_from_row(row) if row else None
                     
         except Exception as e:
             logger.error(f"Ошибка получения пользователя: {e}")
@@ -333,52 +619,130 @@ class UserManager:
             list: Список подписок
         """
         try:
-            with self.get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT id, plan, price, status, created_at, expires_at, conf_file, public_key, client_ip
-                        FROM orders 
-                        WHERE user_id = %s 
-                        ORDER BY created_at DESC
-                    """, (user_id,))
-                    
-                    subscriptions = []
-                    for row in cur.fetchall():
-                        subscriptions.append({
-                            'id': row[0],
-                            'plan': row[1],
-                            'price': float(row[2]),
-                            'status': row[3],
-                            'created_at': row[4].isoformat() if row[4] else None,
-                            'expires_at': row[5].isoformat() if row[5] else None,
-                            'has_config': bool(row[6]),
-                            'public_key': row[7],
-                            'client_ip': row[8]
-                        })
-                    
-                    return subscriptions
+            if self.subscriptions is not None:
+                orders = self.subscriptions.for_user(user_id)
+            else:
+                orders = self._load_user_orders(user_id)
+            return [self.subscription_from_order(order) for order in orders]
                     
         except Exception as e:
             logger.error(f"Ошибка получения подписок: {e}")
             return []
+
+    @staticmethod
+    def subscription_from_order(order: Dict[str, Any]) -> Dict[str, Any]:
+        """Заказ (services.subscriptions.describe) в виде элемента /api/user/subscriptions"""
+        return {
+            'id': order['id'],
+            'plan': order['plan'],
+            'price': float(order['price']),
+            'status': order['status'],
+            'created_at': order['created_at'].isoformat() if order['created_at'] else None,
+            'expires_at': order['expires_at'].isoformat() if order['expires_at'] else None,
+            'is_expired': order['is_expired'],
+            'is_active': order['is_active'],
+            'has_config': bool(order['conf_file']),
+            'public_key': order['public_key'],
+            'client_ip': order['client_ip']
+        }
+
+    def get_dashboard(self, user_id: int, notifications=None, notifications_limit: int = 20) -> Optional[Dict[str, Any]]:
+        """
+        Всё для первой отрисовки личного кабинета в одном соединении
+        
+        Пользователь, его заказы (подписки и конфиги) и первая страница
+        уведомлений со счётчиком — четыре запроса по индексам, без кеша
+        заказов: все части ответа читаются с одного сервера.
+        
+        Args:
+            user_id: ID пользователя
+            notifications: services.notifications.NotificationService (опционально)
+            notifications_limit: Размер первой страницы уведомлений
+            
+        Returns:
+            dict: user, orders (describe) и notifications (page) или None, если пользователя нет
+        """
+        with self.get_read_conn(f"user:{user_id}") as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, telegram_id, username, first_name, last_name, email,
+                           language_code, created_at, last_login, is_active, settings
+                    FROM users 
+                    WHERE id = %s
+                """, (user_id,))
+                row = cur.fetchone()
+                if not row:
+                    return None
+                cur.execute(f"""
+                    SELECT {ORDER_COLUMNS}
+                    FROM orders 
+                    WHERE user_id = %s 
+                    ORDER BY created_at DESC
+                """, (user_id,))
+                fields = [d[0] for d in cur.description]
+                now = datetime.now(timezone.utc)
+                orders = [describe(dict(zip(fields, order)), now) for order in cur.fetchall()]
+                feed = notifications.read_page(cur, user_id, limit=notifications_limit) if notifications else None
+        return {'user': self._user_from_row(row), 'orders': orders, 'notifications': feed}
+
+    def _load_user_orders(self, user_id: int) -> List[Dict[str, Any]]:
+        """Заказы пользователя из БД в виде services.subscriptions.describe (без кеша)"""
+        with self.get_read_conn(f"user:{user_id}") as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT {ORDER_COLUMNS}
+                    FROM orders 
+                    WHERE user_id = %s 
+                    ORDER BY created_at DESC
+                """, (user_id,))
+                fields = [d[0] for d in cur.description]
+                return [describe(dict(zip(fields, row))) for row in cur.fetchall()]
     
-    def cleanup_expired_sessions(self) -> int:
+    def cleanup_expired_sessions(self, batch_size: int = SESSION_SWEEP_BATCH, max_batches: int = 100) -> int:
         """
         Очистка истекших сессий
         
+        Удаляет пачками по batch_size, каждая — отдельная короткая
+        транзакция, чтобы не держать блокировки и не раздувать WAL одним
+        огромным DELETE. Кеш сбрасывать не нужно: запись SessionCache живёт
+        не дольше срока сессии.
+        
+        Args:
+            batch_size: Строк за одну транзакцию
+            max_batches: Предел пачек за вызов (остальное — в следующий раз)
+            
         Returns:
             int: Количество удаленных сессий
         """
+        deleted = 0
         try:
-            with self.get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT cleanup_expired_sessions()")
-                    result = cur.fetchone()
-                    return result[0] if result else 0
-                    
+            for _ in range(max_batches):
+                with self.get_conn() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(SWEEP_SQL, (batch_size,))
+                        count = cur.rowcount
+                deleted += count
+                if count < batch_size:
+                    break
         except Exception as e:
             logger.error(f"Ошибка очистки сессий: {e}")
-            return 0
+        if deleted:
+            logger.info("Удалено истекших сессий: %s", deleted)
+        return deleted
+
+    def start_session_sweeper(self, interval: float = SESSION_SWEEP_INTERVAL) -> threading.Thread:
+        """Фоновая уборка истекших сессий раз в interval секунд"""
+        if self._sweeper is None:
+            def loop():
+                while not self._sweeper_stop.is_set():
+                    self.cleanup_expired_sessions()
+                    self._sweeper_stop.wait(interval)
+            self._sweeper = threading.Thread(target=loop, name="session-sweeper", daemon=True)
+            self._sweeper.start()
+        return self._sweeper
+
+    def stop_session_sweeper(self):
+        self._sweeper_stop.set()
     
     def revoke_user_session(self, token: str) -> bool:
         """
@@ -395,156 +759,15 @@ class UserManager:
                 with conn.cursor() as cur:
                     cur.execute("""
                         DELETE FROM user_sessions 
-                        WHERE session_token = %s
-                    """, (token,))
-                    
-                    return cur.rowcount > 0
+                        WHERE token_hash = %s
+                    """, (token_digest(token),))
+                    revoked = cur.rowcount > 0
+                    # Остальные воркеры сбросят кеш после COMMIT
+                    cur.execute("SELECT pg_notify(%s, %s)", (SESSIONS_CHANNEL, token_hash(token)))
+            
+            self.session_cache.invalidate(token_hash(token))
+            return revoked
                     
         except Exception as e:
             logger.error(f"Ошибка отзыва сессии: {e}")
             return False
-
-    def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict[str, Any]]:
-        """
-        Получение пользователя по Telegram ID (асинхронная версия)
-        
-        Args:
-            telegram_id: Telegram ID пользователя
-            
-        Returns:
-            Dict с данными пользователя или None
-        """
-        try:
-            conn = self.get_conn()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, telegram_id, username, first_name, last_name, 
-                       email, language_code, is_bot, is_premium, 
-                       allows_write_to_pm, photo_url, settings, 
-                       created_at, last_login
-                FROM users 
-                WHERE telegram_id = %s
-            """, (telegram_id,))
-            
-            result = cursor.fetchone()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'telegram_id': result[1],
-                    'username': result[2],
-                    'first_name': result[3],
-                    'last_name': result[4],
-                    'email': result[5],
-                    'language_code': result[6],
-                    'is_bot': result[7],
-                    'is_premium': result[8],
-                    'allows_write_to_pm': result[9],
-                    'photo_url': result[10],
-                    'settings': result[11],
-                    'created_at': result[12],
-                    'last_login': result[13]
-                }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error getting user by telegram_id: {e}")
-            return None
-        finally:
-            if 'conn' in locals():
-                conn.close()
-
-    def get_or_create_telegram_user(self, telegram_id: int, username: str = None, 
-                                        first_name: str = None, last_name: str = None,
-                                        language_code: str = None) -> Dict[str, Any]:
-        """
-        Получение или создание пользователя по Telegram данным (асинхронная версия)
-        
-        Args:
-            telegram_id: Telegram ID пользователя
-            username: Username пользователя
-            first_name: Имя пользователя
-            last_name: Фамилия пользователя
-            language_code: Код языка
-            
-        Returns:
-            Dict с данными пользователя
-        """
-        try:
-            # Сначала пытаемся найти существующего пользователя
-            user = self.get_user_by_telegram_id(telegram_id)
-            
-            if user:
-                # Обновляем last_login
-                self.update_user_last_login(user['id'])
-                return user
-            
-            # Создаем нового пользователя
-            conn = self.get_conn()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT INTO users (telegram_id, username, first_name, last_name, language_code, created_at, last_login)
-                VALUES (%s, %s, %s, %s, %s, NOW(), NOW())
-                RETURNING id, telegram_id, username, first_name, last_name, 
-                         email, language_code, is_bot, is_premium, 
-                         allows_write_to_pm, photo_url, settings, 
-                         created_at, last_login
-            """, (telegram_id, username, first_name, last_name, language_code))
-            
-            result = cursor.fetchone()
-            conn.commit()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'telegram_id': result[1],
-                    'username': result[2],
-                    'first_name': result[3],
-                    'last_name': result[4],
-                    'email': result[5],
-                    'language_code': result[6],
-                    'is_bot': result[7],
-                    'is_premium': result[8],
-                    'allows_write_to_pm': result[9],
-                    'photo_url': result[10],
-                    'settings': result[11],
-                    'created_at': result[12],
-                    'last_login': result[13]
-                }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error creating telegram user: {e}")
-            return None
-        finally:
-            if 'conn' in locals():
-                conn.close()
-
-    def update_user_last_login(self, user_id: int):
-        """
-        Обновление времени последнего входа (асинхронная версия)
-        
-        Args:
-            user_id: ID пользователя
-        """
-        try:
-            conn = self.get_conn()
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE users 
-                SET last_login = NOW() 
-                WHERE id = %s
-            """, (user_id,))
-            
-            conn.commit()
-            
-        except Exception as e:
-            logger.error(f"Error updating user last login: {e}")
-        finally:
-            if 'conn' in locals():
-                conn.close()